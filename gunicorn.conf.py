@@ -0,0 +1,24 @@
+"""
+Gunicorn configuration, loaded automatically from the working directory (see Procfile).
+
+Worker processes write Prometheus samples into a shared directory, so /metrics/
+returns values aggregated over all workers.
+"""
+import os
+import shutil
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/webshop_metrics')
+
+
+def on_starting(server):
+    """ Removes samples left by the previous run. """
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """ Keeps samples of the exited worker, but drops its live gauges. """
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
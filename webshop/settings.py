@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
 from pathlib import Path
+import dj_database_url
 import django_heroku
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +44,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'webshop_app.metrics.MetricsMiddleware',
+    'webshop_app.middleware.PerformanceMiddleware',
+    'webshop_app.edge.EdgeCacheMiddleware',
+    'webshop_app.routers.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -56,7 +62,7 @@ ROOT_URLCONF = 'webshop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'webshop_app.template_backend.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'webshop_app.context_processors.navigation',
             ],
         },
     },
@@ -86,6 +93,109 @@ DATABASES = {
     }
 }
 
+# Optional read replica. Reads go to the replica, writes and reads of clients who have written
+# something in the last REPLICA_PIN_SECONDS go to the primary (see webshop_app/routers.py).
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'], conn_max_age=600)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS = ['webshop_app.routers.PrimaryReplicaRouter']
+
+# Should be longer than the replication lag.
+REPLICA_PIN_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Catalog pages work with any backend, e.g. 'django.core.cache.backends.filebased.FileBasedCache'.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'webshop',
+    }
+}
+
+# Catalog pages are cached by reverse proxies (s-maxage) for EDGE_CACHE_SECONDS, see webshop_app/edge.py.
+# EDGE_CACHE_ENABLED=1 caches them in Django's cache as well, to measure the hit rate without a proxy.
+EDGE_CACHE_SECONDS = 60 * 5
+EDGE_CACHE_ENABLED = os.environ.get('EDGE_CACHE_ENABLED') == '1'
+EDGE_CACHE_ALIAS = 'default'
+
+# Lifetime (seconds) of cached category listings and product details.
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Number of products on a single category page.
+CATEGORY_PAGE_SIZE = 24
+
+# Number of orders & addresses on a single page of user's account.
+ACCOUNT_PAGE_SIZE = 20
+
+# Default & maximal number of rows on a single page of the JSON API (/api/v1/, see webshop_app/api.py).
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+
+
+# Number of rows fetched from the database at once by order exports.
+EXPORT_CHUNK_SIZE = 2000
+
+# Longest time (seconds) between creating an order and committing it. Incremental order exports &
+# recommendations look again for orders with lower ids than the processed ones during that time.
+ORDER_COMMIT_TIMEOUT = 60 * 5
+
+
+# Lifetime (seconds) of stock reservations made by adding products to the cart.
+# Expired reservations are returned to stock by `manage.py release_reservations`.
+CART_RESERVATION_TTL = 60 * 15
+
+
+# "Customers also bought" recommendations (manage.py build_recommendations).
+# The state file keeps co-occurrence of ordered products between incremental runs.
+RECOMMENDATIONS_STATE_FILE = os.environ.get('RECOMMENDATIONS_STATE_FILE', BASE_DIR / 'recommendations.npz')
+RECOMMENDATIONS_PER_PRODUCT = 10
+RECOMMENDATIONS_SHOWN = 4
+
+
+# Bestseller & trending lists of the homepage and category pages: length and cache lifetime (seconds).
+RANKINGS_SIZE = 8
+RANKINGS_CACHE_TIMEOUT = 60 * 10
+
+
+# Background jobs (manage.py run_jobs). Failed jobs are retried after JOB_RETRY_DELAY seconds, doubled
+# after every next failure up to JOB_MAX_RETRY_DELAY. Jobs running longer than JOB_TIMEOUT are run again.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 30
+JOB_MAX_RETRY_DELAY = 60 * 60
+JOB_TIMEOUT = 60 * 10
+
+
+# E-mail
+# https://docs.djangoproject.com/en/4.1/topics/email/
+# Locally e-mails are printed by the worker, set EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend
+# to keep them in EMAIL_FILE_PATH instead.
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', BASE_DIR / 'sent_emails')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'sklep@webshop.local')
+
+
+# Admin changelists of tables bigger than this take row count from planner statistics (PostgreSQL only).
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+# Performance instrumentation
+# Adds Server-Timing header & JSON log line (logger 'webshop_app.performance') to every response.
+
+PERFORMANCE_INSTRUMENTATION = os.environ.get('PERFORMANCE_INSTRUMENTATION') == '1'
+
+# Statements executed at least that many times in one request are logged as duplicates.
+PERFORMANCE_DUPLICATE_QUERY_THRESHOLD = 5
+
+# Prometheus metrics exposed at /metrics/. Multiple worker processes are aggregated
+# through PROMETHEUS_MULTIPROC_DIR environment variable (set by gunicorn.conf.py).
+# The endpoint is available to staff users and to scrapers sending "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -123,9 +233,24 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Product picture variants (see webshop_app/images.py), written next to uploaded pictures.
+# Variant names contain a hash of their content, so WhiteNoise can let browsers cache them forever
+# (like the hashed names of collected static files).
+PRODUCT_IMAGE_WIDTHS = [200, 400, 800, 1600]
+PRODUCT_IMAGE_VARIANTS_ROOT = BASE_DIR / 'staticfiles' / 'images' / 'variants'
+PRODUCT_IMAGE_VARIANTS_URL = STATIC_URL + 'images/variants/'
+WHITENOISE_IMMUTABLE_FILE_TEST = r'^/static/(images/variants/[0-9a-f]{16}-|.*\.[0-9a-f]{12}\.\w+$)'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 django_heroku.settings(locals())
+
+# django_heroku replaces LOGGING, so application loggers are added afterwards.
+LOGGING['loggers']['webshop_app'] = {  # noqa: F821
+    'handlers': ['console'],
+    'level': 'INFO',
+    'propagate': False,
+}
@@ -22,10 +22,11 @@ from webshop_app.views import \
     RegistrationView, \
     LogoutView, \
     LoggedView, \
-    CpuView, \
-    GpuView, \
-    MotherboardView, \
+    AddressListView, \
+    CategoryView, \
     ProductView, \
+    UserFragmentView, \
+    SearchView, \
     AddressView, \
     UpdateUserView, \
     ChangePasswordView, \
@@ -33,13 +34,18 @@ from webshop_app.views import \
     ChangeAddressView, \
     CartView, \
     OrderView, \
+    OrderExportView, \
     add_to_cart, \
     remove_from_cart, \
+    remove_from_anonymous_cart, \
     remove_comment
+from webshop_app.metrics import metrics_view
+from webshop_app import api
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name="metrics"),
     path('', HomeView.as_view(), name="base"),
     path('home/', HomeView.as_view(), name="home"),
     path('registration/', RegistrationView.as_view(), name="registration"),
@@ -48,16 +54,23 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name="login"),
     path('logout/', LogoutView.as_view(), name="logout"),
     path('logged/', LoggedView.as_view(), name="logged"),
+    path('addresses/', AddressListView.as_view(), name="addresses"),
     path('address/<int:address_id>/', AddressView.as_view(), name="address"),
     path('addaddress/', AddAddressView.as_view(), name="add-address"),
     path('changeaddress/<int:address_id>/', ChangeAddressView.as_view(), name="change-address"),
     path('cart/', CartView.as_view(), name="cart"),
     path('add-to-cart/<pk>/', add_to_cart, name="add-to-cart"),
     path('remove-from-cart/<cart_id>/', remove_from_cart, name="remove-from-cart"),
-    path('order/<order_id>/', OrderView.as_view(), name="order"),
-    path('category/cpu/', CpuView.as_view(), name="category-cpu"),
-    path('category/gpu/', GpuView.as_view(), name="category-gpu"),
-    path('category/motherboards/', MotherboardView.as_view(), name="category-motherboard"),
+    path('remove-from-anonymous-cart/<int:pk>/', remove_from_anonymous_cart, name="remove-from-anonymous-cart"),
+    path('order/<uuid:order_id>/', OrderView.as_view(), name="order"),
+    path('export/orders/', OrderExportView.as_view(), name="export-orders"),
+    path('category/<slug:slug>/', CategoryView.as_view(), name="category"),
     path('product/<int:pk>/', ProductView.as_view(), name="product"),
+    path('search/', SearchView.as_view(), name="search"),
+    path('fragments/user/', UserFragmentView.as_view(), name="user-fragment"),
     path('remove-comment/<comment_id>/<pk>/', remove_comment, name="remove-comment"),
+    path('api/v1/categories/', api.CategoryListView.as_view(), name="api-categories"),
+    path('api/v1/products/', api.ProductListView.as_view(), name="api-products"),
+    path('api/v1/products/<int:pk>/', api.ProductView.as_view(), name="api-product"),
+    path('api/v1/products/<int:pk>/comments/', api.CommentListView.as_view(), name="api-comments"),
 ]
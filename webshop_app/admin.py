@@ -1,35 +1,167 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-from .models import Address, Cart, Category, Comment, Order, Product, Profile
+from . import catalog, inventory, search
+from .models import Address, Cart, Category, Comment, Job, Order, OrderLine, Product, Profile
 
 
-class AddressAdmin(admin.ModelAdmin):
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator of unfiltered changelists, which on PostgreSQL takes number of rows of big tables
+    from planner statistics (pg_class.reltuples) instead of running COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            estimate = int(row[0]) if row else 0
+            if estimate >= getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000):
+                return estimate
+        return super().count
+
+
+class FastChangeListAdmin(admin.ModelAdmin):
+    """ Base admin of big tables. Skips the full COUNT(*) of the whole table & estimates counts. """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class AddressAdmin(FastChangeListAdmin):
     """ Modifies addresses toolbar in Django admin site. """
     list_display = ('profile', 'city', 'country')
+    list_select_related = ('profile__user',)
+    raw_id_fields = ('profile',)
+    search_fields = ('=profile__user__username',)
+
 
+class CategoryAdmin(admin.ModelAdmin):
+    """ Modifies categories toolbar in Django admin site. """
+    list_display = ('category', 'slug')
+    prepopulated_fields = {'slug': ('category',)}
 
-class ProductAdmin(admin.ModelAdmin):
-    """ Modifies products toolbar in Django admin site. """
-    list_display = ('product', 'category', 'price', 'available')
-    list_editable = ('available',)
 
+@admin.action(description='Oznacz jako niedostępne (zeruje stan magazynowy)')
+def mark_unavailable(modeladmin, request, queryset):
+    """
+    Clears stock of selected products with a single UPDATE, so they stay unavailable until restocked.
+    Items reserved in carts can still be ordered.
+    """
+    products = list(queryset.values_list('id', 'category_id'))
+    updated = Product.objects.filter(id__in=[product_id for product_id, category_id in products]).update(
+        stock=0, available=False, updated_at=timezone.now(),
+    )
+    # QuerySet.update() does not send signals.
+    catalog.invalidate_product_details([product_id for product_id, category_id in products])
+    for category_id in {category_id for product_id, category_id in products}:
+        catalog.invalidate_category(category_id)
+    catalog.invalidate_products()
+    modeladmin.message_user(
+        request, f'Oznaczono {updated} produktów jako niedostępne, ich stan magazynowy wyzerowano.', messages.SUCCESS,
+    )
 
-class CartAdmin(admin.ModelAdmin):
+
+class ProductAdmin(FastChangeListAdmin):
+    """ Modifies products toolbar in Django admin site. Search uses full-text index and exact SKU. """
+    list_display = ('product', 'sku', 'category', 'price', 'stock', 'available')
+    list_editable = ('stock',)
+    list_select_related = ('category',)
+    list_filter = ('category', 'available')
+    search_fields = ('=sku',)
+    search_help_text = 'Nazwa produktu (początki słów) lub dokładny SKU.'
+    actions = (mark_unavailable,)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        ids = [product['id'] for product in search.search_products(search_term, limit=1000)]
+        return queryset.filter(Q(sku=search_term) | Q(id__in=ids)), False
+
+
+class CartAdmin(FastChangeListAdmin):
     """ Modifies carts toolbar in Django admin site. """
-    list_display = ('product', 'quantity', 'user')
+    list_display = ('product', 'quantity', 'reserved', 'reserved_until', 'user')
     list_editable = ('quantity',)
+    readonly_fields = ('reserved', 'reserved_until')
+    list_select_related = ('product', 'user')
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('product',)
+    search_fields = ('=user__username',)
+
+    def delete_model(self, request, obj):
+        inventory.release_lines(Cart.objects.filter(id=obj.id))
+
+    def delete_queryset(self, request, queryset):
+        inventory.release_lines(queryset)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FastChangeListAdmin):
     """ Modifies comments toolbar in Django admin site. """
-    list_display = ('user', 'product')
+    list_display = ('user', 'product', 'text_date')
+    list_select_related = ('user', 'product')
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('product',)
+    search_fields = ('=user__username',)
+
+
+@admin.action(description='Uruchom ponownie')
+def retry_jobs(modeladmin, request, queryset):
+    """ Schedules selected jobs to run now. """
+    updated = queryset.update(status=Job.PENDING, run_at=timezone.now(), attempts=0)
+    modeladmin.message_user(request, f'Zaplanowano ponownie {updated} zadań.', messages.SUCCESS)
+
+
+class JobAdmin(FastChangeListAdmin):
+    """ Modifies background jobs toolbar in Django admin site. """
+    list_display = ('name', 'status', 'run_at', 'attempts', 'last_error')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at',)
+    actions = (retry_jobs,)
+
+
+class OrderLineInline(admin.TabularInline):
+    """ Order lines displayed on the order page. """
+    model = OrderLine
+    raw_id_fields = ('product',)
+    extra = 0
+
+
+class OrderAdmin(FastChangeListAdmin):
+    """ Modifies orders toolbar in Django admin site. """
+    list_display = ('order_id', 'user', 'order_date')
+    list_select_related = ('user',)
+    list_filter = ('order_date',)
+    raw_id_fields = ('user',)
+    exclude = ('cart',)
+    search_fields = ('=order_id', '=user__username')
+    inlines = (OrderLineInline,)
+
+
+class ProfileAdmin(FastChangeListAdmin):
+    """ Modifies profiles toolbar in Django admin site. """
+    list_display = ('user', 'birth_date')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
 
 
 admin.site.register(Address, AddressAdmin)
 admin.site.register(Cart, CartAdmin)
+admin.site.register(Category, CategoryAdmin)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(Order, OrderAdmin)
 admin.site.register(Product, ProductAdmin)
-
-admin.site.register(Category)
-admin.site.register(Profile)
-admin.site.register(Order)
+admin.site.register(Profile, ProfileAdmin)
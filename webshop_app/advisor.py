@@ -0,0 +1,220 @@
+"""
+Query plan advisor.
+
+Requests every benchmarked route once (with catalog cache disabled, so every query is executed),
+EXPLAINs the captured SELECT statements and reports sequential scans, sorts done without an index
+and statements repeated within a single request. For scanned tables it proposes indexes built
+from the equality conditions and ORDER BY of the statement, unless an existing index covers them.
+"""
+import json
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.apps import apps
+from django.db import connection, migrations, models, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.test.utils import override_settings
+
+from . import benchmark
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# Column compared with a value (not with another column, as in joins).
+_CONDITION = re.compile(r'"(?P<table>\w+)"\."(?P<column>\w+)" (?P<operator><=|>=|=|<|>|IN|IS) (?!")')
+_ORDER_BY = re.compile(r' ORDER BY (?P<columns>.+?)(?: LIMIT | OFFSET | FOR UPDATE|$)')
+_ORDER_COLUMN = re.compile(r'"(?P<table>\w+)"\."(?P<column>\w+)"(?P<descending> DESC)?')
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(?P<table>\w+)(?: AS \w+)?$')
+_SQLITE_SEARCH = re.compile(r'^(?:SCAN|SEARCH) (?:TABLE )?(?P<table>\w+)')
+
+
+@dataclass
+class Finding:
+    """ Problem found in a query plan. """
+    route: str
+    kind: str
+    table: str
+    sql: str
+    detail: str = ''
+
+
+@dataclass
+class Report:
+    findings: list = field(default_factory=list)
+    repeated: dict = field(default_factory=dict)
+    candidates: dict = field(default_factory=dict)
+    statements: int = 0
+
+
+def normalize(sql):
+    """ Replaces literals with placeholders, so statements differing only in parameters compare equal. """
+    return _LITERAL.sub('?', sql)
+
+
+def explain(sql):
+    """ Returns list of (kind, table, detail) of sequential scans and index-less sorts in the plan of `sql`. """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return list(_postgresql_problems(plan[0]['Plan']))
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return list(_sqlite_problems([row[-1] for row in cursor.fetchall()]))
+
+
+def _postgresql_problems(node):
+    if node['Node Type'] == 'Seq Scan':
+        buffers = node.get('Shared Hit Blocks', 0) + node.get('Shared Read Blocks', 0)
+        yield 'seq scan', node['Relation Name'], (
+            f"rows={node.get('Actual Rows')} removed={node.get('Rows Removed by Filter', 0)} "
+            f"buffers={buffers} filter={node.get('Filter', '')}"
+        )
+    if node['Node Type'] in ('Sort', 'Incremental Sort'):
+        yield 'sort', _first_relation(node), (
+            f"key={', '.join(node.get('Sort Key', []))} method={node.get('Sort Method')}"
+        )
+    for child in node.get('Plans', []):
+        yield from _postgresql_problems(child)
+
+
+def _first_relation(node):
+    if 'Relation Name' in node:
+        return node['Relation Name']
+    for child in node.get('Plans', []):
+        relation = _first_relation(child)
+        if relation:
+            return relation
+    return ''
+
+
+def _sqlite_problems(details):
+    for detail in details:
+        scan = _SQLITE_SCAN.match(detail)
+        if scan:
+            yield 'seq scan', scan.group('table'), detail
+        elif detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            searched = [_SQLITE_SEARCH.match(other) for other in details]
+            tables = [match.group('table') for match in searched if match]
+            yield 'sort', tables[0] if tables else '', detail
+
+
+def _models_by_table():
+    return {model._meta.db_table: model for model in apps.get_models()}
+
+
+def _existing_indexes(model):
+    """ Returns column tuples of indexes which exist on the model's table. """
+    meta = model._meta
+    indexes = []
+    for index in meta.indexes:
+        indexes.append(tuple(meta.get_field(name.lstrip('-')).column for name in index.fields))
+    for constraint in meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and constraint.fields:
+            indexes.append(tuple(meta.get_field(name).column for name in constraint.fields))
+    for fields in meta.unique_together:
+        indexes.append(tuple(meta.get_field(name).column for name in fields))
+    for model_field in meta.concrete_fields:
+        if model_field.primary_key or model_field.unique or model_field.db_index:
+            indexes.append((model_field.column,))
+    return indexes
+
+
+def candidate_index(sql, table):
+    """
+    Returns index (list of model field names, '-' marks descending) useful for `sql` on `table`:
+    columns compared for equality, then the first range condition, then ORDER BY columns. None if there are none.
+    """
+    equal, ranges, ordering = [], [], []
+    for condition in _CONDITION.finditer(sql):
+        if condition.group('table') != table:
+            continue
+        target = equal if condition.group('operator') in ('=', 'IN', 'IS') else ranges
+        if condition.group('column') not in equal + ranges:
+            target.append(condition.group('column'))
+    ranges = [column for column in ranges if column not in equal]
+    order_by = _ORDER_BY.search(sql)
+    if order_by:
+        for column in _ORDER_COLUMN.finditer(order_by.group('columns')):
+            if column.group('table') == table:
+                ordering.append(('-' if column.group('descending') else '') + column.group('column'))
+    columns = equal + ranges[:1] + [column for column in ordering if column.lstrip('-') not in equal + ranges[:1]]
+    return columns or None
+
+
+def _covered(columns, indexes):
+    plain = tuple(column.lstrip('-') for column in columns)
+    return any(index[:len(plain)] == plain for index in indexes)
+
+
+def _field_names(model, columns):
+    by_column = {model_field.column: model_field.name for model_field in model._meta.concrete_fields}
+    names = []
+    for column in columns:
+        name = by_column.get(column.lstrip('-'))
+        if name is None:
+            return None
+        names.append(('-' if column.startswith('-') else '') + name)
+    return names
+
+
+def analyze(user, routes=None):
+    """ Requests routes and returns `Report`. Changes made by the requests & fixtures are rolled back. """
+    report = Report()
+    models_by_table = _models_by_table()
+    explained = {}
+    with override_settings(CACHES=DUMMY_CACHES), transaction.atomic():
+        for route, url, queries, elapsed in benchmark.requests(user, routes):
+            repeated = Counter(normalize(query['sql']) for query in queries)
+            repeated = {sql: count for sql, count in repeated.items() if count > 1}
+            if repeated:
+                report.repeated[route.name] = repeated
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or 'FOR UPDATE' in sql:
+                    continue
+                report.statements += 1
+                key = normalize(sql)
+                if key not in explained:
+                    explained[key] = explain(sql)
+                for kind, table, detail in explained[key]:
+                    report.findings.append(Finding(route.name, kind, table, key, detail))
+                    model = models_by_table.get(table)
+                    columns = candidate_index(sql, table) if model else None
+                    if not columns or _covered(columns, _existing_indexes(model)):
+                        continue
+                    names = _field_names(model, columns)
+                    if names:
+                        report.candidates.setdefault((model._meta.model_name, tuple(names)), model)
+        transaction.set_rollback(True)
+    return report
+
+
+def candidate_migration(candidates, app_label='webshop_app'):
+    """ Returns (file name, source, operations) of migration adding candidate indexes to `app_label`. """
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    leaves = loader.graph.leaf_nodes(app_label)
+    operations = []
+    for (model_name, fields), model in sorted(candidates.items(), key=lambda item: item[0]):
+        if model._meta.app_label != app_label:
+            continue
+        index = models.Index(fields=list(fields), name='')
+        index.set_name_with_model(model)
+        operations.append(migrations.AddIndex(model_name=model_name, index=index))
+    migration = type('Migration', (migrations.Migration,), {
+        'dependencies': leaves,
+        'operations': operations,
+    })('advised_indexes', app_label)
+    number = int(leaves[0][1][:4]) + 1 if leaves else 1
+    return f'{number:04d}_advised_indexes.py', MigrationWriter(migration).as_string(), operations
+
+
+def group_findings(findings):
+    """ Returns {(kind, table): [findings]} sorted by number of findings. """
+    grouped = defaultdict(list)
+    for finding in findings:
+        grouped[(finding.kind, finding.table)].append(finding)
+    return dict(sorted(grouped.items(), key=lambda item: -len(item[1])))
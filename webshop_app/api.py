@@ -0,0 +1,220 @@
+"""
+Read-only JSON API (version 1) of the catalog: categories, products & comments.
+
+Lists are paginated by keyset cursors (see `pagination.py`): every response contains `next`,
+the url of the next page or null. `limit` sets the page size (API_PAGE_SIZE by default, up to
+API_MAX_PAGE_SIZE). `fields` selects returned fields, e.g. `?fields=id,product,price`. Only the
+selected columns are read - rows are fetched with `.values()`, so no model instances are built and
+unrequested columns (e.g. product descriptions) never leave the database.
+
+Responses are cacheable by proxies like catalog pages (see `edge.py`). Their ETags are built
+from catalog generation counters, so a client revalidating an unchanged resource gets
+304 Not Modified without a single query. Bodies are read from the replica, except right after
+a change of the catalog (`catalog.fresh()`), so a lagging replica never pairs a new ETag with stale data.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
+
+from . import catalog, edge
+from .models import Category, Comment, Product
+from .pagination import InvalidCursor, paginate
+
+
+class InvalidParameter(ValueError):
+    """ Query parameter has a wrong value. """
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def select(requested, fields, default=None):
+    """
+    Returns names of fields selected by comma separated `requested` names, `default` (all `fields`)
+    when nothing was requested. Raises InvalidParameter for unknown names.
+    """
+    if not requested:
+        return list(default or fields)
+    names = list(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+    unknown = [name for name in names if name not in fields]
+    if unknown or not names:
+        raise InvalidParameter(f'Unknown fields: {", ".join(unknown)}.')
+    return names
+
+
+def values(queryset, names, fields, *extra):
+    """
+    Returns `queryset.values()` reading only the fields `names` of `fields` ({name: ORM expression or None})
+    and `extra` model fields.
+    """
+    return queryset.values(
+        *(name for name in names if fields[name] is None),
+        *extra,
+        **{name: fields[name] for name in names if fields[name] is not None},
+    )
+
+
+def page_size(limit):
+    """ Returns page size requested by `limit` parameter. Raises InvalidParameter for wrong values. """
+    if not limit:
+        return settings.API_PAGE_SIZE
+    if not re.fullmatch('[0-9]+', limit) or not 0 < int(limit) <= settings.API_MAX_PAGE_SIZE:
+        raise InvalidParameter(f'Limit has to be a number from 1 to {settings.API_MAX_PAGE_SIZE}.')
+    return int(limit)
+
+
+def _etag(generation):
+    """ Returns `condition` ETag function of responses which change with `generation(**view kwargs)`. """
+    def etag_func(request, **kwargs):
+        return edge.etag(['v1', generation(**kwargs), request.get_full_path()])
+    return etag_func
+
+
+class ListView(View):
+    """
+    Paginated list of rows of `queryset()` sorted by one of `orderings` (`sort` parameter).
+    `fields` maps names of returned fields to ORM expressions (None for model fields of the same name).
+    """
+    fields = {}
+    default_fields = None
+    orderings = {}
+    default_sort = None
+
+    def queryset(self, request, **kwargs):
+        raise NotImplementedError
+
+    def get(self, request, **kwargs):
+        """ Returns page of rows as JSON with url of the next page. """
+        try:
+            names = select(request.GET.get('fields'), self.fields, self.default_fields)
+            limit = page_size(request.GET.get('limit'))
+            sort = request.GET.get('sort') or self.default_sort
+            if sort not in self.orderings:
+                raise InvalidParameter(f'Unknown sort: {sort}.')
+            queryset = self.queryset(request, **kwargs)
+        except InvalidParameter as error:
+            return _error(str(error))
+        ordering = self.orderings[sort]
+        # The cursor is made of sort key values, so they are read even when not requested.
+        hidden = [field.lstrip('-') for field in ordering if field.lstrip('-') not in names]
+        try:
+            page = paginate(
+                values(queryset, names, self.fields, *hidden),
+                ordering,
+                cursor=request.GET.get('cursor'),
+                page_size=limit,
+            )
+        except InvalidCursor:
+            return _error('Invalid cursor.')
+        results = page.items
+        if hidden:
+            results = [{name: row[name] for name in names} for row in results]
+        next_url = None
+        if page.has_next:
+            query = request.GET.copy()
+            query['cursor'] = page.next_cursor
+            next_url = f'{request.path}?{query.urlencode()}'
+        return JsonResponse({'results': results, 'next': next_url})
+
+
+CATEGORY_FIELDS = {
+    'id': None,
+    'category': None,
+    'slug': None,
+}
+
+PRODUCT_FIELDS = {
+    'id': None,
+    'category_id': None,
+    'sku': None,
+    'product': None,
+    'description': None,
+    'price': None,
+    'available': None,
+    'picture_variants': None,
+}
+
+COMMENT_FIELDS = {
+    'id': None,
+    'text': None,
+    'text_date': None,
+    'user_id': None,
+    'username': F('user__username'),
+}
+
+
+@method_decorator(edge.shared_page, name='get')
+@method_decorator(condition(etag_func=_etag(catalog.categories_generation)), name='get')
+@method_decorator(catalog.fresh(), name='get')
+class CategoryListView(ListView):
+    """ Categories sorted by name. """
+    fields = CATEGORY_FIELDS
+    orderings = {'name': ('category', 'id')}
+    default_sort = 'name'
+
+    def queryset(self, request):
+        return Category.objects.all()
+
+
+@method_decorator(edge.shared_page, name='get')
+@method_decorator(condition(etag_func=_etag(catalog.products_generation)), name='get')
+@method_decorator(catalog.fresh(), name='get')
+class ProductListView(ListView):
+    """
+    Products, optionally of a single category (`category` parameter with its id), sorted by id or
+    like category pages. Descriptions are returned only when requested by `fields`.
+    """
+    fields = PRODUCT_FIELDS
+    default_fields = [name for name in PRODUCT_FIELDS if name != 'description']
+    orderings = {'id': ('id',), **catalog.CATEGORY_SORTS}
+    default_sort = 'id'
+
+    def queryset(self, request):
+        products = Product.objects.all()
+        category = request.GET.get('category')
+        if category:
+            if not re.fullmatch('[0-9]+', category):
+                raise InvalidParameter('Category has to be an id.')
+            low, high = connections[products.db].ops.integer_field_ranges[Category._meta.pk.get_internal_type()]
+            if int(category) > high:
+                return products.none()
+            products = products.filter(category_id=category)
+        return products
+
+
+@method_decorator(edge.shared_page, name='get')
+@method_decorator(condition(etag_func=_etag(lambda pk: catalog.products_generation())), name='get')
+@method_decorator(catalog.fresh(), name='get')
+class ProductView(View):
+    """ Single product with all fields, unless `fields` selects some. """
+
+    def get(self, request, pk):
+        """ Returns the product as JSON. """
+        try:
+            names = select(request.GET.get('fields'), PRODUCT_FIELDS)
+        except InvalidParameter as error:
+            return _error(str(error))
+        product = values(Product.objects.filter(id=pk), names, PRODUCT_FIELDS).first()
+        if product is None:
+            return _error('Not found.', status=404)
+        return JsonResponse(product)
+
+
+@method_decorator(edge.shared_page, name='get')
+@method_decorator(condition(etag_func=_etag(lambda pk: catalog.comments_generation(pk))), name='get')
+@method_decorator(catalog.fresh(), name='get')
+class CommentListView(ListView):
+    """ Comments of a product, the newest first. """
+    fields = COMMENT_FIELDS
+    orderings = {'-date': ('-text_date', '-id')}
+    default_sort = '-date'
+
+    def queryset(self, request, pk):
+        return Comment.objects.filter(product_id=pk)
@@ -0,0 +1,190 @@
+"""
+Benchmark of every named route with query budgets.
+
+Routes are requested through Django's test client against the current database (fill it with
+`manage.py seed_catalog`). For each route latency percentiles and query counts are reported and
+the highest query count is compared with the route's budget.
+
+Some routes write (e.g. add to cart reserves stock), so the whole run happens in a transaction which
+is rolled back, and the cache is used under a separate key prefix.
+"""
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+from django.utils.functional import cached_property
+
+from .models import Address, Cart, Category, Comment, Order, Product
+
+
+@dataclass
+class Route:
+    """ Benchmarked url. `kwargs` builds url arguments from fixtures before every request. """
+    name: str
+    budget: int
+    login: bool = False
+    staff: bool = False
+    kwargs: Optional[Callable] = None
+    params: dict = field(default_factory=dict)
+
+
+@dataclass
+class Result:
+    route: Route
+    timings: list
+    queries: list
+
+    def percentile(self, percent):
+        """ Returns latency percentile in milliseconds. """
+        timings = sorted(self.timings)
+        index = min(len(timings) - 1, max(0, round(percent / 100 * len(timings)) - 1))
+        return timings[index] * 1000
+
+    @property
+    def p50(self):
+        return statistics.median(self.timings) * 1000
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def max_queries(self):
+        return max(self.queries)
+
+    @property
+    def over_budget(self):
+        return self.max_queries > self.route.budget
+
+
+class Fixtures:
+    """ Existing rows used to build urls. Rows created by benchmarked requests are created here as well. """
+
+    def __init__(self, user):
+        self.user = user
+        self.product = Product.objects.filter(available=True).order_by('id').first()
+        self.category = Category.objects.filter(product__isnull=False).order_by('id').first()
+        self.order = Order.objects.filter(user=user).order_by('-order_date').first()
+        if self.order is None:
+            self.order = Order.objects.create(user=user)
+        self.address = Address.objects.filter(profile__user=user).order_by('id').first()
+        if self.address is None:
+            self.address = Address.objects.create(profile=user.profile, name='Benchmark', city='Warszawa',
+                                                  address='ul. Prosta 1', zip_code='00-001')
+
+    @cached_property
+    def staff_user(self):
+        user, created = User.objects.get_or_create(username='benchmark_staff', defaults={'is_staff': True})
+        return user
+
+    def cart_line(self):
+        line, created = Cart.objects.get_or_create(user=self.user, product=self.product)
+        return {'cart_id': line.id}
+
+    def comment(self):
+        comment = Comment.objects.create(user=self.user, product=self.product, text='Benchmark')
+        return {'comment_id': comment.id, 'pk': self.product.id}
+
+
+# Budgets include session & user lookups (2 queries) of logged in requests and savepoint statements
+# of nested transactions (as executed inside test cases).
+ROUTES = [
+    Route('base', budget=3),
+    Route('home', budget=3),
+    Route('registration', budget=1),
+    Route('login', budget=1),
+    Route('logout', budget=1),
+    Route('metrics', budget=2, staff=True),
+    Route('search', budget=2, params={'q': 'pro'}),
+    Route('category', budget=5, kwargs=lambda f: {'slug': f.category.slug}),
+    Route('product', budget=3, kwargs=lambda f: {'pk': f.product.id}),
+    Route('user-fragment', budget=3, login=True),
+    Route('remove-from-anonymous-cart', budget=0, kwargs=lambda f: {'pk': f.product.id}),
+    Route('update-user', budget=3, login=True),
+    Route('change-password', budget=2, login=True),
+    Route('logged', budget=4, login=True),
+    Route('addresses', budget=3, login=True),
+    Route('address', budget=3, login=True, kwargs=lambda f: {'address_id': f.address.id}),
+    Route('add-address', budget=2, login=True),
+    Route('change-address', budget=3, login=True, kwargs=lambda f: {'address_id': f.address.id}),
+    Route('cart', budget=3, login=True),
+    Route('add-to-cart', budget=11, login=True, kwargs=lambda f: {'pk': f.product.id}),
+    Route('remove-from-cart', budget=10, login=True, kwargs=lambda f: f.cart_line()),
+    Route('order', budget=4, login=True, kwargs=lambda f: {'order_id': f.order.order_id}),
+    Route('remove-comment', budget=6, login=True, kwargs=lambda f: f.comment()),
+    Route('export-orders', budget=3, staff=True),
+    Route('api-categories', budget=1),
+    Route('api-products', budget=1),
+    Route('api-product', budget=1, kwargs=lambda f: {'pk': f.product.id}),
+    Route('api-comments', budget=1, kwargs=lambda f: {'pk': f.product.id}),
+]
+
+# Named urls which are not benchmarked.
+EXCLUDED = set()
+
+
+def missing_routes():
+    """ Returns names of urls without benchmark definition. """
+    names = {name for name in get_resolver().reverse_dict if isinstance(name, str)}
+    return names - {route.name for route in ROUTES} - EXCLUDED
+
+
+def requests(user, routes=None, iterations=1):
+    """
+    Requests every route `iterations` times. Yields (route, url, captured queries, seconds) per request.
+    """
+    fixtures = Fixtures(user)
+    anonymous = Client()
+    logged = Client()
+    with override_settings(ALLOWED_HOSTS=['*']):
+        for route in routes or ROUTES:
+            client = logged if route.login or route.staff else anonymous
+            for _ in range(iterations):
+                if route.staff:
+                    client.force_login(fixtures.staff_user)
+                elif route.login:
+                    client.force_login(user)
+                url = reverse(route.name, kwargs=route.kwargs(fixtures) if route.kwargs else None)
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(url, route.params)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - start
+                yield route, url, captured.captured_queries, elapsed
+
+
+def _isolated_caches():
+    """ Returns CACHES setting storing entries under separate keys, so none of them is seen by the shop. """
+    return {
+        alias: {**options, 'KEY_PREFIX': f'{options.get("KEY_PREFIX", "")}benchmark'}
+        for alias, options in settings.CACHES.items()
+    }
+
+
+def run(user, iterations=20, routes=None):
+    """
+    Requests every route `iterations` times and returns list of `Result`.
+    Changes made by the requests & fixtures are rolled back.
+    """
+    results = {}
+    with override_settings(CACHES=_isolated_caches()), transaction.atomic():
+        for route, url, queries, elapsed in requests(user, routes, iterations):
+            result = results.setdefault(route.name, Result(route, [], []))
+            result.timings.append(elapsed)
+            result.queries.append(len(queries))
+        transaction.set_rollback(True)
+    return list(results.values())
+
+
+def default_user():
+    """ Returns user with the most orders, so account pages are measured at their worst. """
+    return User.objects.filter(profile__isnull=False).annotate(orders=Count('order')).order_by('-orders', 'id').first()
@@ -0,0 +1,123 @@
+"""
+Cart operations shared by the views.
+
+Logged users keep their cart in the database. Anonymous visitors keep it in a signed cookie,
+{product id: quantity}, so browsing and filling the cart writes nothing to the database.
+The cookie cart is merged into the database cart on login.
+"""
+import json
+
+from django.core import signing
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from . import inventory
+from .models import Cart, Product
+
+# Highest quantity which can be added to the cart in a single request.
+MAX_QUANTITY = 99
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'webshop_app.cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Keeps the cookie well below 4 kB browser limit.
+MAX_COOKIE_LINES = 50
+
+
+def parse_quantity(value, default=1):
+    """ Returns quantity as int or None if it is not a number between 1 and MAX_QUANTITY. """
+    if value in (None, ''):
+        return default
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= quantity <= MAX_QUANTITY:
+        return None
+    return quantity
+
+
+def add_product(user_id, product_id, quantity=1):
+    """
+    Adds product to the user's cart or increases quantity of the existing cart line.
+    Added items are reserved in stock for CART_RESERVATION_TTL, InsufficientStock is raised when there are not enough.
+    Relies on the unique (user, product) constraint, so concurrent requests never create duplicated lines.
+    The cart line is written before the product row, the same lock order as in checkout and releases.
+    """
+    with transaction.atomic():
+        reserved_until = inventory.reservation_deadline()
+        lines = Cart.objects.filter(user_id=user_id, product_id=product_id)
+        increase = {
+            'quantity': F('quantity') + quantity,
+            'reserved': F('reserved') + quantity,
+            'reserved_until': reserved_until,
+        }
+        if not lines.update(**increase):
+            try:
+                with transaction.atomic():
+                    Cart.objects.create(
+                        user_id=user_id, product_id=product_id, quantity=quantity,
+                        reserved=quantity, reserved_until=reserved_until,
+                    )
+            except IntegrityError:
+                # Another request created the line in the meantime.
+                lines.update(**increase)
+        inventory.take({product_id: quantity})
+
+
+def remove_line(user_id, cart_id):
+    """ Removes line from the user's cart and returns its reservation to stock. """
+    if not inventory.release_lines(Cart.objects.filter(user_id=user_id, id=cart_id)):
+        raise Cart.DoesNotExist()
+
+
+def read_cookie(request):
+    """ Returns anonymous cart as {product id: quantity}. Missing, tampered or malformed cookie gives empty cart. """
+    try:
+        lines = json.loads(request.get_signed_cookie(COOKIE_NAME, default='{}', salt=COOKIE_SALT))
+        return {int(product_id): int(quantity) for product_id, quantity in lines.items() if int(quantity) > 0}
+    except (signing.BadSignature, ValueError, TypeError, AttributeError):
+        return {}
+
+
+def write_cookie(response, lines):
+    """ Stores anonymous cart in the response, empty cart removes the cookie. """
+    if not lines:
+        response.delete_cookie(COOKIE_NAME)
+        return
+    response.set_signed_cookie(
+        COOKIE_NAME, json.dumps(lines, separators=(',', ':')), salt=COOKIE_SALT,
+        max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+    )
+
+
+def add_to_cookie(lines, product_id, quantity):
+    """ Returns anonymous cart with added product, None when the cart is full. """
+    if product_id not in lines and len(lines) >= MAX_COOKIE_LINES:
+        return None
+    return {**lines, product_id: min(lines.get(product_id, 0) + quantity, MAX_QUANTITY)}
+
+
+def merge(user_id, lines):
+    """
+    Merges anonymous cart into the user's cart with a single upsert, quantities of products
+    present in both carts are summed. Merged items are not reserved, checkout takes them from stock.
+    """
+    products = sorted(Product.objects.filter(id__in=lines).values_list('id', flat=True))
+    if not products:
+        return
+    meta = Cart._meta
+    table = connection.ops.quote_name(meta.db_table)
+    user, product, quantity, reserved, reserved_until = (
+        connection.ops.quote_name(meta.get_field(name).column)
+        for name in ('user', 'product', 'quantity', 'reserved', 'reserved_until')
+    )
+    with connection.cursor() as cursor:
+        # The sum is computed by the database, so items added by a concurrent request are not overwritten.
+        cursor.execute(
+            f'INSERT INTO {table} ({user}, {product}, {quantity}, {reserved}, {reserved_until}) '
+            f'VALUES {", ".join(["(%s, %s, %s, 0, NULL)"] * len(products))} '
+            f'ON CONFLICT ({user}, {product}) '
+            f'DO UPDATE SET {quantity} = {table}.{quantity} + EXCLUDED.{quantity}',
+            [value for product_id in products for value in (user_id, product_id, lines[product_id])],
+        )
@@ -0,0 +1,298 @@
+"""
+Cached read layer for the catalog pages.
+
+Category listings and product details are stored in Django's cache framework and
+invalidated by the signals in `signals.py`. Every key is written with
+`CATALOG_SCHEMA_VERSION`, so a deploy which changes the shape of a payload never
+reads entries written by the previous release. Entries are read from the replica, except for
+REPLICA_PIN_SECONDS after any change of the catalog (`fresh()`), so a lagging replica never caches
+stale rows under the new generation.
+"""
+import contextlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import facets, rankings, routers
+from .models import Category, Comment, Product, ProductRecommendation
+from .pagination import paginate
+
+# Bump whenever the structure of a cached payload changes.
+CATALOG_SCHEMA_VERSION = 7
+
+CATEGORIES_GENERATION_KEY = 'catalog:categories:generation'
+PRODUCTS_GENERATION_KEY = 'catalog:products:generation'
+CHANGED_KEY = 'catalog:changed'
+
+# Category listing sort options. Each one is served by an index on (category, field, id).
+CATEGORY_SORTS = {
+    'name': ('product', 'id'),
+    '-name': ('-product', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+}
+
+
+def _timeout():
+    """ Returns cache timeout for catalog entries. """
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
+
+
+def _set(key, value):
+    cache.set(key, value, timeout=_timeout(), version=CATALOG_SCHEMA_VERSION)
+
+
+def _get(key):
+    return cache.get(key, version=CATALOG_SCHEMA_VERSION)
+
+
+def _generation(key):
+    """
+    Returns current generation counter stored under `key`.
+    Counter starts from the current time, so an evicted counter never brings back older entries.
+    """
+    generation = _get(key)
+    if generation is None:
+        generation = time.time_ns()
+        cache.add(key, generation, timeout=None, version=CATALOG_SCHEMA_VERSION)
+        generation = _get(key) or generation
+    return generation
+
+
+def _changed():
+    """ Remembers that the catalog has just changed, so the replica may lag behind it. """
+    cache.set(CHANGED_KEY, True, timeout=settings.REPLICA_PIN_SECONDS, version=CATALOG_SCHEMA_VERSION)
+
+
+@contextlib.contextmanager
+def fresh():
+    """
+    Sends reads inside the block to the primary when the catalog changed in the last REPLICA_PIN_SECONDS,
+    to the replica otherwise. Has to be entered after reading generation counters, which are bumped
+    only after `_changed()`.
+    """
+    if _get(CHANGED_KEY):
+        with routers.primary():
+            yield
+    else:
+        yield
+
+
+def _bump(key):
+    """ Moves generation counter forward, which orphans all entries built on the old one. """
+    _changed()
+    try:
+        cache.incr(key, version=CATALOG_SCHEMA_VERSION)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None, version=CATALOG_SCHEMA_VERSION)
+
+
+def _category_generation_key(category_id):
+    return f'catalog:category:{category_id}:generation'
+
+
+def _product_key(product_id):
+    return f'catalog:product:{product_id}'
+
+
+def _comments_generation_key(product_id):
+    return f'catalog:product:{product_id}:comments:generation'
+
+
+def categories_generation():
+    """ Returns counter which changes with every change of any category. """
+    return _generation(CATEGORIES_GENERATION_KEY)
+
+
+def products_generation():
+    """ Returns counter which changes with every change of any product or category shown in the catalog. """
+    return _generation(PRODUCTS_GENERATION_KEY)
+
+
+def comments_generation(product_id):
+    """ Returns counter which changes with every change of the product's comments. """
+    return _generation(_comments_generation_key(product_id))
+
+
+def categories():
+    """ Returns list of all categories as dictionaries. """
+    generation = _generation(CATEGORIES_GENERATION_KEY)
+    key = f'catalog:categories:{generation}'
+    result = _get(key)
+    if result is None:
+        with fresh():
+            result = list(Category.objects.order_by('category').values('id', 'category', 'slug'))
+        _set(key, result)
+    return result
+
+
+def navigation():
+    """
+    Returns categories with numbers of their products (`products`) and available products (`available`),
+    counted by a single aggregate query. Cached until any category or product changes.
+    """
+    generation = f'{_generation(CATEGORIES_GENERATION_KEY)}:{_generation(PRODUCTS_GENERATION_KEY)}'
+    key = f'catalog:navigation:{generation}'
+    result = _get(key)
+    if result is None:
+        with fresh():
+            result = list(
+                Category.objects
+                .annotate(products=Count('product'), available=Count('product', filter=Q(product__available=True)))
+                .order_by('category')
+                .values('id', 'category', 'slug', 'products', 'available')
+            )
+        _set(key, result)
+    return result
+
+
+def category_by_slug(slug):
+    """ Returns category with given slug or None. """
+    for category in categories():
+        if category['slug'] == slug:
+            return category
+    return None
+
+
+def category_by_id(category_id):
+    """ Returns category with given id or None. """
+    for category in categories():
+        if category['id'] == category_id:
+            return category
+    return None
+
+
+def category_page(category_id, sort, filters, cursor=None):
+    """
+    Returns `KeysetPage` of products in the category matching `filters`, sorted by one of `CATEGORY_SORTS`.
+    Raises InvalidCursor for malformed cursors.
+    """
+    ordering = CATEGORY_SORTS[sort]
+    generation = _generation(_category_generation_key(category_id))
+    key = f'catalog:category:{category_id}:{generation}:{sort}:{facets.signature(filters)}:{cursor or ""}'
+    page = _get(key)
+    if page is None:
+        with fresh():
+            page = paginate(
+                Product.objects
+                .filter(facets.filter_q(filters), category_id=category_id)
+                .values('id', 'product', 'price', 'available', 'picture_variants'),
+                ordering,
+                cursor=cursor,
+                page_size=getattr(settings, 'CATEGORY_PAGE_SIZE', 24),
+            )
+        _set(key, page)
+    return page
+
+
+def category_facets(category_id, filters):
+    """ Returns facet counts of the category page for given filters. """
+    generation = _generation(PRODUCTS_GENERATION_KEY)
+    key = f'catalog:facets:{generation}:{category_id}:{facets.signature(filters)}'
+    counts = _get(key)
+    if counts is None:
+        category_ids = [category['id'] for category in categories()]
+        with fresh():
+            counts = facets.count(category_id, category_ids, filters)
+        _set(key, counts)
+    return counts
+
+
+def product_detail(product_id):
+    """
+    Returns product details with its comments (newest first) & available recommended products
+    or None if product does not exist.
+    """
+    key = _product_key(product_id)
+    detail = _get(key)
+    if detail is None:
+        with fresh():
+            product = (
+                Product.objects
+                .filter(id=product_id)
+                .values(
+                    'id', 'category_id', 'product', 'description', 'price', 'available', 'picture_variants',
+                    'updated_at',
+                )
+                .first()
+            )
+            if product is None:
+                return None
+            comments = list(
+                Comment.objects
+                .filter(product_id=product_id)
+                .order_by('-text_date')
+                .values('id', 'text', 'text_date', 'user_id', 'user__username')
+            )
+            recommendations = list(
+                ProductRecommendation.objects
+                .filter(product_id=product_id, recommended__available=True)
+                .order_by('rank')
+                .values(
+                    'recommended_id', 'recommended__product', 'recommended__price',
+                )[:settings.RECOMMENDATIONS_SHOWN]
+            )
+            detail = {
+                'product': product,
+                'comments': comments,
+                'recommendations': recommendations,
+            }
+        _set(key, detail)
+    return detail
+
+
+def popular_products(category_id=None):
+    """
+    Returns {ranking kind: list of products} of `rankings.RANKINGS` for all products or one category.
+    Rankings are rebuilt after RANKINGS_CACHE_TIMEOUT, the next day or when any product changes.
+    """
+    today = timezone.localdate()
+    generation = _generation(PRODUCTS_GENERATION_KEY)
+    key = f'catalog:popular:{category_id or "all"}:{today.isoformat()}:{generation}'
+    result = _get(key)
+    if result is None:
+        with fresh():
+            result = {
+                kind: rankings.top(kind, category_id, limit=settings.RANKINGS_SIZE, today=today)
+                for kind in rankings.RANKINGS
+            }
+        cache.set(key, result, timeout=settings.RANKINGS_CACHE_TIMEOUT, version=CATALOG_SCHEMA_VERSION)
+    return result
+
+
+def invalidate_category(category_id):
+    """ Drops cached listings of the category. """
+    if category_id is not None:
+        _bump(_category_generation_key(category_id))
+
+
+def invalidate_categories():
+    """ Drops cached list of categories. """
+    _bump(CATEGORIES_GENERATION_KEY)
+
+
+def invalidate_products():
+    """ Drops cached data computed over products of all categories, e.g. facet counts & navigation. """
+    _bump(PRODUCTS_GENERATION_KEY)
+
+
+def invalidate_product(product_id):
+    """ Drops cached details of the product. """
+    if product_id is not None:
+        _changed()
+        cache.delete(_product_key(product_id), version=CATALOG_SCHEMA_VERSION)
+
+
+def invalidate_comments(product_id):
+    """ Marks comments of the product as changed. """
+    if product_id is not None:
+        _bump(_comments_generation_key(product_id))
+
+
+def invalidate_product_details(product_ids):
+    """ Drops cached details of many products at once, e.g. after bulk updates which do not send signals. """
+    _changed()
+    cache.delete_many([_product_key(product_id) for product_id in product_ids], version=CATALOG_SCHEMA_VERSION)
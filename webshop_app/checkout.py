@@ -0,0 +1,88 @@
+"""
+Checkout pipeline. Turns user's cart into an order in a single transaction.
+"""
+from django.db import IntegrityError, transaction
+
+from . import inventory, jobs
+from .metrics import CHECKOUTS
+from .models import Cart, Order, OrderLine, Product
+
+
+class CheckoutError(Exception):
+    """ Order could not be placed. """
+
+
+class EmptyCartError(CheckoutError):
+    """ There is nothing to order. """
+
+
+class UnavailableProductsError(CheckoutError):
+    """ Stock of some products in the cart is too low. """
+
+    def __init__(self, products):
+        super().__init__(', '.join(products))
+        self.products = products
+
+
+def place_order(user, idempotency_key=None):
+    """
+    Creates order from the user's cart and clears the cart.
+
+    Items reserved by cart lines are already taken from stock, only the rest (after expired reservation
+    or quantity change) is taken here with a conditional UPDATE, see the inventory module.
+    Cart lines are locked in primary key order, so concurrent checkouts never deadlock.
+    Sales statistics & confirmation e-mail are left to background jobs.
+    Number of queries does not depend on the number of cart lines.
+    Repeated call with the same `idempotency_key` returns the order created by the first call.
+    """
+    if idempotency_key is not None:
+        existing = Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+        if existing is not None:
+            CHECKOUTS.labels('duplicate').inc()
+            return existing
+    try:
+        with transaction.atomic():
+            lines = list(
+                Cart.objects
+                .select_for_update()
+                .filter(user=user)
+                .order_by('id')
+                .values('id', 'product_id', 'quantity', 'reserved')
+            )
+            if not lines:
+                CHECKOUTS.labels('empty').inc()
+                raise EmptyCartError()
+
+            products = Product.objects.filter(
+                id__in=[line['product_id'] for line in lines],
+            ).only('id', 'product', 'price')
+            products = {product.id: product for product in products}
+
+            try:
+                inventory.take({line['product_id']: line['quantity'] - line['reserved'] for line in lines})
+            except inventory.InsufficientStock as error:
+                CHECKOUTS.labels('unavailable').inc()
+                raise UnavailableProductsError([products[product_id].product for product_id in error.product_ids])
+
+            order = Order.objects.create(user=user, idempotency_key=idempotency_key)
+            OrderLine.objects.bulk_create([
+                OrderLine(
+                    order=order,
+                    product_id=line['product_id'],
+                    product_name=products[line['product_id']].product,
+                    price=products[line['product_id']].price,
+                    quantity=line['quantity'],
+                )
+                for line in lines
+            ])
+            jobs.enqueue('record_sales', order_id=order.id)
+            jobs.enqueue('send_order_confirmation', order_id=order.id)
+            Cart.objects.filter(id__in=[line['id'] for line in lines]).delete()
+    except IntegrityError:
+        # Concurrent request with the same idempotency key has already placed the order.
+        if idempotency_key is None:
+            raise
+        CHECKOUTS.labels('duplicate').inc()
+        return Order.objects.get(user=user, idempotency_key=idempotency_key)
+    CHECKOUTS.labels('placed').inc()
+    return order
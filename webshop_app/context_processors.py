@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import catalog
+
+
+def navigation(request):
+    """ Adds categories of the navigation bar. Read from the cache only by pages which display them. """
+    return {
+        'navigation_categories': SimpleLazyObject(catalog.navigation),
+    }
@@ -0,0 +1,90 @@
+"""
+Caching of shared pages by reverse proxies (CDN, Varnish, nginx).
+
+Catalog pages (`shared_page` views) contain nothing user specific, the navigation links, messages,
+comment form & CSRF token of the user are loaded by the page from `UserFragmentView`. They are sent
+with `Cache-Control: public, max-age=0, s-maxage=EDGE_CACHE_SECONDS`, so proxies keep them and
+browsers revalidate them with ETag / Last-Modified. Shared views must not touch the session, which
+would add `Vary: Cookie` and make every visitor's copy different.
+
+`EdgeCacheMiddleware` plays such a proxy inside Django (EDGE_CACHE_ENABLED), e.g. to measure the
+hit rate locally: hits & misses are counted by the `webshop_edge_cache_requests_total` metric.
+"""
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import get_cache_key, get_conditional_response, learn_cache_key, patch_cache_control, \
+    patch_vary_headers
+
+from .metrics import EDGE_CACHE
+
+KEY_PREFIX = 'edge'
+
+
+def shared_page(view):
+    """ Marks responses of the view (incl. 304 Not Modified) as cacheable by shared caches. """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=0, s_maxage=settings.EDGE_CACHE_SECONDS)
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    return wrapper
+
+
+def etag(data):
+    """ Returns ETag of a page built from JSON serializable `data`. """
+    return hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _shared_max_age(response):
+    """ Returns s-maxage of response cacheable by shared caches, None otherwise. """
+    directives = {}
+    for directive in response.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value
+    if 'public' not in directives or 'private' in directives or 'no-store' in directives:
+        return None
+    try:
+        return int(directives.get('s-maxage', ''))
+    except ValueError:
+        return None
+
+
+class EdgeCacheMiddleware:
+    """
+    Serves shared pages from the cache like a caching reverse proxy, keyed by url & `Vary` headers.
+    Responses setting cookies are never stored. Not used unless EDGE_CACHE_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.EDGE_CACHE_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.cache = caches[settings.EDGE_CACHE_ALIAS]
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return self.get_response(request)
+        key = get_cache_key(request, KEY_PREFIX, 'GET', cache=self.cache)
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            EDGE_CACHE.labels('hit').inc()
+            cached['X-Cache'] = 'HIT'
+            # Proxies answer conditional requests of cached pages themselves.
+            return get_conditional_response(
+                request, etag=cached.get('ETag'), last_modified=None, response=cached,
+            )
+
+        response = self.get_response(request)
+        timeout = _shared_max_age(response)
+        if timeout and response.status_code == 200 and not response.streaming and not response.cookies:
+            EDGE_CACHE.labels('miss').inc()
+            response['X-Cache'] = 'MISS'
+            self.cache.set(learn_cache_key(request, response, timeout, KEY_PREFIX, cache=self.cache), response, timeout)
+        return response
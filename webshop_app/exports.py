@@ -0,0 +1,180 @@
+"""
+Streaming export of order lines.
+
+Rows are read with `QuerySet.iterator()`, which uses server-side cursors on PostgreSQL, and are
+written out as they arrive, so memory use does not depend on the number of orders.
+
+Incremental exports (and recommendations) remember processed orders with `OrderWatermark`.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ExportCheckpoint, OrderLine
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+COLUMNS = (
+    ('order_id', 'order__order_id'),
+    ('order_date', 'order__order_date'),
+    ('username', 'order__user__username'),
+    ('email', 'order__user__email'),
+    ('product_id', 'product_id'),
+    ('product', 'product_name'),
+    ('price', 'price'),
+    ('quantity', 'quantity'),
+)
+
+
+class InvalidExportParameter(ValueError):
+    """ Export filter could not be parsed. """
+
+
+# Checkpoints of other incremental order consumers (e.g. recommendations), not available to exports.
+RESERVED_CHECKPOINT_PREFIX = 'internal:'
+
+
+def parse_moment(value, end_of_day=False):
+    """ Parses date or datetime given as ISO string. Dates mean start (or end) of the day. """
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        moment = datetime.combine(day, time.max if end_of_day else time.min) if day else parse_datetime(value)
+    except ValueError:
+        raise InvalidExportParameter(value)
+    if moment is None:
+        raise InvalidExportParameter(value)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class OrderWatermark:
+    """
+    Orders already processed by the named incremental consumer (ExportCheckpoint `name`).
+
+    Order ids are assigned at INSERT, but transactions commit in any order, so an order with a lower
+    id than the last processed one may still appear. Missing ids below the last processed order are
+    kept in `pending_order_ids` and looked for again until ORDER_COMMIT_TIMEOUT has passed since they
+    were first missed. Checkout creates an order & commits it within that time after its order_date,
+    so gaps before orders older than twice the timeout are never waited for.
+    """
+
+    def __init__(self, name, reset=False):
+        self.checkpoint, created = ExportCheckpoint.objects.get_or_create(name=name)
+        self.started = timezone.now()
+        self.last_order_id = 0 if reset else self.checkpoint.last_order_id
+        self.pending = {} if reset else {order_id: missing_since for order_id, missing_since in
+                                         self.checkpoint.pending_order_ids}
+        self._previous = self.last_order_id
+
+    def filter(self, lines):
+        """ Returns OrderLine queryset limited to orders which have not been processed yet. """
+        condition = Q(order_id__gt=self.last_order_id)
+        if self.pending:
+            condition |= Q(order_id__in=list(self.pending))
+        return lines.filter(condition)
+
+    def add(self, order_id, order_date):
+        """ Marks the order as processed. Orders above the last processed one must come by ascending id. """
+        if order_id in self.pending:
+            del self.pending[order_id]
+            return
+        if order_id <= self._previous:
+            return
+        timeout = timedelta(seconds=settings.ORDER_COMMIT_TIMEOUT)
+        if order_date > self.started - 2 * timeout:
+            # Lower ids were assigned before this order's, their transactions may still be open.
+            for missing in range(self._previous + 1, order_id):
+                self.pending[missing] = self.started.timestamp()
+        self._previous = self.last_order_id = order_id
+
+    def save(self):
+        """ Stores processed orders. Missing ids this run could not have missed anymore are dropped. """
+        expired = self.started.timestamp() - settings.ORDER_COMMIT_TIMEOUT
+        self.checkpoint.last_order_id = self.last_order_id
+        self.checkpoint.pending_order_ids = sorted(
+            [order_id, missing_since] for order_id, missing_since in self.pending.items() if missing_since > expired
+        )
+        self.checkpoint.save(update_fields=['last_order_id', 'pending_order_ids', 'exported_at'])
+
+
+class OrderExport:
+    """
+    Export of order lines placed between `since` and `until`.
+    Named incremental export (`checkpoint`) includes only orders placed after its previous run
+    and moves the checkpoint forward once all rows have been written.
+    """
+
+    def __init__(self, since=None, until=None, checkpoint=None):
+        if checkpoint and checkpoint.startswith(RESERVED_CHECKPOINT_PREFIX):
+            raise InvalidExportParameter(checkpoint)
+        self.since = since
+        self.until = until
+        self.checkpoint = checkpoint
+        self.watermark = None
+
+    def queryset(self):
+        lines = OrderLine.objects.all()
+        if self.since:
+            lines = lines.filter(order__order_date__gte=self.since)
+        if self.until:
+            lines = lines.filter(order__order_date__lte=self.until)
+        if self.checkpoint:
+            self.watermark = OrderWatermark(self.checkpoint)
+            lines = self.watermark.filter(lines)
+        return lines.order_by('order_id', 'id').values_list('order_id', *(lookup for name, lookup in COLUMNS))
+
+    def rows(self):
+        """ Yields rows as dictionaries. """
+        chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+        for order_pk, *values in self.queryset().iterator(chunk_size=chunk_size):
+            row = dict(zip((name for name, lookup in COLUMNS), values))
+            if self.watermark:
+                self.watermark.add(order_pk, row['order_date'])
+            yield row
+        if self.watermark:
+            self.watermark.save()
+
+    def csv_lines(self):
+        """ Yields CSV lines, starting with the header. """
+        buffer = _Echo()
+        writer = csv.writer(buffer)
+        yield writer.writerow([name for name, lookup in COLUMNS])
+        for row in self.rows():
+            yield writer.writerow([_text(value) for value in row.values()])
+
+    def jsonl_lines(self):
+        """ Yields JSON lines. """
+        for row in self.rows():
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+    def lines(self, export_format):
+        if export_format == 'csv':
+            return self.csv_lines()
+        return self.jsonl_lines()
+
+
+class _Echo:
+    """ File-like object returning written value, lets csv.writer produce lines one by one. """
+
+    def write(self, value):
+        return value
+
+
+def _text(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None:
+        return ''
+    return str(value)
@@ -0,0 +1,126 @@
+"""
+Category page filters and facet counts.
+
+Every facet count excludes its own filter (e.g. price range counts ignore selected price
+range), so visitors always see how many products they get after changing one filter.
+All counts are computed by a single conditional aggregation query.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Q
+from django.utils.http import urlencode
+
+from .models import Product
+
+# (key, label, lowest price, highest price - exclusive)
+PRICE_RANGES = [
+    ('0-500', 'do 500 PLN', None, Decimal('500')),
+    ('500-1000', '500–1000 PLN', Decimal('500'), Decimal('1000')),
+    ('1000-2000', '1000–2000 PLN', Decimal('1000'), Decimal('2000')),
+    ('2000-', 'od 2000 PLN', Decimal('2000'), None),
+]
+
+
+def parse_filters(params):
+    """ Returns filters selected in query parameters. Unknown values are ignored. """
+    price = params.get('price')
+    if price not in {key for key, *_ in PRICE_RANGES}:
+        price = None
+    return {
+        'price': price,
+        'available': params.get('available') == '1',
+    }
+
+
+def signature(filters):
+    """ Returns filters as a canonical query string, used in urls and cache keys. """
+    params = {}
+    if filters['price']:
+        params['price'] = filters['price']
+    if filters['available']:
+        params['available'] = '1'
+    return urlencode(sorted(params.items()))
+
+
+def _price_q(key):
+    for range_key, label, low, high in PRICE_RANGES:
+        if range_key == key:
+            condition = Q()
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            return condition
+    return Q()
+
+
+def filter_q(filters):
+    """ Returns condition selecting products matching the filters. """
+    condition = _price_q(filters['price'])
+    if filters['available']:
+        condition &= Q(available=True)
+    return condition
+
+
+def count(category_id, category_ids, filters):
+    """
+    Returns facet counts for the category page:
+    {'total': n, 'categories': {id: n}, 'prices': {key: n}, 'available': n}
+    """
+    in_category = Q(category_id=category_id)
+    price = _price_q(filters['price'])
+    available = Q(available=True) if filters['available'] else Q()
+
+    aggregates = {'total': Count('id', filter=in_category & price & available)}
+    for other_id in category_ids:
+        aggregates[f'category_{other_id}'] = Count('id', filter=Q(category_id=other_id) & price & available)
+    for key, *_ in PRICE_RANGES:
+        aggregates[f'price_{key}'] = Count('id', filter=in_category & _price_q(key) & available)
+    aggregates['available'] = Count('id', filter=in_category & price & Q(available=True))
+
+    products = Product.objects.all()
+    if price & available:
+        # Rows outside the category matter only for category counts, which use price & availability filters.
+        products = products.filter((price & available) | in_category)
+    result = products.aggregate(**aggregates)
+    return {
+        'total': result['total'],
+        'categories': {other_id: result[f'category_{other_id}'] for other_id in category_ids},
+        'prices': {key: result[f'price_{key}'] for key, *_ in PRICE_RANGES},
+        'available': result['available'],
+    }
+
+
+def _url(path, filters, **changes):
+    query = signature({**filters, **changes})
+    return f'{path}?{query}' if query else path
+
+
+def build(category, categories, filters, counts):
+    """ Returns facets ready to be displayed: labels, counts and urls toggling each filter. """
+    path = f"/category/{category['slug']}/"
+    return {
+        'categories': [
+            {
+                'category': other['category'],
+                'count': counts['categories'].get(other['id'], 0),
+                'url': _url(f"/category/{other['slug']}/", filters),
+                'selected': other['id'] == category['id'],
+            }
+            for other in categories
+        ],
+        'prices': [
+            {
+                'label': label,
+                'count': counts['prices'][key],
+                'url': _url(path, filters, price=None if filters['price'] == key else key),
+                'selected': filters['price'] == key,
+            }
+            for key, label, *_ in PRICE_RANGES
+        ],
+        'available': {
+            'count': counts['available'],
+            'url': _url(path, filters, available=not filters['available']),
+            'selected': filters['available'],
+        },
+    }
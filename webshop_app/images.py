@@ -0,0 +1,121 @@
+"""
+Product picture variants.
+
+Every uploaded picture is scaled down to PRODUCT_IMAGE_WIDTHS (never up) and saved as WebP and as
+JPEG (PNG for pictures with transparency), so pages can offer browsers a `srcset` and tiles never
+download the original photo. Variant names contain a hash of the original file, so they can be
+cached forever and an unchanged picture is never processed twice.
+
+Variants are made by the `generate_image_variants` job after upload and by
+`manage.py regenerate_images` in bulk. Their description (with size of the biggest variant)
+is stored in `Product.picture_variants`:
+
+    {'width': 1200, 'height': 800, 'sources': {'webp': [[200, 'url'], ...], 'jpeg': [[200, 'url'], ...]}}
+"""
+import hashlib
+import io
+import math
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.timezone import now
+from PIL import Image, ImageOps
+
+from . import catalog
+from .models import Product
+
+# Bump when the output of `render_variants` changes (e.g. quality), so new variants get new names.
+VARIANTS_VERSION = 1
+
+ORIENTATION_TAG = 0x0112
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'format': 'PNG', 'optimize': True},
+}
+
+
+def variant_storage():
+    """ Returns storage of picture variants. """
+    return FileSystemStorage(
+        location=settings.PRODUCT_IMAGE_VARIANTS_ROOT,
+        base_url=settings.PRODUCT_IMAGE_VARIANTS_URL,
+    )
+
+
+def _widths(width):
+    """ Returns widths of variants of picture `width` pixels wide. Small pictures get a single variant. """
+    widths = [target for target in settings.PRODUCT_IMAGE_WIDTHS if target < width]
+    return widths + [min(width, max(settings.PRODUCT_IMAGE_WIDTHS))]
+
+
+def render_variants(name):
+    """
+    Writes variants of picture `name` (in the storage of Product.picture) and returns their description.
+    Touches no database, so it can run in a separate process.
+    """
+    with Product._meta.get_field('picture').storage.open(name, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data + str(VARIANTS_VERSION).encode()).hexdigest()[:16]
+    storage = variant_storage()
+
+    with Image.open(io.BytesIO(data)) as original:
+        # EXIF orientations 5-8 turn the picture by 90 degrees.
+        rotated = original.getexif().get(ORIENTATION_TAG, 1) >= 5
+        widths = _widths(original.height if rotated else original.width)
+        # JPEG decoder can scale the picture down while decoding, which is much faster for big photos.
+        scale = widths[-1] / (original.height if rotated else original.width)
+        original.draft('RGB', (math.ceil(original.width * scale), math.ceil(original.height * scale)))
+        image = ImageOps.exif_transpose(original)
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+        width, height = image.size
+
+        sources = {'webp': [], 'png' if transparent else 'jpeg': []}
+        for target in widths:
+            scaled = image if target >= width else image.resize(
+                (target, max(1, round(height * target / width))), Image.Resampling.LANCZOS,
+            )
+            for extension in sources:
+                variant = f'{digest}-{target}.{extension}'
+                if not storage.exists(variant):
+                    output = io.BytesIO()
+                    scaled.save(output, **FORMATS[extension])
+                    storage.save(variant, ContentFile(output.getvalue()))
+                sources[extension].append([target, storage.url(variant)])
+    return {'width': widths[-1], 'height': max(1, round(height * widths[-1] / width)), 'sources': sources}
+
+
+def save_variants(product_id, name, variants):
+    """ Stores variants of picture `name`, unless the product has got another picture meanwhile. """
+    product = Product.objects.filter(id=product_id).values('category_id').first()
+    # QuerySet.update() does not send signals, so variants are not generated again.
+    if not Product.objects.filter(id=product_id, picture=name).update(picture_variants=variants, updated_at=now()):
+        return False
+    catalog.invalidate_product(product_id)
+    catalog.invalidate_category(product['category_id'])
+    catalog.invalidate_products()
+    return True
+
+
+def generate(product_id):
+    """ Makes variants of the product's picture. Returns False when there is nothing to do. """
+    name = Product.objects.filter(id=product_id).values_list('picture', flat=True).first()
+    if not name:
+        return False
+    return save_variants(product_id, name, render_variants(name))
+
+
+def srcset(variants, extension):
+    """ Returns `srcset` attribute value of variants in the format. """
+    return ', '.join(f'{url} {width}w' for width, url in variants['sources'][extension])
+
+
+def fallback(variants, width):
+    """ Returns (extension, url) of the narrowest non-WebP variant at least `width` pixels wide. """
+    extension = next(extension for extension in variants['sources'] if extension != 'webp')
+    candidates = variants['sources'][extension]
+    url = next((url for variant_width, url in candidates if variant_width >= width), candidates[-1][1])
+    return extension, url
@@ -0,0 +1,138 @@
+"""
+Stock keeping.
+
+Stock is changed only by conditional UPDATE statements (`... WHERE stock >= n`), which lock just
+the updated product rows, so concurrent checkouts of the same product can never oversell it.
+The same statements keep `Product.available` equal to `stock > 0`.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, IntegerField, Value, When
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from . import catalog
+from .models import Cart, Product
+
+
+class InsufficientStock(Exception):
+    """ Stock of some products is lower than requested quantity. """
+
+    def __init__(self, product_ids):
+        super().__init__(', '.join(str(product_id) for product_id in product_ids))
+        self.product_ids = product_ids
+
+
+def reservation_deadline():
+    """ Returns expiry time of reservation made now. """
+    return timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+
+def _per_product(quantities):
+    return Case(
+        *(When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def take(quantities):
+    """
+    Subtracts {product_id: quantity} from stock with a single UPDATE, negative quantities return items to stock.
+    Either every product has enough stock, or nothing is changed and InsufficientStock is raised.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    delta = _per_product(quantities)
+    if len(quantities) == 1:
+        # Single row is either updated or not, no savepoint is needed.
+        if not _update_stock(quantities, delta):
+            raise InsufficientStock(list(quantities))
+    else:
+        try:
+            with transaction.atomic():
+                # Rows updated by one statement are locked in scan order, so concurrent multi-product
+                # updates lock them in primary key order first to rule out deadlocks.
+                list(Product.objects.select_for_update().filter(id__in=quantities).order_by('id').values_list('id'))
+                if _update_stock(quantities, delta) != len(quantities):
+                    raise InsufficientStock([])
+        except InsufficientStock:
+            raise InsufficientStock(list(
+                Product.objects.filter(id__in=quantities, stock__lt=delta).order_by('id').values_list('id', flat=True)
+            ))
+    _invalidate_sold_out(quantities)
+
+
+def _update_stock(quantities, delta):
+    return Product.objects.filter(id__in=quantities, stock__gte=delta).update(
+        stock=F('stock') - delta,
+        available=Case(When(stock__gt=delta, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        updated_at=Now(),
+    )
+
+
+def release(quantities):
+    """ Returns {product_id: quantity} to stock. """
+    take({product_id: -quantity for product_id, quantity in quantities.items()})
+
+
+def _invalidate_sold_out(quantities):
+    """
+    Drops cached catalog entries of products which have just become (un)available, once the change is committed.
+    """
+    changed = [
+        (product_id, category_id)
+        for product_id, category_id, stock in Product.objects.filter(id__in=quantities).values_list(
+            'id', 'category_id', 'stock',
+        )
+        if (quantities[product_id] > 0 and stock == 0)
+        or (quantities[product_id] < 0 and stock == -quantities[product_id])
+    ]
+    if not changed:
+        return
+
+    def invalidate():
+        catalog.invalidate_product_details([product_id for product_id, category_id in changed])
+        for category_id in {category_id for product_id, category_id in changed}:
+            catalog.invalidate_category(category_id)
+        catalog.invalidate_products()
+
+    transaction.on_commit(invalidate)
+
+
+def release_lines(lines):
+    """ Deletes given cart lines and returns their reservations to stock. Returns number of deleted lines. """
+    with transaction.atomic():
+        rows = list(lines.select_for_update().order_by('id').values('id', 'product_id', 'reserved'))
+        release(_reserved_per_product(rows))
+        Cart.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def release_expired(batch_size=1000):
+    """
+    Returns expired reservations of up to `batch_size` cart lines to stock. Cart lines stay in the cart.
+    Lines locked by a running checkout are skipped. Returns number of released lines.
+    """
+    with transaction.atomic():
+        rows = list(
+            Cart.objects
+            .select_for_update(skip_locked=True)
+            .filter(reserved__gt=0, reserved_until__lt=timezone.now())
+            .order_by('id')
+            .values('id', 'product_id', 'reserved')[:batch_size]
+        )
+        release(_reserved_per_product(rows))
+        Cart.objects.filter(id__in=[row['id'] for row in rows]).update(reserved=0, reserved_until=None)
+    return len(rows)
+
+
+def _reserved_per_product(rows):
+    quantities = Counter()
+    for row in rows:
+        quantities[row['product_id']] += row['reserved']
+    return quantities
@@ -0,0 +1,176 @@
+"""
+Database backed background jobs.
+
+Views enqueue jobs in their own transaction, so a job exists only when the change which created it
+was committed. `manage.py run_jobs` claims due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so
+concurrent workers never take the same job, and runs them on a thread pool. Failed jobs are retried
+with exponential backoff, jobs of a worker which died are claimed again after JOB_TIMEOUT.
+
+Every job runs in a transaction which also deletes it, so its database changes are made exactly once.
+Other side effects (e-mails) may repeat when a worker dies in the middle of a job.
+Handlers ignore rows deleted before the job ran.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import catalog, images, rankings
+from .models import Job, Order, OrderLine
+
+logger = logging.getLogger(__name__)
+
+# Handlers by job name, registered with `@job(name)`.
+HANDLERS = {}
+
+
+class UnknownJob(Exception):
+    """ No handler is registered under the job's name. """
+
+
+def job(name):
+    """ Registers decorated function as handler of jobs `name`. Handler gets the payload as keyword arguments. """
+    def register(handler):
+        HANDLERS[name] = handler
+        return handler
+    return register
+
+
+def enqueue(name, delay=0, **payload):
+    """ Creates job `name` with JSON serializable `payload`, due in `delay` seconds. """
+    if name not in HANDLERS:
+        raise UnknownJob(name)
+    return Job.objects.create(name=name, payload=payload, run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def backoff(attempts):
+    """ Returns number of seconds to wait before retrying a job which failed `attempts` times. """
+    return min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.JOB_MAX_RETRY_DELAY)
+
+
+def claim(batch_size):
+    """
+    Marks up to `batch_size` due jobs as running and returns them, the longest waiting first.
+    Jobs locked by other workers are skipped.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=Job.PENDING, run_at__lte=now)
+                | Q(status=Job.RUNNING, run_at__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+            )
+            .order_by('run_at', 'id')[:batch_size]
+        )
+        # Running job's run_at is the time it was claimed, so stale jobs are found by the same index.
+        Job.objects.filter(id__in=[claimed.id for claimed in jobs]).update(
+            status=Job.RUNNING, run_at=now, attempts=F('attempts') + 1,
+        )
+    for claimed in jobs:
+        claimed.attempts += 1
+    return jobs
+
+
+def run(claimed):
+    """ Runs claimed job, schedules retry or marks it failed on error. Returns True when the job succeeded. """
+    try:
+        with transaction.atomic():
+            handler = HANDLERS.get(claimed.name)
+            if handler is None:
+                raise UnknownJob(claimed.name)
+            handler(**claimed.payload)
+            Job.objects.filter(id=claimed.id).delete()
+    except Exception as error:
+        logger.exception('Job %s %s failed (attempt %s).', claimed.id, claimed.name, claimed.attempts)
+        failed = claimed.attempts >= settings.JOB_MAX_ATTEMPTS
+        Job.objects.filter(id=claimed.id).update(
+            status=Job.FAILED if failed else Job.PENDING,
+            run_at=timezone.now() + timedelta(seconds=backoff(claimed.attempts)),
+            last_error=f'{type(error).__name__}: {error}',
+        )
+        return False
+    return True
+
+
+def run_in_thread(claimed):
+    """ Runs job on a worker thread, which has its own database connection. """
+    close_old_connections()
+    try:
+        return run(claimed)
+    finally:
+        close_old_connections()
+
+
+def run_pending(batch_size=100, executor=None):
+    """
+    Runs due jobs until there are none, on `executor` (concurrent.futures) or in the current thread.
+    Returns (succeeded, failed) numbers of jobs.
+    """
+    succeeded = failed = 0
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return succeeded, failed
+        results = list(executor.map(run_in_thread, jobs) if executor else map(run, jobs))
+        succeeded += results.count(True)
+        failed += results.count(False)
+
+
+@job('send_welcome_email')
+def send_welcome_email(user_id):
+    """ Sends e-mail confirming registration. """
+    user = User.objects.only('username', 'email').filter(id=user_id).first()
+    if user is not None and user.email:
+        send_mail(
+            'Witamy w sklepie!',
+            f'Cześć {user.username}, Twoje konto zostało założone.',
+            None,
+            [user.email],
+        )
+
+
+@job('send_order_confirmation')
+def send_order_confirmation(order_id):
+    """ Sends e-mail with ordered products. """
+    order = Order.objects.select_related('user').filter(id=order_id).first()
+    if order is None or not order.user.email:
+        return
+    lines = OrderLine.objects.filter(order_id=order_id).order_by('id')
+    items = '\n'.join(f'{line.product_name} x {line.quantity} - {line.price} PLN' for line in lines)
+    send_mail(
+        f'Potwierdzenie zamówienia {order.order_id}',
+        f'Dziękujemy za zamówienie!\n\n{items}',
+        None,
+        [order.user.email],
+    )
+
+
+@job('record_sales')
+def record_sales(order_id):
+    """ Adds the order to the daily sales of bestseller rankings. """
+    order_date = Order.objects.filter(id=order_id).values_list('order_date', flat=True).first()
+    if order_date is None:
+        return
+    rankings.record_order(
+        OrderLine.objects.filter(order_id=order_id).only('product_id', 'quantity'),
+        day=timezone.localdate(order_date),
+    )
+
+
+@job('warm_product')
+def warm_product(product_id):
+    """ Caches product details dropped by a change (e.g. new comment) before the next visitor asks for them. """
+    catalog.product_detail(product_id)
+
+
+@job('generate_image_variants')
+def generate_image_variants(product_id):
+    """ Scales down the product's new picture. """
+    images.generate(product_id)
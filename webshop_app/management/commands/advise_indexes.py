@@ -0,0 +1,65 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from webshop_app import advisor, benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests every url once, EXPLAINs executed queries (EXPLAIN ANALYZE on PostgreSQL, EXPLAIN QUERY PLAN '
+        'on SQLite) and reports sequential scans, sorts without index, repeated queries & candidate indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', help='Username used for pages of logged users. Defaults to user with most orders.',
+        )
+        parser.add_argument('--route', action='append', dest='routes', help='Analyze only given url names.')
+        parser.add_argument(
+            '--write-migration', action='store_true',
+            help='Writes candidate migration into webshop_app/migrations. Copy the indexes into models Meta as well.',
+        )
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = benchmark.default_user()
+        if user is None:
+            raise CommandError('No user with profile found, run seed_catalog first.')
+        routes = benchmark.ROUTES
+        if options['routes']:
+            routes = [route for route in routes if route.name in options['routes']]
+
+        report = advisor.analyze(user, routes)
+        self.stdout.write(f'Explained {report.statements} statements on {connection.vendor}.')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nSequential scans & sorts without index:'))
+        for (kind, table), findings in advisor.group_findings(report.findings).items():
+            routes = sorted({finding.route for finding in findings})
+            self.stdout.write(f'  {kind:<9} {table:<32} {len(findings):>4}x  routes: {", ".join(routes)}')
+            self.stdout.write(f'            {findings[0].detail}')
+            self.stdout.write(f'            {findings[0].sql[:300]}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nQueries repeated within one request:'))
+        for route, repeated in report.repeated.items():
+            for sql, count in sorted(repeated.items(), key=lambda item: -item[1]):
+                self.stdout.write(f'  {route:<24} {count:>4}x  {sql[:300]}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nCandidate indexes:'))
+        if not report.candidates:
+            self.stdout.write('  None.')
+            return
+        name, source, operations = advisor.candidate_migration(report.candidates)
+        for operation in operations:
+            self.stdout.write(f'  {operation.model_name}: {operation.index!r}')
+        if options['write_migration']:
+            path = os.path.join(os.path.dirname(advisor.__file__), 'migrations', name)
+            with open(path, 'w', encoding='utf-8') as migration:
+                migration.write(source)
+            self.stdout.write(self.style.SUCCESS(f'\nWritten {path}'))
+        else:
+            self.stdout.write(f'\n{source}')
@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from webshop_app import benchmark
+from webshop_app.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Requests every url, reports p50/p95 latency & query counts and fails when a query budget is exceeded.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument(
+            '--user', help='Username used for pages of logged users. Defaults to user with most orders.',
+        )
+        parser.add_argument('--route', action='append', dest='routes', help='Benchmark only given url names.')
+
+    def handle(self, *args, **options):
+        missing = benchmark.missing_routes()
+        if missing:
+            raise CommandError(f'No benchmark defined for urls: {", ".join(sorted(missing))}')
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = benchmark.default_user()
+        if user is None:
+            raise CommandError('No user with profile found, run seed_catalog first.')
+        if not Product.objects.filter(available=True).exists():
+            raise CommandError('No products found, run seed_catalog first.')
+
+        routes = benchmark.ROUTES
+        if options['routes']:
+            routes = [route for route in routes if route.name in options['routes']]
+        results = benchmark.run(user, iterations=options['iterations'], routes=routes)
+
+        self.stdout.write(f'{"route":<24}{"p50 ms":>10}{"p95 ms":>10}{"queries":>10}{"budget":>10}')
+        for result in results:
+            line = (f'{result.route.name:<24}{result.p50:>10.1f}{result.p95:>10.1f}'
+                    f'{result.max_queries:>10}{result.route.budget:>10}')
+            self.stdout.write(self.style.ERROR(line) if result.over_budget else line)
+
+        over_budget = [result.route.name for result in results if result.over_budget]
+        if over_budget:
+            raise CommandError(f'Query budget exceeded: {", ".join(over_budget)}')
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from webshop_app import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Updates "customers also bought" recommendations with orders placed since the previous run and current carts. '
+        'Run it periodically, e.g. every hour.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recomputes the matrix from all orders.')
+        parser.add_argument('--state', default=settings.RECOMMENDATIONS_STATE_FILE, help='Matrix state file.')
+        parser.add_argument('--top-k', type=int, default=settings.RECOMMENDATIONS_PER_PRODUCT)
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Order lines processed at once.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        lines, products = recommendations.update(
+            str(options['state']),
+            top_k=options['top_k'],
+            chunk_size=options['chunk_size'],
+            rebuild=options['rebuild'],
+        )
+        self.stdout.write(
+            f'Processed {lines} order lines, updated recommendations of {products} products '
+            f'in {time.perf_counter() - start:.1f}s.'
+        )
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webshop_app import exports
+
+
+class Command(BaseCommand):
+    help = 'Streams order lines as CSV or JSON lines to a file or standard output.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--since', help='Orders placed at or after this date/datetime (ISO).')
+        parser.add_argument('--until', help='Orders placed at or before this date/datetime (ISO).')
+        parser.add_argument(
+            '--checkpoint',
+            help='Name of incremental export. Only orders placed after its previous run are exported.',
+        )
+        parser.add_argument('--output', help='Output file. Defaults to standard output.')
+
+    def handle(self, *args, **options):
+        try:
+            export = exports.OrderExport(
+                since=exports.parse_moment(options['since']),
+                until=exports.parse_moment(options['until'], end_of_day=True),
+                checkpoint=options['checkpoint'],
+            )
+        except exports.InvalidExportParameter as error:
+            raise CommandError(f'Invalid date: {error}')
+
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in export.lines(options['format']):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,221 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.text import slugify
+
+from webshop_app import catalog
+from webshop_app.models import Cart, Category, Product
+
+FORMATS = ('csv', 'jsonl')
+
+# Columns updated when product with the same SKU already exists. Django 4.1 puts these names
+# into ON CONFLICT clause as they are, so foreign keys are given by column name.
+UPDATE_FIELDS = ['category_id', 'product', 'description', 'price', 'stock', 'available', 'updated_at']
+
+MAX_STOCK = 2147483647
+
+MAX_PRICE = Decimal('99999999.99')
+
+
+class RejectedRow(ValueError):
+    """ Row can not be imported. """
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams products from CSV or JSONL feed (columns: sku, product, category, price, description, stock) '
+        'and upserts them by SKU in batches. Model signals are not sent.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--create-categories', action='store_true', help='Creates missing categories.')
+        parser.add_argument('--checkpoint', help='File storing number of imported rows after every batch.')
+        parser.add_argument('--resume', action='store_true', help='Skips rows imported before according to checkpoint.')
+        parser.add_argument('--rejects', help='File receiving rejected rows as JSON lines.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Unknown format "{file_format}", use --format.')
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError('--resume requires --checkpoint.')
+
+        self.batch_size = options['batch_size']
+        self.checkpoint = options['checkpoint']
+        self.create_categories = options['create_categories']
+        self.categories = {name.strip().lower(): pk for name, pk in Category.objects.values_list('category', 'id')}
+        self.slugs = set(Category.objects.values_list('slug', flat=True))
+
+        skip = self.read_checkpoint() if options['resume'] else 0
+        imported = rejected = 0
+        start = time.perf_counter()
+        rejects = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+        try:
+            with open(path, newline='', encoding='utf-8') as feed:
+                batch = {}
+                row_number = skip
+                for row_number, row in self.read(feed, file_format, skip):
+                    try:
+                        product = self.build_product(row)
+                    except RejectedRow as error:
+                        rejected += 1
+                        if rejects:
+                            rejects.write(json.dumps({'row': row_number, 'error': str(error), 'data': row}) + '\n')
+                        continue
+                    # Last occurrence of SKU within the batch wins.
+                    batch[product.sku] = product
+                    if len(batch) >= self.batch_size:
+                        imported += self.save(batch, row_number)
+                        batch = {}
+                imported += self.save(batch, row_number)
+        finally:
+            if rejects:
+                rejects.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'Imported {imported} products, rejected {rejected} rows in {elapsed:.1f}s '
+            f'({(imported + rejected) / elapsed if elapsed else 0:.0f} rows/s).'
+        )
+
+    def read(self, feed, file_format, skip):
+        """ Yields (row number, row dictionary) of rows after the first `skip` ones. """
+        if file_format == 'csv':
+            rows = csv.DictReader(feed)
+        else:
+            rows = (line for line in feed if line.strip())
+        for row_number, row in enumerate(rows, start=1):
+            if row_number <= skip:
+                continue
+            if file_format == 'jsonl':
+                try:
+                    row = json.loads(row)
+                except ValueError:
+                    row = {'raw': row.strip()}
+                if not isinstance(row, dict):
+                    row = {'raw': row}
+            yield row_number, row
+
+    def build_product(self, row):
+        """ Returns unsaved Product built from the row, raises RejectedRow for invalid data. """
+        sku = str(row.get('sku') or '').strip()
+        if not sku or len(sku) > 64:
+            raise RejectedRow('Invalid sku.')
+        name = str(row.get('product') or '').strip()
+        if not name or len(name) > 100:
+            raise RejectedRow('Invalid product name.')
+        try:
+            price = Decimal(str(row.get('price')).replace(',', '.'))
+            # NaN can not be compared, Infinity can not be quantized.
+            if not price.is_finite() or not Decimal('0') <= price <= MAX_PRICE:
+                raise RejectedRow('Invalid price.')
+            price = price.quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            raise RejectedRow('Invalid price.')
+        description = row.get('description')
+        if isinstance(description, (dict, list)):
+            raise RejectedRow('Invalid description.')
+        try:
+            stock = int(str(row.get('stock') or 0).strip())
+        except ValueError:
+            raise RejectedRow('Invalid stock.')
+        if not 0 <= stock <= MAX_STOCK:
+            raise RejectedRow('Invalid stock.')
+        return Product(
+            sku=sku,
+            product=name,
+            category_id=self.category_id(str(row.get('category') or '').strip()),
+            price=price,
+            description=str(description) if description not in (None, '') else None,
+            stock=stock,
+            available=stock > 0,
+        )
+
+    def category_id(self, name):
+        """ Resolves category name through in-memory cache. """
+        if not name:
+            raise RejectedRow('Missing category.')
+        key = name.lower()
+        if key not in self.categories:
+            if not self.create_categories:
+                raise RejectedRow(f'Unknown category "{name}".')
+            base = slugify(name) or 'category'
+            slug = base
+            suffix = 2
+            while slug in self.slugs:
+                slug = f'{base}-{suffix}'
+                suffix += 1
+            self.slugs.add(slug)
+            self.categories[key] = Category.objects.create(category=name[:100], slug=slug).id
+        return self.categories[key]
+
+    def save(self, batch, row_number):
+        """ Upserts batch by SKU, stores checkpoint and drops affected cache entries. """
+        if batch:
+            products = list(batch.values())
+            with transaction.atomic():
+                # Rows are locked first, so no reservation changes until the new stock is stored.
+                existing = list(
+                    Product.objects.select_for_update().filter(sku__in=batch).order_by('id').values_list(
+                        'id', 'category_id',
+                    )
+                )
+                self.subtract_reserved(batch)
+                Product.objects.bulk_create(
+                    products,
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=UPDATE_FIELDS,
+                )
+            catalog.invalidate_product_details([product_id for product_id, category_id in existing])
+            categories = {category_id for product_id, category_id in existing}
+            categories.update(product.category_id for product in products)
+            for category_id in categories:
+                catalog.invalidate_category(category_id)
+            catalog.invalidate_products()
+        self.write_checkpoint(row_number)
+        return len(batch)
+
+    def subtract_reserved(self, batch):
+        """
+        Subtracts items reserved in carts from stock of the feed, which counts all items in the warehouse.
+        Reservations are returned to stock when they expire or are ordered.
+        """
+        reserved = (
+            Cart.objects
+            .filter(product__sku__in=batch, reserved__gt=0)
+            .values_list('product__sku')
+            .annotate(Sum('reserved'))
+        )
+        for sku, quantity in reserved:
+            product = batch[sku]
+            product.stock = max(product.stock - quantity, 0)
+            product.available = product.stock > 0
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint, encoding='utf-8') as checkpoint:
+                return json.load(checkpoint)['rows']
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError):
+            raise CommandError(f'Invalid checkpoint file {self.checkpoint}.')
+
+    def write_checkpoint(self, rows):
+        if not self.checkpoint:
+            return
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as checkpoint:
+            json.dump({'rows': rows}, checkpoint)
+        os.replace(temporary, self.checkpoint)
@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from webshop_app import images
+from webshop_app.models import Product
+
+
+def render(product_id, name):
+    """ Runs in a worker process, which only reads & writes picture files. """
+    try:
+        return product_id, name, images.render_variants(name), None
+    except Exception as error:
+        return product_id, name, None, f'{type(error).__name__}: {error}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Makes scaled down WebP & JPEG/PNG variants of product pictures on a pool of processes. '
+        'Pictures which already have variants are skipped unless --all is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerates variants of every picture.')
+        parser.add_argument('--workers', type=int, default=None, help='Number of processes, CPU count by default.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(picture='').exclude(picture__isnull=True)
+        if not options['all']:
+            products = products.filter(picture_variants={})
+        pictures = list(products.order_by('id').values_list('id', 'picture'))
+        # Worker processes must not inherit open database connections.
+        connections.close_all()
+
+        saved = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            futures = [executor.submit(render, product_id, name) for product_id, name in pictures]
+            for future in as_completed(futures):
+                product_id, name, variants, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f'Product {product_id} ({name}): {error}')
+                elif images.save_variants(product_id, name, variants):
+                    saved += 1
+        self.stdout.write(f'Generated variants of {saved} pictures, {failed} failed.')
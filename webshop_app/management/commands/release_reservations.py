@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from webshop_app import inventory
+
+
+class Command(BaseCommand):
+    help = 'Returns expired cart reservations to stock in batches. Run it periodically (e.g. every minute).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = 0
+        while True:
+            batch = inventory.release_expired(batch_size=options['batch_size'])
+            released += batch
+            if batch < options['batch_size']:
+                break
+        self.stdout.write(f'Released reservations of {released} cart lines.')
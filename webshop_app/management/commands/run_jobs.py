@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from webshop_app import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs background jobs (e-mails, sales statistics, cache warming) on a pool of threads. '
+        'Several workers can run at once, each job is claimed by one of them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100, help='Jobs claimed at once.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when there are no jobs.')
+        parser.add_argument('--once', action='store_true', help='Exits when there are no due jobs.')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        if connection.vendor == 'sqlite' and threads > 1:
+            self.stdout.write('SQLite does not support concurrent writers, jobs are run one by one.')
+            threads = 1
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job') if threads > 1 else None
+        succeeded = failed = 0
+        try:
+            while True:
+                batch = jobs.run_pending(batch_size=options['batch_size'], executor=executor)
+                succeeded += batch[0]
+                failed += batch[1]
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.stdout.write(f'Finished {succeeded} jobs, {failed} failed.')
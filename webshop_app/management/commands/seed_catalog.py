@@ -0,0 +1,182 @@
+import random
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from webshop_app import catalog, rankings
+from webshop_app.models import Address, Cart, Category, Comment, Order, OrderLine, Product, Profile
+
+BRANDS = ['AMD', 'Intel', 'Nvidia', 'ASUS', 'MSI', 'Gigabyte', 'ASRock', 'Zotac', 'Sapphire', 'EVGA']
+WORDS = ['Pro', 'Max', 'Ultra', 'Gaming', 'Elite', 'Plus', 'Turbo', 'Silent', 'OC', 'Mini']
+CITIES = ['Warszawa', 'Kraków', 'Gdańsk', 'Wrocław', 'Poznań', 'Łódź', 'Lublin', 'Szczecin']
+COMMENTS = [
+    'Polecam!', 'Działa bez zarzutu.', 'Za głośny.', 'Świetny stosunek ceny do jakości.', 'Szybka wysyłka.',
+]
+
+# Every seeded user gets this password.
+PASSWORD = 'password'
+
+
+class Command(BaseCommand):
+    help = 'Generates random catalog, users, carts and orders. Rows are written with batched bulk_create.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=5)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--addresses', type=int, default=150)
+        parser.add_argument('--comments', type=int, default=2000)
+        parser.add_argument('--carts', type=int, default=300, help='Number of cart lines.')
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--lines-per-order', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, for reproducible datasets.')
+
+    def handle(self, *args, **options):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError('Database does not return primary keys from bulk inserts.')
+        if options['categories'] < 1 or (options['users'] < 1 and (options['carts'] or options['orders'])):
+            raise CommandError('At least one category (and one user for carts & orders) is required.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Makes names unique across several runs on the same database.
+        self.token = uuid.UUID(int=self.random.getrandbits(128)).hex[:8]
+
+        with transaction.atomic():
+            categories = self.create_categories(options['categories'])
+            products = self.create_products(categories, options['products'])
+            users = self.create_users(options['users'])
+            self.create_addresses(users, options['addresses'])
+            self.create_comments(users, products, options['comments'])
+            self.create_carts(users, products, options['carts'])
+            self.create_orders(users, products, options['orders'], options['lines_per_order'])
+        catalog.invalidate_categories()
+        catalog.invalidate_products()
+        for category_id in categories:
+            catalog.invalidate_category(category_id)
+
+    def bulk_create(self, model, objects):
+        """ Saves objects from iterable in batches and returns their primary keys. """
+        ids = []
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                ids.extend(obj.pk for obj in model.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            ids.extend(obj.pk for obj in model.objects.bulk_create(batch))
+        self.stdout.write(f'{model.__name__}: {len(ids)}')
+        return ids
+
+    def create_categories(self, count):
+        return self.bulk_create(Category, (
+            Category(category=f'Kategoria {i}', slug=f'kategoria-{self.token}-{i}') for i in range(count)
+        ))
+
+    def create_products(self, categories, count):
+        """ Returns list of (id, name, price) tuples. """
+        products = []
+
+        def generate():
+            for i in range(count):
+                name = f'{self.random.choice(BRANDS)} {self.random.choice(WORDS)} {i}'
+                price = Decimal(self.random.randint(5000, 1000000)) / 100
+                stock = self.random.randint(1, 500) if self.random.random() > 0.1 else 0
+                products.append((name, price))
+                yield Product(
+                    category_id=self.random.choice(categories),
+                    product=name,
+                    description=' '.join(self.random.choices(WORDS + BRANDS, k=20)),
+                    price=price,
+                    stock=stock,
+                    available=stock > 0,
+                )
+
+        ids = self.bulk_create(Product, generate())
+        return [(product_id, name, price) for product_id, (name, price) in zip(ids, products)]
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        ids = self.bulk_create(User, (
+            User(username=f'seed_{self.token}_{i}', email=f'seed_{self.token}_{i}@example.com', password=password)
+            for i in range(count)
+        ))
+        self.bulk_create(Profile, (
+            Profile(
+                user_id=user_id, birth_date=timezone.now().date() - timedelta(days=self.random.randint(6600, 25000)),
+            )
+            for user_id in ids
+        ))
+        return ids
+
+    def create_addresses(self, users, count):
+        if not users:
+            return
+        profiles = dict(Profile.objects.filter(user_id__in=users).values_list('user_id', 'id'))
+        self.bulk_create(Address, (
+            Address(
+                profile_id=profiles[self.random.choice(users)],
+                name=f'Adres {i}',
+                country='PL',
+                city=self.random.choice(CITIES),
+                address=f'ul. Prosta {self.random.randint(1, 200)}',
+                zip_code=f'{self.random.randint(10, 99)}-{self.random.randint(100, 999)}',
+            )
+            for i in range(count)
+        ))
+
+    def create_comments(self, users, products, count):
+        if not users or not products:
+            return
+        now = timezone.now()
+        self.bulk_create(Comment, (
+            Comment(
+                user_id=self.random.choice(users),
+                product_id=self.random.choice(products)[0],
+                text=self.random.choice(COMMENTS),
+                text_date=now - timedelta(minutes=self.random.randint(0, 525600)),
+            )
+            for _ in range(count)
+        ))
+
+    def create_carts(self, users, products, count):
+        if not products:
+            return
+        count = min(count, len(users) * len(products))
+        pairs = set()
+        while len(pairs) < count:
+            pairs.add((self.random.choice(users), self.random.choice(products)[0]))
+        self.bulk_create(Cart, (
+            Cart(user_id=user_id, product_id=product_id, quantity=self.random.randint(1, 3))
+            for user_id, product_id in pairs
+        ))
+
+    def create_orders(self, users, products, count, lines_per_order):
+        if not products:
+            return
+        now = timezone.now()
+        dates = [now - timedelta(minutes=self.random.randint(0, 525600)) for _ in range(count)]
+        orders = self.bulk_create(Order, (
+            Order(user_id=self.random.choice(users), order_date=order_date) for order_date in dates
+        ))
+        lines = [
+            OrderLine(order_id=order_id, product_id=product_id, product_name=name, price=price,
+                      quantity=self.random.randint(1, 3))
+            for order_id in orders
+            for product_id, name, price in self.random.sample(products, min(lines_per_order, len(products)))
+        ]
+        self.bulk_create(OrderLine, lines)
+        days = {order_id: timezone.localdate(order_date) for order_id, order_date in zip(orders, dates)}
+        sales = defaultdict(Counter)
+        for line in lines:
+            sales[days[line.order_id]][line.product_id] += line.quantity
+        for day, quantities in sales.items():
+            rankings.record_sales(quantities, day=day)
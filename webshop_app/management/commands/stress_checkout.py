@@ -0,0 +1,67 @@
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+
+from webshop_app import cart, checkout, inventory
+from webshop_app.models import Category, OrderLine, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Buys a single hot product from many threads at once (add to cart & checkout) and checks that '
+        'it was not oversold. Creates its own product & users and removes them afterwards. Needs PostgreSQL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=300)
+        parser.add_argument('--stock', type=int, default=100)
+        parser.add_argument('--quantity', type=int, default=1, help='Items bought by every buyer.')
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--keep', action='store_true', help='Keeps created rows.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError('SQLite does not support concurrent writers, use PostgreSQL.')
+        token = secrets.token_hex(4)
+        category = Category.objects.create(category=f'Stress {token}', slug=f'stress-{token}')
+        product = Product.objects.create(
+            category=category, sku=f'stress-{token}', product=f'Stress {token}', price='1.00', stock=options['stock'],
+        )
+        users = User.objects.bulk_create(User(username=f'stress_{token}_{i}') for i in range(options['buyers']))
+
+        def buy(user):
+            try:
+                cart.add_product(user.id, product.id, options['quantity'])
+                checkout.place_order(user)
+                return True
+            except (inventory.InsufficientStock, checkout.CheckoutError):
+                return False
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                placed = sum(executor.map(buy, users))
+            elapsed = time.perf_counter() - start
+
+            product.refresh_from_db()
+            sold = OrderLine.objects.filter(product=product).aggregate(sold=Sum('quantity'))['sold'] or 0
+            expected = min(options['stock'] // options['quantity'], options['buyers'])
+            self.stdout.write(
+                f'{placed} of {options["buyers"]} orders placed in {elapsed:.2f}s, '
+                f'{sold} items sold, {product.stock} left in stock.'
+            )
+            if sold + product.stock != options['stock'] or placed != expected:
+                raise CommandError(f'Stock mismatch: expected {expected} orders and {options["stock"]} items in total.')
+            if product.available != (product.stock > 0):
+                raise CommandError('Product availability does not match its stock.')
+        finally:
+            if not options['keep']:
+                User.objects.filter(id__in=[user.id for user in users]).delete()
+                category.delete()
@@ -0,0 +1,110 @@
+"""
+Prometheus metrics.
+
+When PROMETHEUS_MULTIPROC_DIR environment variable is set (see gunicorn.conf.py) every worker
+process writes its samples into that directory and the /metrics endpoint aggregates all of them.
+The endpoint is available to staff users and to scrapers with METRICS_TOKEN.
+"""
+import os
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+
+# Other methods are counted as 'OTHER', so clients can not create unlimited label values.
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+REQUEST_LATENCY = Histogram(
+    'webshop_request_latency_seconds',
+    'Request latency per route.',
+    ['route', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter(
+    'webshop_requests_total',
+    'Responses per route and status code.',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'webshop_request_db_queries',
+    'Number of SQL queries per request.',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+CHECKOUTS = Counter(
+    'webshop_checkouts_total',
+    'Checkout attempts per result.',
+    ['result'],
+)
+EDGE_CACHE = Counter(
+    'webshop_edge_cache_requests_total',
+    'Cacheable page requests answered by the edge cache middleware per result (hit/miss).',
+    ['result'],
+)
+
+
+def registry():
+    """ Returns registry with samples of all worker processes. """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return collector_registry
+    return REGISTRY
+
+
+def _authorized(request):
+    """ Returns True for staff users and requests with METRICS_TOKEN as bearer token. """
+    token = settings.METRICS_TOKEN
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_staff
+
+
+def metrics_view(request):
+    """ Exposes metrics in Prometheus text format. """
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+class QueryCounter:
+    """ Database execute wrapper counting queries. """
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """ Records latency, status code & query count of every request, labelled with url name. """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        latency = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'OTHER'
+        REQUEST_LATENCY.labels(route, method).observe(latency)
+        REQUESTS.labels(route, method, response.status_code).inc()
+        DB_QUERIES.labels(route).observe(counter.queries)
+        return response
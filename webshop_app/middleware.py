@@ -0,0 +1,104 @@
+"""
+Per-request performance instrumentation.
+
+Enabled with the PERFORMANCE_INSTRUMENTATION setting. When disabled the middleware removes
+itself from the chain (MiddlewareNotUsed), so it costs nothing.
+"""
+import contextvars
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('webshop_app.performance')
+
+_current_stats = contextvars.ContextVar('webshop_request_stats', default=None)
+
+
+def current_stats():
+    """ Returns `RequestStats` of the request being processed or None. """
+    return _current_stats.get()
+
+
+class RequestStats:
+    """
+    Collects SQL & template timings of a single request.
+    Instance is used as a database execute wrapper.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        """ Returns {sql: count} of statements executed at least `threshold` times. """
+        return {sql: count for sql, count in self.statements.items() if count >= threshold}
+
+    def track(self):
+        """ Context manager installing this object on every database connection & as current stats. """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        token = _current_stats.set(self)
+        stack.callback(_current_stats.reset, token)
+        return stack
+
+
+class PerformanceMiddleware:
+    """
+    Measures SQL query count, database time, template render time and view time of every request.
+    Adds them as Server-Timing header and logs them as JSON line keyed by url name.
+    Statements repeated at least PERFORMANCE_DUPLICATE_QUERY_THRESHOLD times (N+1 patterns) are logged as warnings.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFORMANCE_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(settings, 'PERFORMANCE_DUPLICATE_QUERY_THRESHOLD', 5)
+
+    def __call__(self, request):
+        stats = RequestStats()
+        start = time.perf_counter()
+        with stats.track():
+            response = self.get_response(request)
+        view_time = time.perf_counter() - start
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'view;dur={view_time * 1000:.1f}',
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match else None
+        duplicates = stats.duplicates(self.duplicate_threshold)
+        logger.info(json.dumps({
+            'url_name': url_name,
+            'method': request.method,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 1),
+            'template_ms': round(stats.template_time * 1000, 1),
+            'view_ms': round(view_time * 1000, 1),
+            'duplicated_queries': len(duplicates),
+        }))
+        for sql, count in duplicates.items():
+            logger.warning(json.dumps({'url_name': url_name, 'duplicated_query': sql, 'count': count}))
+        return response
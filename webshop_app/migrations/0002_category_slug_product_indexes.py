@@ -0,0 +1,47 @@
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def populate_slugs(apps, schema_editor):
+    """ Creates unique slugs from category names. """
+    Category = apps.get_model('webshop_app', 'Category')
+    used = set()
+    for category in Category.objects.order_by('id'):
+        base = slugify(category.category) or f'category-{category.id}'
+        slug = base
+        suffix = 2
+        while slug in used:
+            slug = f'{base}-{suffix}'
+            suffix += 1
+        used.add(slug)
+        category.slug = slug
+        category.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(max_length=100, null=True),
+        ),
+        migrations.RunPython(populate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(max_length=100, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'product', 'id'], name='product_category_name_idx'),
+        ),
+    ]
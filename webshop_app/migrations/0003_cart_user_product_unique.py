@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicated_lines(apps, schema_editor):
+    """ Merges cart lines of the same product into a single line with summed quantity. """
+    Cart = apps.get_model('webshop_app', 'Cart')
+    duplicates = (
+        Cart.objects
+        .values('user_id', 'product_id')
+        .annotate(lines=Count('id'), first_id=Min('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        Cart.objects.filter(id=duplicate['first_id']).update(quantity=duplicate['total'])
+        Cart.objects.filter(
+            user_id=duplicate['user_id'],
+            product_id=duplicate['product_id'],
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0002_category_slug_product_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicated_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='cart_user_product_unique'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "ALTER TABLE webshop_app_product ADD COLUMN search_vector tsvector NULL",
+    """
+    CREATE FUNCTION webshop_app_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.product, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER webshop_app_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF product, description, search_vector ON webshop_app_product
+    FOR EACH ROW EXECUTE FUNCTION webshop_app_product_search_vector_update()
+    """,
+    # Fires the trigger for existing rows.
+    "UPDATE webshop_app_product SET product = product",
+    "CREATE INDEX product_search_vector_gin ON webshop_app_product USING GIN (search_vector)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP TRIGGER webshop_app_product_search_vector_trigger ON webshop_app_product",
+    "DROP FUNCTION webshop_app_product_search_vector_update()",
+    "ALTER TABLE webshop_app_product DROP COLUMN search_vector",
+]
+
+
+def add_search_vector(apps, schema_editor):
+    """ Adds trigger maintained tsvector column with GIN index, or a plain unused column on other databases. """
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in POSTGRES_FORWARD:
+            schema_editor.execute(statement)
+    else:
+        schema_editor.execute("ALTER TABLE webshop_app_product ADD COLUMN search_vector text NULL")
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in POSTGRES_BACKWARD:
+            schema_editor.execute(statement)
+    else:
+        schema_editor.execute("ALTER TABLE webshop_app_product DROP COLUMN search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0004_order_lines'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='product',
+                    name='search_vector',
+                    field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_search_vector, remove_search_vector),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.2 on 2026-10-17 13:49
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0007_export_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_date',
+            field=models.DateTimeField(db_index=True, default=datetime.datetime.now),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.2 on 2026-10-17 13:51
+
+from django.db import migrations, models
+
+
+def withdraw_products(apps, schema_editor):
+    """
+    Real stock levels are unknown before stock keeping, so products start with no stock and are
+    withdrawn from sale until their stock is imported (manage.py import_catalog) or set in the admin.
+    """
+    Product = apps.get_model('webshop_app', 'Product')
+    Product.objects.update(stock=0, available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0008_order_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(withdraw_products, migrations.RunPython.noop),
+    ]
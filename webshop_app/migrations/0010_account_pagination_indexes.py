@@ -0,0 +1,21 @@
+# Generated by Django 4.1.2 on 2026-10-17 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0009_product_stock_cart_reservations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['profile', 'name', 'id'], name='address_profile_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-order_date', 'id'], name='order_user_date_idx'),
+        ),
+    ]
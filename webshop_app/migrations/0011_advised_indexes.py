@@ -0,0 +1,21 @@
+# Generated by Django 4.1.2 on 2026-10-17 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0010_account_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['category'], name='category_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product', '-text_date'], name='comment_product_date_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.2 on 2026-10-17 14:05
+
+from datetime import timedelta
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Sales older than this do not affect any ranking.
+BACKFILL_DAYS = 30
+
+
+def backfill_sales(apps, schema_editor):
+    """ Rolls up order lines of the last days, so rankings are not empty after deploy. """
+    OrderLine = apps.get_model('webshop_app', 'OrderLine')
+    ProductSalesDaily = apps.get_model('webshop_app', 'ProductSalesDaily')
+    sales = (
+        OrderLine.objects
+        .filter(product__isnull=False, order__order_date__gte=timezone.now() - timedelta(days=BACKFILL_DAYS + 1))
+        .annotate(day=TruncDate('order__order_date'))
+        .values('product_id', 'day')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+    ProductSalesDaily.objects.bulk_create(
+        (ProductSalesDaily(product_id=row['product_id'], day=row['day'], quantity=row['quantity']) for row in sales),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0012_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='webshop_app.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productsalesdaily',
+            index=models.Index(fields=['day', 'product'], name='sales_day_product_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsalesdaily',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='sales_product_day_unique'),
+        ),
+        migrations.RunPython(backfill_sales, migrations.RunPython.noop),
+    ]
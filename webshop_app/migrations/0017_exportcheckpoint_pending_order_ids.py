@@ -0,0 +1,18 @@
+# Generated by Django 4.1.2 on 2026-10-17 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0016_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportcheckpoint',
+            name='pending_order_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.2 on 2026-10-17 15:30
+
+from django.db import migrations
+
+
+def rename_checkpoint(apps, schema_editor):
+    """ Moves the recommendations checkpoint out of the names available to order exports. """
+    ExportCheckpoint = apps.get_model('webshop_app', 'ExportCheckpoint')
+    if not ExportCheckpoint.objects.filter(name='internal:recommendations').exists():
+        ExportCheckpoint.objects.filter(name='recommendations').update(name='internal:recommendations')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webshop_app', '0017_exportcheckpoint_pending_order_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_checkpoint, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,9 @@ import uuid as uuid
 from datetime import datetime
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from django_countries.fields import CountryField
 
@@ -26,6 +28,12 @@ class Address(models.Model):
     address = models.CharField(max_length=100)
     zip_code = models.CharField(max_length=10)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of user's addresses sorted by name.
+            models.Index(fields=['profile', 'name', 'id'], name='address_profile_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -33,6 +41,13 @@ class Address(models.Model):
 class Category(models.Model):
     """ Category model. """
     category = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True)
+
+    class Meta:
+        indexes = [
+            # Categories are listed sorted by name.
+            models.Index(fields=['category'], name='category_name_idx'),
+        ]
 
     def __str__(self):
         return self.category
@@ -41,21 +56,49 @@ class Category(models.Model):
 class Product(models.Model):
     """ Product model. Belongs to specific category. """
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     product = models.CharField(max_length=100)
     description = models.TextField(null=True)
     price = models.DecimalField(decimal_places=2, max_digits=10)
     picture = models.ImageField(upload_to='staticfiles/images/', null=True, blank=True)
+    # Scaled down copies of the picture, see the images module.
+    picture_variants = models.JSONField(default=dict, blank=True, editable=False)
+    stock = models.PositiveIntegerField(default=0)
+    # Derived from `stock`, kept in sync by `save()` and by stock updates of the inventory module.
     available = models.BooleanField(default=True, null=False)
+    # Last change of anything shown on the product page (incl. comments), Last-Modified of the page.
+    updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by a database trigger on PostgreSQL (see migration 0005), not written by Django.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of category listings sorted by price or name.
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'product', 'id'], name='product_category_name_idx'),
+        ]
 
     def __str__(self):
         return self.product
 
+    def save(self, *args, **kwargs):
+        self.available = self.stock > 0
+        super().save(*args, **kwargs)
+
 
 class Cart(models.Model):
     """ Cart model. Stores products for further actions. """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
+    # Number of items taken from product's stock for this line until `reserved_until`.
+    reserved = models.PositiveIntegerField(default=0)
+    reserved_until = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='cart_user_product_unique'),
+        ]
 
 
 class Order(models.Model):
@@ -63,12 +106,43 @@ class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     cart = models.ManyToManyField(Cart)
     order_id = models.UUIDField(default=uuid.uuid4, unique=True, db_index=True, editable=False)
-    order_date = models.DateTimeField(default=datetime.now)
+    order_date = models.DateTimeField(default=datetime.now, db_index=True)
+    idempotency_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of user's order history, the newest first.
+            models.Index(fields=['user', '-order_date', 'id'], name='order_user_date_idx'),
+        ]
 
     def __str__(self):
         return str(self.user)
 
 
+class OrderLine(models.Model):
+    """ Ordered product. Keeps product's name & price from the moment of placing the order. """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    product_name = models.CharField(max_length=100)
+    price = models.DecimalField(decimal_places=2, max_digits=10)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return self.product_name
+
+
+class ExportCheckpoint(models.Model):
+    """ Last order included in the named incremental export. """
+    name = models.CharField(max_length=100, unique=True)
+    last_order_id = models.BigIntegerField(default=0)
+    # [order id, first missed (timestamp)] of lower ids whose orders may still be committed, see exports.OrderWatermark.
+    pending_order_ids = models.JSONField(default=list, blank=True)
+    exported_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Comment(models.Model):
     """ Comment model. """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -76,5 +150,70 @@ class Comment(models.Model):
     text = models.TextField()
     text_date = models.DateTimeField(default=datetime.now)
 
+    class Meta:
+        indexes = [
+            # Comments of the product page, the newest first.
+            models.Index(fields=['product', '-text_date'], name='comment_product_date_idx'),
+        ]
+
     def __str__(self):
         return str(self.user)
+
+
+class ProductRecommendation(models.Model):
+    """
+    Product often bought together with `product` ("customers also bought"), `rank` 1 is the strongest.
+    Built by `manage.py build_recommendations`.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # Serves the product page lookup ordered by rank.
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_unique'),
+        ]
+
+
+class ProductSalesDaily(models.Model):
+    """ Number of items of the product sold on the day. Updated by every placed order, read by rankings. """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales')
+    day = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Target of the upsert made at checkout, serves per product (category) lookups as well.
+            models.UniqueConstraint(fields=['product', 'day'], name='sales_product_day_unique'),
+        ]
+        indexes = [
+            # Rankings of all products read only the last days.
+            models.Index(fields=['day', 'product'], name='sales_day_product_idx'),
+        ]
+
+
+class Job(models.Model):
+    """ Background job run by `manage.py run_jobs`, see the jobs module. Finished jobs are deleted. """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Oczekuje'), (RUNNING, 'W trakcie'), (FAILED, 'Nieudane')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim due jobs in run_at order, stale running jobs are found by the same index.
+            models.Index(fields=['status', 'run_at', 'id'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
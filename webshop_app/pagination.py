@@ -0,0 +1,130 @@
+"""
+Keyset (seek) pagination.
+
+Pages are addressed by the sort key of the last row seen instead of an OFFSET, so every
+page is a single index range scan no matter how deep the visitor browses.
+"""
+import base64
+import json
+import math
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """ Cursor could not be decoded. """
+
+
+def _value(row, field):
+    if isinstance(row, dict):
+        return row[field]
+    return getattr(row, field)
+
+
+def encode_cursor(values):
+    """ Encodes sort key values into url-safe string. """
+    encoded = []
+    for value in values:
+        if isinstance(value, (Decimal, datetime)):
+            value = str(value) if isinstance(value, Decimal) else value.isoformat()
+        encoded.append(value)
+    return base64.urlsafe_b64encode(json.dumps(encoded).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ Decodes cursor created by `encode_cursor`. """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def _clean(queryset, name, value):
+    """
+    Converts cursor value of model field `name` to its Python type, so a tampered cursor never reaches
+    the database. Raises InvalidCursor for values the field can not hold.
+    """
+    if isinstance(value, (list, dict)) or value is None:
+        raise InvalidCursor(value)
+    try:
+        field = queryset.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return value
+    try:
+        value = field.to_python(value)
+    except (ValidationError, ValueError, TypeError):
+        raise InvalidCursor(value)
+    if isinstance(value, (Decimal, float)) and not math.isfinite(value):
+        raise InvalidCursor(value)
+    ranges = connections[queryset.db].ops.integer_field_ranges
+    if field.get_internal_type() in ranges:
+        low, high = ranges[field.get_internal_type()]
+        if not low <= value <= high:
+            raise InvalidCursor(value)
+    return value
+
+
+def _seek_filter(ordering, values):
+    """
+    Builds WHERE clause selecting rows placed after `values` in `ordering`,
+    e.g. for ('price', 'id'): price > p OR (price = p AND id > i).
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPage:
+    """ Single page of results. """
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate(queryset, ordering, cursor=None, page_size=24):
+    """
+    Returns `KeysetPage` of `queryset` sorted by `ordering`.
+    The last field of `ordering` has to be unique (usually 'id' or '-id').
+    Raises InvalidCursor for malformed cursors.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor(cursor)
+        values = [_clean(queryset, field.lstrip('-'), value) for field, value in zip(ordering, values)]
+        try:
+            queryset = queryset.filter(_seek_filter(ordering, values))
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([_value(last, field.lstrip('-')) for field in ordering])
+    return KeysetPage(items, next_cursor)
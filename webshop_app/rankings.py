@@ -0,0 +1,103 @@
+"""
+Bestseller and trending product rankings.
+
+Every placed order adds its quantities to `ProductSalesDaily` (one row per product and day) with
+a single upsert made by the `record_sales` job, so rankings never aggregate the order history.
+A ranking sums sales of the last `days` days, each day weighted by exponential decay with the
+given half-life, so recent sales count more. Rankings are cached by `catalog.popular_products`.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, Sum, Value, When
+from django.utils import timezone
+
+from .models import ProductSalesDaily
+
+
+@dataclass(frozen=True)
+class Ranking:
+    """ Sales of the last `days` days, weight of a day's sales halves every `half_life` days. """
+    title: str
+    days: int
+    half_life: float
+
+
+# Number of products written by one INSERT statement.
+WRITE_BATCH = 1000
+
+RANKINGS = {
+    'bestsellers': Ranking('Bestsellery', days=30, half_life=10),
+    'trending': Ranking('Popularne w tym tygodniu', days=7, half_life=2),
+}
+
+
+def record_sales(quantities, day=None):
+    """
+    Adds {product_id: quantity} to sales of the day (today by default) with INSERT ... ON CONFLICT,
+    a single statement for up to WRITE_BATCH products.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if product_id and quantity}
+    if not quantities:
+        return
+    day = day or timezone.localdate()
+    meta = ProductSalesDaily._meta
+    table = connection.ops.quote_name(meta.db_table)
+    product, day_column, quantity = (
+        connection.ops.quote_name(meta.get_field(name).column) for name in ('product', 'day', 'quantity')
+    )
+    product_ids = sorted(quantities)
+    with connection.cursor() as cursor:
+        for start in range(0, len(product_ids), WRITE_BATCH):
+            batch = product_ids[start:start + WRITE_BATCH]
+            # QuerySet.bulk_create(update_conflicts=True) can only overwrite the quantity, not add to it.
+            cursor.execute(
+                f'INSERT INTO {table} ({product}, {day_column}, {quantity}) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({product}, {day_column}) '
+                f'DO UPDATE SET {quantity} = {table}.{quantity} + EXCLUDED.{quantity}',
+                [value for product_id in batch for value in (product_id, day, quantities[product_id])],
+            )
+
+
+def record_order(lines, day=None):
+    """ Adds ordered quantities of OrderLine objects to sales of the day (today by default). """
+    quantities = Counter()
+    for line in lines:
+        quantities[line.product_id] += line.quantity
+    record_sales(quantities, day=day)
+
+
+def _decay(ranking, today):
+    return Case(
+        *(
+            When(day=today - timedelta(days=age), then=Value(0.5 ** (age / ranking.half_life)))
+            for age in range(ranking.days)
+        ),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def top(kind, category_id=None, limit=8, today=None):
+    """
+    Returns up to `limit` available products with the highest decayed sales score of the ranking `kind`,
+    optionally only from one category, as dictionaries (product_id, product__product, product__price, score).
+    """
+    ranking = RANKINGS[kind]
+    today = today or timezone.localdate()
+    sales = ProductSalesDaily.objects.filter(
+        day__gt=today - timedelta(days=ranking.days),
+        day__lte=today,
+        product__available=True,
+    )
+    if category_id is not None:
+        sales = sales.filter(product__category_id=category_id)
+    return list(
+        sales
+        .values('product_id', 'product__product', 'product__price')
+        .annotate(score=Sum(F('quantity') * _decay(ranking, today)))
+        .order_by('-score', 'product_id')[:limit]
+    )
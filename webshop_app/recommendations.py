@@ -0,0 +1,179 @@
+"""
+"Customers also bought" recommendations.
+
+Co-occurrence matrix C (products x products) counts baskets containing both products. Baskets are
+orders and current carts. For basket x product incidence matrix B the co-occurrence is C = Bᵀ·B.
+
+The order part of C is kept in a state file (.npz) together with the last order it includes, so
+a run only adds orders placed since the previous one (C += Bᵀ·B of new orders). Processed orders
+are tracked by `exports.OrderWatermark`, so orders committed out of id order are added as well. Carts change
+all the time, so they are counted again on every run and never stored. Top-K neighbours of every
+changed product are written to ProductRecommendation, which the product page reads with a single
+indexed lookup.
+"""
+import os
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from scipy import sparse
+
+from . import catalog
+from .exports import RESERVED_CHECKPOINT_PREFIX, OrderWatermark
+from .models import Cart, OrderLine, Product, ProductRecommendation
+
+# Name of ExportCheckpoint holding the last order included in the stored matrix.
+CHECKPOINT = f'{RESERVED_CHECKPOINT_PREFIX}recommendations'
+
+# Number of products whose recommendations are replaced by one DELETE & INSERT.
+WRITE_BATCH = 1000
+
+
+class State:
+    """ Order co-occurrence matrix with the last included order & products of carts counted by the last run. """
+
+    def __init__(self, matrix, last_order_id=0, cart_products=()):
+        self.matrix = matrix
+        self.last_order_id = last_order_id
+        self.cart_products = set(cart_products)
+
+    @classmethod
+    def empty(cls):
+        return cls(sparse.csr_matrix((0, 0), dtype=np.int32))
+
+    @classmethod
+    def load(cls, path):
+        """ Returns stored state or None when the file does not exist. """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            matrix = sparse.csr_matrix(
+                (stored['data'], stored['indices'], stored['indptr']), shape=tuple(stored['shape']),
+            )
+            return cls(matrix, int(stored['last_order_id']), stored['cart_products'].tolist())
+
+    def save(self, path):
+        """ Writes the state atomically. """
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as file:
+            np.savez_compressed(
+                file,
+                data=self.matrix.data,
+                indices=self.matrix.indices,
+                indptr=self.matrix.indptr,
+                shape=np.array(self.matrix.shape),
+                last_order_id=np.array(self.last_order_id),
+                cart_products=np.array(sorted(self.cart_products), dtype=np.int64),
+            )
+        os.replace(temporary, path)
+
+
+def cooccurrence(baskets, products, size):
+    """
+    Returns `size` x `size` matrix counting baskets which contain both products,
+    baskets are given as (basket id, product id) pairs.
+    """
+    if not len(baskets):
+        return sparse.csr_matrix((size, size), dtype=np.int32)
+    rows = np.unique(baskets, return_inverse=True)[1]
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, products)), shape=(rows.max() + 1, size),
+    )
+    # Product listed twice in one basket counts once.
+    incidence.data[:] = 1
+    matrix = (incidence.T @ incidence).tocsr()
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _resize(matrix, size):
+    matrix = matrix.tocsr()
+    if matrix.shape[0] < size:
+        matrix.resize((size, size))
+    return matrix
+
+
+def order_chunks(watermark, chunk_size):
+    """
+    Yields (order ids, product ids) arrays of lines of orders not processed according to `watermark`,
+    about `chunk_size` lines at once. Lines of one order are always in the same chunk.
+    Orders are added to the watermark.
+    """
+    lines = (
+        watermark.filter(OrderLine.objects.filter(product_id__isnull=False))
+        .order_by('order_id')
+        .values_list('order_id', 'order__order_date', 'product_id')
+    )
+    orders, products = [], []
+    for order_id, order_date, product_id in lines.iterator(chunk_size=chunk_size):
+        if not orders or order_id != orders[-1]:
+            if len(orders) >= chunk_size:
+                yield np.array(orders, dtype=np.int64), np.array(products, dtype=np.int64)
+                orders, products = [], []
+            watermark.add(order_id, order_date)
+        orders.append(order_id)
+        products.append(product_id)
+    if orders:
+        yield np.array(orders, dtype=np.int64), np.array(products, dtype=np.int64)
+
+
+def top_neighbours(matrix, product_id, alive, top_k):
+    """ Returns [(recommended product id, score)] of the strongest `top_k` existing neighbours. """
+    start, end = matrix.indptr[product_id], matrix.indptr[product_id + 1]
+    columns = matrix.indices[start:end]
+    scores = matrix.data[start:end]
+    keep = alive[columns]
+    columns, scores = columns[keep], scores[keep]
+    best = np.lexsort((columns, -scores))[:top_k]
+    return [(int(columns[i]), int(scores[i])) for i in best]
+
+
+def update(path, top_k=10, chunk_size=100000, rebuild=False):
+    """
+    Adds orders placed since the previous run (all orders with `rebuild`) and current carts to the matrix
+    and rewrites recommendations of changed products. Returns (number of processed order lines, changed products).
+    Stored state not matching the checkpoint in the database (e.g. lost file) triggers the full rebuild.
+    """
+    watermark = OrderWatermark(CHECKPOINT)
+    state = None if rebuild else State.load(path)
+    if state is None or state.last_order_id != watermark.last_order_id:
+        state = State.empty()
+        watermark = OrderWatermark(CHECKPOINT, reset=True)
+        rebuild = True
+
+    size = (Product.objects.aggregate(size=Max('id'))['size'] or 0) + 1
+    matrix = _resize(state.matrix, size)
+    changed = set()
+    lines = 0
+    for orders, products in order_chunks(watermark, chunk_size):
+        matrix = matrix + cooccurrence(orders, products, size)
+        changed.update(np.unique(products).tolist())
+        lines += len(orders)
+
+    cart_lines = np.array(list(Cart.objects.values_list('user_id', 'product_id')), dtype=np.int64).reshape(-1, 2)
+    cart_products = set(np.unique(cart_lines[:, 1]).tolist())
+    combined = matrix + cooccurrence(cart_lines[:, 0], cart_lines[:, 1], size)
+    changed |= cart_products | {product_id for product_id in state.cart_products if product_id < size}
+    if rebuild:
+        changed |= set(np.flatnonzero(np.diff(combined.indptr)).tolist())
+        changed |= set(ProductRecommendation.objects.values_list('product_id', flat=True).distinct())
+
+    alive = np.zeros(size, dtype=bool)
+    alive[list(Product.objects.values_list('id', flat=True))] = True
+    changed = sorted(product_id for product_id in changed if alive[product_id])
+    with transaction.atomic():
+        for start in range(0, len(changed), WRITE_BATCH):
+            batch = changed[start:start + WRITE_BATCH]
+            ProductRecommendation.objects.filter(product_id__in=batch).delete()
+            Product.objects.filter(id__in=batch).update(updated_at=timezone.now())
+            ProductRecommendation.objects.bulk_create([
+                ProductRecommendation(product_id=product_id, recommended_id=recommended_id, score=score, rank=rank)
+                for product_id in batch
+                for rank, (recommended_id, score) in enumerate(top_neighbours(combined, product_id, alive, top_k), 1)
+            ])
+        watermark.save()
+        State(matrix, watermark.last_order_id, cart_products).save(path)
+    catalog.invalidate_product_details(changed)
+    return lines, len(changed)
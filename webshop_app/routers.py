@@ -0,0 +1,100 @@
+"""
+Primary/replica database routing.
+
+Reads go to the 'replica' database, writes to 'default' (primary). A client which has written
+anything is pinned to the primary for REPLICA_PIN_SECONDS (remembered in a cookie by
+`ReplicaPinMiddleware`), so it never reads stale data missing its own cart lines or comments.
+Reads inside a transaction use the primary as well.
+
+Data stored in shared caches is read from the primary (`primary()`) for REPLICA_PIN_SECONDS after
+a change of the catalog (see `catalog.fresh()`): a replica lagging behind would otherwise keep stale
+rows cached long after the replica has caught up.
+"""
+import contextlib
+import contextvars
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+ROUTER = 'webshop_app.routers.PrimaryReplicaRouter'
+PIN_COOKIE = 'primary_pin'
+
+_pinned = contextvars.ContextVar('webshop_pinned_to_primary', default=False)
+_written = contextvars.ContextVar('webshop_written_to_primary', default=False)
+
+
+def pin():
+    """ Sends further reads of the current request (& client) to the primary. """
+    _pinned.set(True)
+    _written.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+@contextlib.contextmanager
+def primary():
+    """ Sends reads inside the block (or decorated function) to the primary, without pinning the client. """
+    pinned = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(pinned)
+
+
+class PrimaryReplicaRouter:
+    """ Routes reads to the replica unless the client is pinned to the primary. """
+
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        pin()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """
+    Restores pinning of the client from the cookie and sets the cookie after requests which wrote to the database.
+    Not used when the router is not installed.
+    """
+
+    def __init__(self, get_response):
+        if ROUTER not in settings.DATABASE_ROUTERS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = _pinned.set(self.pinned_until(request) > time.time())
+        written = _written.set(False)
+        try:
+            response = self.get_response(request)
+            if _written.get():
+                seconds = settings.REPLICA_PIN_SECONDS
+                response.set_cookie(
+                    PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds, httponly=True, samesite='Lax',
+                )
+            return response
+        finally:
+            _written.reset(written)
+            _pinned.reset(pinned)
+
+    @staticmethod
+    def pinned_until(request):
+        try:
+            return int(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            return 0
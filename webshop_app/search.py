@@ -0,0 +1,153 @@
+"""
+Product search.
+
+On PostgreSQL queries run against the trigger maintained `Product.search_vector` column
+with a GIN index. Other databases (SQLite, test runs) use `InvertedIndex`, an in-process
+index built from the Product table on first use and updated by the signals in `signals.py`.
+"""
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections, router
+from django.db.models import F
+
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Weight of a token found in product's name and in its description.
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+RESULT_FIELDS = ('id', 'product', 'price', 'available')
+
+
+def tokenize(text):
+    """ Splits text into lowercase tokens. """
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class InvertedIndex:
+    """ In-memory inverted index of product names & descriptions with prefix matching. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._postings = defaultdict(dict)  # token -> {product_id: weight}
+        self._documents = {}  # product_id -> set of tokens
+        self._terms = []  # sorted tokens, used for prefix lookups
+
+    @property
+    def built(self):
+        return self._built
+
+    def build(self):
+        """ Indexes all products. """
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            products = Product.objects.values_list('id', 'product', 'description').iterator(chunk_size=2000)
+            for product_id, name, description in products:
+                self._add(product_id, name, description)
+            self._terms = sorted(self._postings)
+            self._built = True
+
+    def _add(self, product_id, name, description):
+        weights = defaultdict(int)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+        for token, weight in weights.items():
+            self._postings[token][product_id] = weight
+        self._documents[product_id] = set(weights)
+
+    def _remove(self, product_id):
+        for token in self._documents.pop(product_id, ()):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                position = bisect.bisect_left(self._terms, token)
+                if position < len(self._terms) and self._terms[position] == token:
+                    del self._terms[position]
+
+    def update(self, product_id, name, description):
+        """ Re-indexes single product. Does nothing until the index has been built. """
+        with self._lock:
+            if not self._built:
+                return
+            self._remove(product_id)
+            self._add(product_id, name, description)
+            for token in self._documents[product_id]:
+                position = bisect.bisect_left(self._terms, token)
+                if position == len(self._terms) or self._terms[position] != token:
+                    self._terms.insert(position, token)
+
+    def remove(self, product_id):
+        """ Drops product from the index. """
+        with self._lock:
+            if self._built:
+                self._remove(product_id)
+
+    def _prefixed(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + '\uffff')
+        return self._terms[start:end]
+
+    def search(self, query, limit=50):
+        """ Returns ids of products matching every token of the query as a prefix, best first. """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        if not self._built:
+            self.build()
+        with self._lock:
+            scores = None
+            for token in tokens:
+                matches = defaultdict(int)
+                for term in self._prefixed(token):
+                    for product_id, weight in self._postings[term].items():
+                        matches[product_id] = max(matches[product_id], weight)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        product_id: score + matches[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in matches
+                    }
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, score in ranked[:limit]]
+
+
+index = InvertedIndex()
+
+
+def uses_postgres():
+    """ Checks if products are read from PostgreSQL. """
+    return connections[router.db_for_read(Product)].vendor == 'postgresql'
+
+
+def search_products(query, limit=50):
+    """ Returns list of products (as dictionaries) matching the query, best first. """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    if uses_postgres():
+        search_query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), search_type='raw', config='simple')
+        return list(
+            Product.objects
+            .filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', 'id')
+            .values(*RESULT_FIELDS)[:limit]
+        )
+    ids = index.search(query, limit=limit)
+    products = {product['id']: product for product in Product.objects.filter(id__in=ids).values(*RESULT_FIELDS)}
+    return [products[product_id] for product_id in ids if product_id in products]
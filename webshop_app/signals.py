@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import catalog, jobs, search
+from .models import Category, Comment, Product
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, raw=False, **kwargs):
+    """
+    Stores category the product belonged to before save, so both listings get invalidated.
+    Drops variants of replaced picture.
+    """
+    instance._previous_category_id = None
+    instance._picture_changed = bool(instance.picture)
+    if instance.pk and not raw:
+        previous = Product.objects.filter(pk=instance.pk).values_list('category_id', 'picture').first()
+        if previous is not None:
+            instance._previous_category_id, picture = previous
+            instance._picture_changed = (picture or '') != (instance.picture.name or '')
+    if instance._picture_changed:
+        instance.picture_variants = {}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    """
+    Drops cached product details, listings of its category and facet counts once the change is committed,
+    so concurrent requests can not cache the old row again.
+    """
+    product_id, category_ids = instance.pk, {instance.category_id, getattr(instance, '_previous_category_id', None)}
+
+    def invalidate():
+        catalog.invalidate_products()
+        catalog.invalidate_product(product_id)
+        for category_id in category_ids:
+            catalog.invalidate_category(category_id)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Product)
+def generate_picture_variants(sender, instance, raw=False, **kwargs):
+    """ Leaves scaling of new picture to a background job. """
+    if instance.picture and getattr(instance, '_picture_changed', False) and not raw:
+        jobs.enqueue('generate_image_variants', product_id=instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """ Refreshes product in the in-process search index. """
+    search.index.update(instance.pk, instance.product, instance.description)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """ Drops product from the in-process search index. """
+    search.index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    """ Drops cached category list, listings of the category and facet counts once the change is committed. """
+    category_id = instance.pk
+
+    def invalidate():
+        catalog.invalidate_categories()
+        catalog.invalidate_products()
+        catalog.invalidate_category(category_id)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    """ Marks the commented product page as changed and drops its cached details once the change is committed. """
+    product_id = instance.product_id
+    Product.objects.filter(pk=product_id).update(updated_at=timezone.now())
+
+    def invalidate():
+        catalog.invalidate_product(product_id)
+        catalog.invalidate_comments(product_id)
+
+    transaction.on_commit(invalidate)
@@ -0,0 +1,26 @@
+from django import template
+from django.utils.html import format_html
+
+from webshop_app import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_picture(variants, alt, sizes, width):
+    """
+    Renders <picture> offering WebP & fallback variants of the product picture, browser picks the smallest one
+    matching `sizes`. `width` is the width (px) of the fallback for browsers without srcset support.
+    Renders nothing until variants are generated.
+    """
+    if not variants:
+        return ''
+    extension, url = images.fallback(variants, width)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        images.srcset(variants, 'webp'), sizes,
+        url, images.srcset(variants, extension), sizes, variants['width'], variants['height'], alt,
+    )
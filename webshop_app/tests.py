@@ -1,6 +1,33 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from PIL import Image
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, router
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    advisor, benchmark, cart, catalog, checkout, images, jobs, pagination, rankings, recommendations, routers, search,
+)
+from .middleware import RequestStats
+from .models import Address, Cart, Category, Comment, ExportCheckpoint, Job, Order, OrderLine, Product, \
+    ProductSalesDaily, Profile
 
 
 class TestUser(TestCase):
@@ -44,3 +71,1328 @@ class TestLoggedView(TestCase):
         self.client.force_login(user=user)
         response = self.client.get(reverse('logged'))
         self.assertEqual(response.status_code, 200)
+
+    @override_settings(ACCOUNT_PAGE_SIZE=5)
+    def test_order_history_pages(self):
+        """ Orders are shown page by page, the newest first, with the same number of queries on every page. """
+        user = User.objects.create_user('test_user', 'test_password')
+        self.client.force_login(user=user)
+        orders = [
+            Order.objects.create(user=user, order_date=timezone.now() - timedelta(days=day)) for day in range(12)
+        ]
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(self.logged_url)
+        self.assertEqual([order.id for order in response.context['order_form']], [order.id for order in orders[:5]])
+        cursor = response.context['order_form'].next_cursor
+        with CaptureQueriesContext(connection) as next_page:
+            response = self.client.get(self.logged_url, {'after': cursor})
+        self.assertEqual([order.id for order in response.context['order_form']], [order.id for order in orders[5:10]])
+        self.assertEqual(len(first_page), len(next_page))
+
+    def test_addresses_fragment(self):
+        """ Addresses are loaded separately from the account page. """
+        user = User.objects.create_user('test_user', 'test_password')
+        profile = Profile.objects.create(user=user, birth_date='1990-01-01')
+        Address.objects.create(profile=profile, name='Dom', city='Kraków', address='ul. Długa 1', zip_code='30-001')
+        self.client.force_login(user=user)
+        self.assertNotContains(self.client.get(self.logged_url), 'Dom</a>')
+        self.assertContains(self.client.get(reverse('addresses')), 'Dom</a>')
+
+    def test_tampered_cursors(self):
+        """ Account pages reject cursors with values of wrong types. """
+        user = User.objects.create_user('test_user', 'test_password')
+        self.client.force_login(user=user)
+        cursor = pagination.encode_cursor(['wczoraj', 'abc'])
+        self.assertRedirects(self.client.get(self.logged_url, {'after': cursor}), self.logged_url)
+        self.assertEqual(self.client.get(reverse('addresses'), {'after': cursor}).status_code, 400)
+
+
+class TestCatalogCache(TestCase):
+    """ Tests cached category & product pages. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.client = Client()
+        self.category = Category.objects.create(category='Procesory', slug='procesory')
+        self.product = Product.objects.create(category=self.category, product='Ryzen 5', price='799.00')
+        self.user = User.objects.create_user('test_user', password='12345')
+
+    def test_product_page_is_cached(self):
+        """ Second visit of the product page does not query the database. """
+        url = reverse('product', kwargs={'pk': self.product.pk})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Ryzen 5')
+
+    def test_comment_invalidates_product_page(self):
+        """ New comment is visible right after it was added. """
+        url = reverse('product', kwargs={'pk': self.product.pk})
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(user=self.user, product=self.product, text='Świetny procesor')
+        response = self.client.get(url)
+        self.assertContains(response, 'Świetny procesor')
+
+    def test_product_change_invalidates_category(self):
+        """ Category listing shows changed product name. """
+        url = reverse('category', kwargs={'slug': 'procesory'})
+        self.client.get(url)
+        product = Product.objects.get(pk=self.product.pk)
+        product.product = 'Ryzen 7'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Ryzen 7')
+
+    def test_invalidation_waits_for_commit(self):
+        """ Cached entries are dropped after commit, a request before it could cache the old row again. """
+        url = reverse('category', kwargs={'slug': 'procesory'})
+        self.client.get(url)
+        product = Product.objects.get(pk=self.product.pk)
+        product.product = 'Ryzen 7'
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.save()
+        self.assertNotContains(self.client.get(url), 'Ryzen 7')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(url), 'Ryzen 7')
+
+    def test_missing_product(self):
+        """ Not existing product returns 404. """
+        response = self.client.get(reverse('product', kwargs={'pk': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_navigation(self):
+        """ Every category is in the navigation, which costs no query once cached. """
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, f'{reverse("category", kwargs={"slug": "procesory"})}">Procesory (0)')
+
+    def test_navigation_is_invalidated(self):
+        """ New category & changed product counts are shown right away. """
+        self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category='Karty graficzne', slug='karty-graficzne')
+            self.product.stock = 3
+            self.product.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Karty graficzne (0)')
+        self.assertContains(response, 'Procesory (1)')
+
+
+class TestCategoryView(TestCase):
+    """ Tests paginated category listing. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.client = Client()
+        self.category = Category.objects.create(category='Karty graficzne', slug='karty-graficzne')
+        self.url = reverse('category', kwargs={'slug': 'karty-graficzne'})
+        Product.objects.bulk_create([
+            Product(category=self.category, product=f'GPU {i:02}', price=100 + i % 3)
+            for i in range(30)
+        ])
+
+    def collect_pages(self, sort):
+        """ Walks through all pages and returns product names. """
+        names = []
+        response = self.client.get(self.url, {'sort': sort})
+        while True:
+            page = response.context['form']
+            names.extend(product['product'] for product in page)
+            if not page.has_next:
+                return names
+            response = self.client.get(self.url, {'sort': sort, 'after': page.next_cursor})
+
+    def test_pages_cover_category(self):
+        """ Every product is listed exactly once, in the requested order. """
+        names = self.collect_pages('-price')
+        self.assertEqual(len(names), 30)
+        self.assertEqual(len(set(names)), 30)
+        prices = list(Product.objects.order_by('-price', '-id').values_list('product', flat=True))
+        self.assertEqual(names, prices)
+
+    def test_tampered_cursor(self):
+        """ Cursors with values of wrong type or range are rejected instead of failing the page. """
+        for values in (['abc', 1], [1, 'abc'], ['NaN', 1], [1, 2 ** 70], [None, 1], [[1], 1], [1]):
+            response = self.client.get(self.url, {'sort': 'price', 'after': pagination.encode_cursor(values)})
+            self.assertEqual(response.status_code, 302, values)
+
+    def test_unknown_category(self):
+        """ Not existing category returns 404. """
+        response = self.client.get(reverse('category', kwargs={'slug': 'brak'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_legacy_url_redirects(self):
+        """ Old hard-coded url redirects to the slug url. """
+        Category.objects.update_or_create(id=2, defaults={'category': 'GPU', 'slug': 'gpu-stare'})
+        response = self.client.get(reverse('category', kwargs={'slug': 'gpu'}))
+        self.assertRedirects(response, reverse('category', kwargs={'slug': 'gpu-stare'}), status_code=301)
+
+    def test_category_with_legacy_slug(self):
+        """ Category whose slug is one of the old urls is displayed instead of redirected. """
+        Category.objects.update_or_create(id=1, defaults={'category': 'CPU', 'slug': 'cpu'})
+        Category.objects.update_or_create(id=2, defaults={'category': 'Dyski', 'slug': 'dyski'})
+        Category.objects.create(category='GPU', slug='gpu')
+        self.assertEqual(self.client.get(reverse('category', kwargs={'slug': 'cpu'})).status_code, 200)
+        response = self.client.get(reverse('category', kwargs={'slug': 'gpu'}))
+        self.assertEqual(response.context['category']['category'], 'GPU')
+
+
+class TestAddToCart(TestCase):
+    """ Tests adding products to the cart. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.client = Client()
+        self.user = User.objects.create_user('test_user', password='12345')
+        self.client.force_login(user=self.user)
+        category = Category.objects.create(category='Płyty główne', slug='plyty-glowne')
+        self.product = Product.objects.create(category=category, product='B650', price='899.00', stock=5)
+        self.url = reverse('add-to-cart', kwargs={'pk': self.product.pk})
+
+    def test_quantity_is_merged(self):
+        """ Adding the same product twice increases quantity of one cart line. """
+        self.client.get(self.url)
+        self.client.get(self.url, {'quantity': 3})
+        line = Cart.objects.get(user=self.user, product=self.product)
+        self.assertEqual(line.quantity, 4)
+
+    def test_invalid_quantity(self):
+        """ Invalid quantity does not change the cart. """
+        self.client.get(self.url, {'quantity': 0})
+        self.assertFalse(Cart.objects.exists())
+
+
+class TestAnonymousCart(TestCase):
+    """ Tests cart of visitors who are not logged in. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.client = Client()
+        self.user = User.objects.create_user('test_user', password='12345')
+        category = Category.objects.create(category='Płyty główne', slug='plyty-glowne')
+        self.first = Product.objects.create(category=category, product='B650', price='899.00', stock=5)
+        self.second = Product.objects.create(category=category, product='X670', price='1499.00', stock=5)
+
+    def test_cart_is_kept_in_cookie(self):
+        """ Anonymous visitor fills the cart without writing to the database. """
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('add-to-cart', kwargs={'pk': self.first.pk}), {'quantity': 2})
+        self.assertFalse([query for query in captured if not query['sql'].startswith('SELECT')])
+        self.assertFalse(Cart.objects.exists())
+        response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'B650')
+        self.assertContains(response, reverse('remove-from-anonymous-cart', kwargs={'pk': self.first.pk}))
+
+    def test_tampered_cookie_is_ignored(self):
+        """ Cart cookie without valid signature is treated as an empty cart. """
+        self.client.cookies['cart'] = '{"%d": 5}' % self.first.pk
+        self.assertContains(self.client.get(reverse('cart')), 'Koszyk jest pusty!')
+
+    def test_cart_is_merged_on_login(self):
+        """ Anonymous cart is added to the user's cart on login and the cookie is removed. """
+        Cart.objects.create(user=self.user, product=self.first, quantity=1)
+        self.client.get(reverse('add-to-cart', kwargs={'pk': self.first.pk}), {'quantity': 2})
+        self.client.get(reverse('add-to-cart', kwargs={'pk': self.second.pk}))
+        response = self.client.post(reverse('login'), {'username': 'test_user', 'password': '12345'})
+        self.assertEqual(response.cookies['cart'].value, '')
+        self.assertEqual(
+            list(Cart.objects.filter(user=self.user).order_by('product_id').values_list('product_id', 'quantity')),
+            [(self.first.pk, 3), (self.second.pk, 1)],
+        )
+
+    def test_merge_adds_in_database(self):
+        """ Merge never reads quantities of cart lines, so concurrent additions are not overwritten. """
+        Cart.objects.create(user=self.user, product=self.first, quantity=1, reserved=1)
+        with CaptureQueriesContext(connection) as captured:
+            cart.merge(self.user.id, {self.first.pk: 2, self.second.pk: 1, 0: 1})
+        self.assertEqual([query['sql'].split()[0] for query in captured], ['SELECT', 'INSERT'])
+        self.assertEqual(
+            list(Cart.objects.filter(user=self.user).order_by('product_id').values_list('quantity', 'reserved')),
+            [(3, 1), (1, 0)],
+        )
+
+    def test_checkout_requires_login(self):
+        """ Anonymous visitor is sent to the login page to place the order. """
+        self.client.get(reverse('add-to-cart', kwargs={'pk': self.first.pk}))
+        response = self.client.post(reverse('cart'))
+        self.assertRedirects(response, f'/login/?next={reverse("cart")}', fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class TestInventory(TestCase):
+    """ Tests stock reservations. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user('test_user', password='12345')
+        self.client.force_login(user=self.user)
+        category = Category.objects.create(category='Płyty główne', slug='plyty-glowne')
+        self.product = Product.objects.create(category=category, product='B650', price='899.00', stock=5)
+        self.url = reverse('add-to-cart', kwargs={'pk': self.product.pk})
+
+    def test_adding_reserves_stock(self):
+        """ Items added to the cart are taken from stock until the reservation expires. """
+        self.client.get(self.url, {'quantity': 3})
+        line = Cart.objects.get(user=self.user)
+        self.assertEqual(line.reserved, 3)
+        self.assertIsNotNone(line.reserved_until)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+    def test_not_enough_stock(self):
+        """ Product is not added when its stock is too low. """
+        self.client.get(self.url, {'quantity': 6})
+        self.assertFalse(Cart.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_sold_out(self):
+        """ Product becomes unavailable when its last items are reserved, also on cached product page. """
+        product_url = reverse('product', kwargs={'pk': self.product.pk})
+        self.assertContains(self.client.get(product_url), 'Produkt dostępny!')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url, {'quantity': 5})
+        self.product.refresh_from_db()
+        self.assertFalse(self.product.available)
+        self.assertContains(self.client.get(product_url), 'Produkt niedostępny!')
+
+    def test_removing_releases_stock(self):
+        """ Reservation of removed cart line returns to stock. """
+        self.client.get(self.url, {'quantity': 5})
+        line = Cart.objects.get(user=self.user)
+        self.client.get(reverse('remove-from-cart', kwargs={'cart_id': line.id}))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.available), (5, True))
+
+    def test_expired_reservations_are_released(self):
+        """ Sweeper returns expired reservations to stock, checkout takes the items again. """
+        self.client.get(self.url, {'quantity': 2})
+        Cart.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        call_command('release_reservations', batch_size=1, stdout=StringIO())
+        line = Cart.objects.get(user=self.user)
+        self.assertEqual((line.reserved, line.reserved_until), (0, None))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.client.post(reverse('cart'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(OrderLine.objects.get().quantity, 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Concurrent writers need PostgreSQL.')
+class TestInventoryConcurrency(TransactionTestCase):
+    """ Stress test of a single product bought by many concurrent buyers. """
+
+    def test_hot_product_is_not_oversold(self):
+        """ Number of placed orders matches the stock. """
+        call_command('stress_checkout', buyers=60, stock=20, threads=16, stdout=StringIO())
+
+
+class TestCheckout(TestCase):
+    """ Tests placing orders. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.client = Client()
+        self.user = User.objects.create_user('test_user', password='12345')
+        self.client.force_login(user=self.user)
+        self.category = Category.objects.create(category='Procesory', slug='procesory')
+
+    def fill_cart(self, lines):
+        """ Puts `lines` different products into the user's cart. """
+        for i in range(lines):
+            product = Product.objects.create(category=self.category, product=f'CPU {i}', price='100.00', stock=10)
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+
+    def test_order_is_placed(self):
+        """ Cart lines become order lines and the cart is cleared. """
+        self.fill_cart(2)
+        response = self.client.post(reverse('cart'), {'idempotency_key': uuid.uuid4()})
+        order = Order.objects.get(user=self.user)
+        self.assertContains(response, str(order.order_id))
+        self.assertEqual(order.lines.count(), 2)
+        self.assertEqual(OrderLine.objects.filter(order=order, quantity=2, price='100.00').count(), 2)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_repeated_post_creates_one_order(self):
+        """ Retried POST with the same idempotency key does not duplicate the order. """
+        self.fill_cart(1)
+        key = uuid.uuid4()
+        self.client.post(reverse('cart'), {'idempotency_key': key})
+        self.client.post(reverse('cart'), {'idempotency_key': key})
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_constant_number_of_queries(self):
+        """ Checkout of a big cart costs the same number of queries as of a small one. """
+        self.fill_cart(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(reverse('cart'))
+        self.fill_cart(10)
+        with CaptureQueriesContext(connection) as big:
+            self.client.post(reverse('cart'))
+        self.assertEqual(len(small), len(big))
+
+    def test_unavailable_product(self):
+        """ Order is not placed when stock of product in the cart is too low. """
+        self.fill_cart(1)
+        Product.objects.update(stock=1, available=True)
+        self.client.post(reverse('cart'))
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(user=self.user).exists())
+
+
+class TestOrderView(TestCase):
+    """ Tests order details view. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.client = Client()
+        self.user = User.objects.create_user('test_user', password='12345')
+        self.client.force_login(user=self.user)
+        self.order = Order.objects.create(user=self.user)
+        OrderLine.objects.bulk_create([
+            OrderLine(order=self.order, product_name=f'GPU {i}', price='10.00', quantity=2) for i in range(5)
+        ])
+        self.url = reverse('order', kwargs={'order_id': self.order.order_id})
+
+    def test_order_details(self):
+        """ Displays lines of the requested order with a fixed number of queries. """
+        self.client.get(self.url)
+        with self.assertNumQueries(4):
+            # session, user, order, order lines
+            response = self.client.get(self.url)
+        self.assertContains(response, 'GPU 4')
+        self.assertContains(response, '100.00 PLN')
+
+    def test_other_users_order(self):
+        """ User can not see someone else's order. """
+        other = User.objects.create_user('other_user', password='12345')
+        self.client.force_login(user=other)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestSearch(TestCase):
+    """ Tests product search with the in-process index. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        search.index = search.InvertedIndex()
+        self.client = Client()
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        self.ryzen = Product.objects.create(category=category, product='Ryzen 7 7700X', price='1599.00',
+                                            description='8 rdzeni, AM5')
+        self.intel = Product.objects.create(category=category, product='Core i7', price='1699.00',
+                                            description='Konkurent dla Ryzen')
+
+    def test_prefix_and_ranking(self):
+        """ Prefix matches, products with the token in the name go first. """
+        response = self.client.get(reverse('search'), {'q': 'ryz'})
+        self.assertEqual([product['id'] for product in response.context['form']], [self.ryzen.id, self.intel.id])
+
+    def test_all_tokens_have_to_match(self):
+        """ Every token of the query has to match. """
+        self.assertEqual([product['id'] for product in search.search_products('ryzen am5')], [self.ryzen.id])
+
+    def test_index_is_updated_on_save(self):
+        """ Changed and deleted products are refreshed in the built index. """
+        search.search_products('ryzen')
+        self.intel.product = 'Core Ultra'
+        self.intel.description = ''
+        self.intel.save()
+        self.ryzen.delete()
+        self.assertEqual(search.search_products('ryzen'), [])
+        self.assertEqual([product['id'] for product in search.search_products('ultra')], [self.intel.id])
+
+
+class TestCategoryFacets(TestCase):
+    """ Tests filters and facet counts of the category page. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.client = Client()
+        self.cpu = Category.objects.create(category='Procesory', slug='procesory')
+        gpu = Category.objects.create(category='Karty graficzne', slug='karty-graficzne')
+        Product.objects.bulk_create([
+            Product(category=self.cpu, product='CPU A', price='300.00'),
+            Product(category=self.cpu, product='CPU B', price='700.00', available=False),
+            Product(category=self.cpu, product='CPU C', price='800.00'),
+            Product(category=gpu, product='GPU A', price='900.00'),
+            Product(category=gpu, product='GPU B', price='2500.00'),
+        ])
+        self.url = reverse('category', kwargs={'slug': 'procesory'})
+
+    def test_filters_and_counts(self):
+        """ Listing is filtered and every facet count ignores only its own filter. """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'price': '500-1000', 'available': '1'})
+        self.assertEqual([product['product'] for product in response.context['form']], ['CPU C'])
+        facets = response.context['facets']
+        self.assertEqual([facet['count'] for facet in facets['prices']], [1, 1, 0, 0])
+        self.assertEqual(facets['available']['count'], 1)
+        self.assertEqual({facet['category']: facet['count'] for facet in facets['categories']},
+                         {'Procesory': 1, 'Karty graficzne': 1})
+        # categories, listing, facet counts, navigation, bestsellers & trending
+        self.assertEqual(len(queries), 6)
+
+    def test_counts_are_invalidated(self):
+        """ Facet counts are refreshed after product change. """
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(category=self.cpu, product='CPU D', price='100.00')
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['total'], 4)
+        self.assertEqual(response.context['facets']['prices'][0]['count'], 2)
+
+
+@override_settings(PERFORMANCE_INSTRUMENTATION=True, PERFORMANCE_DUPLICATE_QUERY_THRESHOLD=2)
+class TestPerformanceMiddleware(TestCase):
+    """ Tests request instrumentation. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.client = Client()
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        self.product = Product.objects.create(category=category, product='Ryzen 5', price='799.00')
+
+    def test_server_timing_and_log(self):
+        """ Response has Server-Timing header, timings are logged with url name. """
+        with self.assertLogs('webshop_app.performance', level='INFO') as logs:
+            response = self.client.get(reverse('product', kwargs={'pk': self.product.pk}))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        self.assertIn('"url_name": "product"', logs.output[0])
+
+    def test_duplicated_queries(self):
+        """ Statements repeated above threshold are reported. """
+        stats = RequestStats()
+        with stats.track():
+            for _ in range(3):
+                list(Product.objects.filter(pk=self.product.pk))
+            list(Category.objects.all())
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(list(stats.duplicates(3).values()), [3])
+
+
+class TestMetrics(TestCase):
+    """ Tests Prometheus metrics endpoint. """
+
+    def test_metrics(self):
+        """ Requests are counted per route and exposed in text format. """
+        client = Client()
+        client.get(reverse('home'))
+        client.force_login(User.objects.create_user('staff_user', password='12345', is_staff=True))
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('webshop_requests_total{method="GET",route="home",status="200"}', content)
+        self.assertIn('webshop_request_db_queries_bucket{le="0.0",route="home"}', content)
+        self.assertIn('webshop_checkouts_total', content)
+
+    @override_settings(METRICS_TOKEN='sekret')
+    def test_access(self):
+        """ Metrics are available only with the token or to staff, unknown methods share one label value. """
+        client = Client()
+        client.generic('BREW', reverse('home'))
+        self.assertEqual(client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer zle').status_code, 403)
+        response = client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer sekret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('method="OTHER",route="home"', response.content.decode())
+        self.assertNotIn('BREW', response.content.decode())
+
+
+class TestQueryBudgets(TestCase):
+    """ Requests every url of the seeded shop and checks query budgets. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        call_command('seed_catalog', categories=3, products=30, users=5, addresses=10, comments=50, carts=10,
+                     orders=20, seed=1, stdout=StringIO())
+
+    def test_seeded_data(self):
+        """ Requested number of rows is created. """
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(OrderLine.objects.count(), 60)
+
+    def test_every_url_is_benchmarked(self):
+        """ Every named url has a query budget. """
+        self.assertEqual(benchmark.missing_routes(), set())
+
+    def test_query_budgets(self):
+        """ No url exceeds its query budget. """
+        results = benchmark.run(benchmark.default_user(), iterations=2)
+        over_budget = {result.route.name: result.queries for result in results if result.over_budget}
+        self.assertEqual(over_budget, {})
+
+    def test_benchmark_leaves_no_changes(self):
+        """ Writes of benchmarked requests & fixtures are rolled back. """
+        counts = [model.objects.count() for model in (Cart, Comment, Order, Address)]
+        stock = list(Product.objects.order_by('id').values_list('stock', flat=True))
+        benchmark.run(benchmark.default_user(), iterations=1)
+        self.assertEqual([model.objects.count() for model in (Cart, Comment, Order, Address)], counts)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)), stock)
+
+
+class TestImportCatalog(TestCase):
+    """ Tests bulk import of product feeds. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.category = Category.objects.create(category='Procesory', slug='procesory')
+        Product.objects.create(category=self.category, sku='CPU-1', product='Stara nazwa', price='1.00')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        """ Creates feed file. """
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as feed:
+            feed.write(content)
+        return path
+
+    def test_csv_upsert(self):
+        """ Existing products are updated by SKU, new ones created, invalid rows rejected. """
+        path = self.write('feed.csv', (
+            'sku,product,category,price,description,stock\n'
+            'CPU-1,Ryzen 5,Procesory,799.00,6 rdzeni,5\n'
+            'CPU-2,Ryzen 7,procesory,"1299,99",,0\n'
+            'CPU-3,Bez ceny,Procesory,abc,,1\n'
+            'GPU-1,RTX,Karty graficzne,2999,,1\n'
+        ))
+        rejects = os.path.join(self.directory.name, 'rejects.jsonl')
+        call_command('import_catalog', path, rejects=rejects, stdout=StringIO())
+        self.assertEqual(Product.objects.get(sku='CPU-1').product, 'Ryzen 5')
+        self.assertEqual(Product.objects.get(sku='CPU-1').stock, 5)
+        self.assertEqual(str(Product.objects.get(sku='CPU-2').price), '1299.99')
+        self.assertFalse(Product.objects.get(sku='CPU-2').available)
+        with open(rejects, encoding='utf-8') as rejected:
+            self.assertEqual([json.loads(line)['row'] for line in rejected], [3, 4])
+
+    def test_jsonl_resume_from_checkpoint(self):
+        """ Rows imported before the checkpoint are skipped. """
+        lines = [
+            {'sku': f'GPU-{i}', 'product': f'GPU {i}', 'category': 'Karty graficzne', 'price': 100 + i}
+            for i in range(5)
+        ]
+        path = self.write('feed.jsonl', '\n'.join(json.dumps(line) for line in lines))
+        checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+        with open(checkpoint, 'w', encoding='utf-8') as file:
+            json.dump({'rows': 3}, file)
+        call_command('import_catalog', path, checkpoint=checkpoint, resume=True, create_categories=True,
+                     batch_size=1, stdout=StringIO())
+        self.assertEqual(sorted(Product.objects.filter(sku__startswith='GPU').values_list('sku', flat=True)),
+                         ['GPU-3', 'GPU-4'])
+        with open(checkpoint, encoding='utf-8') as file:
+            self.assertEqual(json.load(file), {'rows': 5})
+
+    def test_jsonl_invalid_values(self):
+        """ Not finite prices & structured descriptions are rejected, scalar descriptions stored as text. """
+        lines = [
+            {'sku': 'CPU-2', 'product': 'NaN', 'category': 'Procesory', 'price': 'NaN'},
+            {'sku': 'CPU-3', 'product': 'Inf', 'category': 'Procesory', 'price': 'Infinity'},
+            {'sku': 'CPU-4', 'product': 'Opis', 'category': 'Procesory', 'price': 1, 'description': {'a': 1}},
+            {'sku': 'CPU-5', 'product': 'Liczba', 'category': 'Procesory', 'price': 1, 'description': 42},
+        ]
+        path = self.write('feed.jsonl', '\n'.join(json.dumps(line) for line in lines))
+        rejects = os.path.join(self.directory.name, 'rejects.jsonl')
+        call_command('import_catalog', path, rejects=rejects, stdout=StringIO())
+        with open(rejects, encoding='utf-8') as rejected:
+            self.assertEqual([json.loads(line)['row'] for line in rejected], [1, 2, 3])
+        self.assertEqual(Product.objects.get(sku='CPU-5').description, '42')
+
+    def test_reserved_items_are_not_sold_twice(self):
+        """ Items reserved in carts are subtracted from stock of the feed and return to it when they expire. """
+        product = Product.objects.get(sku='CPU-1')
+        Product.objects.filter(id=product.id).update(stock=5, available=True)
+        cart.add_product(User.objects.create_user('test_user').id, product.id, 3)
+        path = self.write('feed.csv', 'sku,product,category,price,stock\nCPU-1,Ryzen 5,Procesory,799,5\n')
+        call_command('import_catalog', path, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 2)
+        Cart.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        call_command('release_reservations', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+
+    def test_cached_product_is_invalidated(self):
+        """ Imported changes are visible on cached product page. """
+        product = Product.objects.get(sku='CPU-1')
+        url = reverse('product', kwargs={'pk': product.pk})
+        Client().get(url)
+        path = self.write('feed.csv', 'sku,product,category,price\nCPU-1,Nowa nazwa,Procesory,5\n')
+        call_command('import_catalog', path, stdout=StringIO())
+        self.assertContains(Client().get(url), 'Nowa nazwa')
+
+
+class TestOrderExport(TestCase):
+    """ Tests streaming export of orders. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.client = Client()
+        self.staff = User.objects.create_user('staff_user', password='12345', is_staff=True)
+        self.customer = User.objects.create_user('customer', password='12345')
+        for day in (1, 2):
+            order = Order.objects.create(user=self.customer, order_date=f'2024-01-0{day}T12:00:00+00:00')
+            OrderLine.objects.create(order=order, product_name=f'CPU {day}', price='10.00', quantity=day)
+        self.url = reverse('export-orders')
+
+    def export(self, **params):
+        """ Returns exported lines. """
+        response = self.client.get(self.url, params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_staff_only(self):
+        """ Regular users can not export orders. """
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_csv_with_date_range(self):
+        """ Only orders placed in the date range are exported. """
+        self.client.force_login(self.staff)
+        lines = self.export(since='2024-01-02', until='2024-01-02')
+        self.assertEqual(lines[0], 'order_id,order_date,username,email,product_id,product,price,quantity')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('customer', lines[1])
+        self.assertIn('CPU 2', lines[1])
+
+    def test_incremental_jsonl(self):
+        """ Second run of incremental export contains only new orders. """
+        self.client.force_login(self.staff)
+        self.assertEqual(len(self.export(format='jsonl', checkpoint='finance')), 2)
+        order = Order.objects.create(user=self.customer)
+        OrderLine.objects.create(order=order, product_name='GPU', price='99.00', quantity=1)
+        lines = self.export(format='jsonl', checkpoint='finance')
+        self.assertEqual([json.loads(line)['product'] for line in lines], ['GPU'])
+        self.assertEqual(ExportCheckpoint.objects.get(name='finance').last_order_id, order.id)
+
+    def test_incremental_late_commit(self):
+        """ Order committed after an order with higher id was exported is exported by the next run. """
+        self.client.force_login(self.staff)
+        self.export(format='jsonl', checkpoint='finance')
+        last_id = Order.objects.order_by('-id').values_list('id', flat=True)[0]
+        # Order last_id + 1 is still in an open transaction.
+        order = Order.objects.create(id=last_id + 2, user=self.customer)
+        OrderLine.objects.create(order=order, product_name='GPU', price='99.00', quantity=1)
+        self.assertEqual(len(self.export(format='jsonl', checkpoint='finance')), 1)
+        late = Order.objects.create(id=last_id + 1, user=self.customer)
+        OrderLine.objects.create(order=late, product_name='SSD', price='50.00', quantity=1)
+        lines = self.export(format='jsonl', checkpoint='finance')
+        self.assertEqual([json.loads(line)['product'] for line in lines], ['SSD'])
+        self.assertEqual(self.export(format='jsonl', checkpoint='finance'), [])
+        checkpoint = ExportCheckpoint.objects.get(name='finance')
+        self.assertEqual((checkpoint.last_order_id, checkpoint.pending_order_ids), (last_id + 2, []))
+
+    def test_missing_order_is_forgotten(self):
+        """ Missing order id is not looked for once ORDER_COMMIT_TIMEOUT has passed. """
+        self.client.force_login(self.staff)
+        first, second = Order.objects.order_by('id').values_list('id', flat=True)
+        now = time.time()
+        ExportCheckpoint.objects.create(name='finance', last_order_id=second + 10, pending_order_ids=[
+            [first, now], [second + 5, now - settings.ORDER_COMMIT_TIMEOUT - 1], [second + 6, now],
+        ])
+        lines = self.export(format='jsonl', checkpoint='finance')
+        self.assertEqual([json.loads(line)['product'] for line in lines], ['CPU 1'])
+        self.assertEqual(ExportCheckpoint.objects.get(name='finance').pending_order_ids, [[second + 6, now]])
+
+
+# Admin templates use static files, which are not collected in tests.
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestAdmin(TestCase):
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.client = Client()
+        self.admin = User.objects.create_superuser('admin_user', password='12345')
+        self.client.force_login(self.admin)
+        self.category = Category.objects.create(category='Admin', slug='admin')
+        self.products = [
+            Product.objects.create(category=self.category, product=f'Admin product {number}', price=10, stock=3)
+            for number in range(3)
+        ]
+
+    def changelist_queries(self, model):
+        """ Returns number of queries executed by model's changelist. """
+        url = reverse(f'admin:webshop_app_{model}_changelist')
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(captured)
+
+    def test_cart_changelist_queries(self):
+        """ Number of changelist queries does not depend on number of rows. """
+        Cart.objects.create(user=self.admin, product=self.products[0])
+        queries = self.changelist_queries('cart')
+        for product in self.products[1:]:
+            customer = User.objects.create_user(f'customer_{product.id}', password='12345')
+            Cart.objects.create(user=customer, product=product)
+        self.assertEqual(self.changelist_queries('cart'), queries)
+
+    def test_order_changelist_queries(self):
+        """ Order changelist loads users together with orders. """
+        Order.objects.create(user=self.admin)
+        queries = self.changelist_queries('order')
+        for number in range(3):
+            Order.objects.create(user=User.objects.create_user(f'buyer_{number}', password='12345'))
+        self.assertEqual(self.changelist_queries('order'), queries)
+
+    def test_mark_unavailable(self):
+        """ Action marks selected products as unavailable. """
+        self.client.post(reverse('admin:webshop_app_product_changelist'), {
+            'action': 'mark_unavailable',
+            '_selected_action': [product.id for product in self.products[:2]],
+        })
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('available', flat=True)), [False, False, True],
+        )
+
+    def test_reserved_items_of_unavailable_product(self):
+        """ Items reserved before the product was marked unavailable can still be ordered. """
+        cart.add_product(self.admin.id, self.products[0].id, 2)
+        self.client.post(reverse('admin:webshop_app_product_changelist'), {
+            'action': 'mark_unavailable',
+            '_selected_action': [self.products[0].id],
+        })
+        self.client.post(reverse('cart'))
+        self.assertEqual(OrderLine.objects.get().quantity, 2)
+        self.assertEqual(Product.objects.get(id=self.products[0].id).stock, 0)
+
+    def test_restock_in_changelist(self):
+        """ Products withdrawn without stock go on sale again when stock is set in the changelist. """
+        Product.objects.update(stock=0, available=False)
+        data = {'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 3, '_save': 'Zapisz'}
+        for number, product in enumerate(self.products):
+            data.update({f'form-{number}-id': product.id, f'form-{number}-stock': 5 if number else 0})
+        self.client.post(reverse('admin:webshop_app_product_changelist'), data)
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('available', flat=True)), [False, True, True],
+        )
+
+    def test_product_search(self):
+        """ Products are found by name prefix and by exact SKU. """
+        Product.objects.filter(id=self.products[2].id).update(sku='SKU-2')
+        url = reverse('admin:webshop_app_product_changelist')
+        self.assertEqual(len(self.client.get(url, {'q': 'admin'}).context['cl'].result_list), 3)
+        self.assertEqual(list(self.client.get(url, {'q': 'SKU-2'}).context['cl'].result_list), [self.products[2]])
+
+
+class TestIndexAdvisor(TestCase):
+    """ Tests query plan advisor. """
+
+    def test_candidate_index(self):
+        """ Index is built from equality conditions and ordering, join conditions are ignored. """
+        sql = (
+            'SELECT "webshop_app_comment"."id" FROM "webshop_app_comment" INNER JOIN "auth_user" '
+            'ON ("webshop_app_comment"."user_id" = "auth_user"."id") '
+            'WHERE "webshop_app_comment"."product_id" = 1 ORDER BY "webshop_app_comment"."text_date" DESC'
+        )
+        self.assertEqual(advisor.candidate_index(sql, 'webshop_app_comment'), ['product_id', '-text_date'])
+
+    def test_report(self):
+        """ Every route is explained, models already have the advised indexes, nothing is written. """
+        call_command('seed_catalog', categories=2, products=20, users=3, comments=20, carts=5, orders=5, seed=1,
+                     stdout=StringIO())
+        counts = [model.objects.count() for model in (User, Cart, Comment, Order, Address)]
+        output = StringIO()
+        call_command('advise_indexes', stdout=output)
+        self.assertIn('Candidate indexes:\n  None.', output.getvalue())
+        self.assertEqual([model.objects.count() for model in (User, Cart, Comment, Order, Address)], counts)
+
+
+@override_settings(DATABASE_ROUTERS=[routers.ROUTER])
+class TestReplicaRouter(SimpleTestCase):
+    """ Tests routing of reads to the replica with pinning of writers to the primary. """
+
+    def request(self, view, **cookies):
+        """ Passes request with `cookies` through the pinning middleware to `view`. """
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return routers.ReplicaPinMiddleware(view)(request)
+
+    def test_reads_use_replica(self):
+        """ Reads of client who has not written anything go to the replica. """
+        aliases = []
+        response = self.request(lambda request: aliases.append(router.db_for_read(Product)) or HttpResponse())
+        self.assertEqual(aliases, [routers.REPLICA])
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_write_pins_client(self):
+        """ After a write, reads of the request and of the following requests go to the primary. """
+        def view(request):
+            aliases.append(router.db_for_write(Cart))
+            aliases.append(router.db_for_read(Cart))
+            return HttpResponse()
+
+        pinned = routers.is_pinned()
+        aliases = []
+        response = self.request(view)
+        self.assertEqual(aliases, ['default', 'default'])
+        self.assertEqual(routers.is_pinned(), pinned)
+        cookie = response.cookies[routers.PIN_COOKIE]
+        aliases = []
+        self.request(lambda request: aliases.append(router.db_for_read(Cart)) or HttpResponse(),
+                     **{routers.PIN_COOKIE: cookie.value})
+        self.assertEqual(aliases, ['default'])
+
+    def test_primary_block(self):
+        """ Reads inside `primary()` go to the primary without pinning the client. """
+        def view(request):
+            with routers.primary():
+                aliases.append(router.db_for_read(Product))
+            aliases.append(router.db_for_read(Product))
+            return HttpResponse()
+
+        aliases = []
+        response = self.request(view)
+        self.assertEqual(aliases, ['default', routers.REPLICA])
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_fresh_after_change(self):
+        """ Catalog reads go to the primary only for REPLICA_PIN_SECONDS after a change. """
+        cache.clear()
+        aliases = []
+        with catalog.fresh():
+            aliases.append(router.db_for_read(Product))
+        catalog.invalidate_products()
+        with catalog.fresh():
+            aliases.append(router.db_for_read(Product))
+        with override_settings(REPLICA_PIN_SECONDS=-1):
+            catalog.invalidate_products()
+        with catalog.fresh():
+            aliases.append(router.db_for_read(Product))
+        self.assertEqual(aliases, [routers.REPLICA, 'default', routers.REPLICA])
+
+    def test_expired_pin(self):
+        """ Client is served from the replica again once the pin expires. """
+        aliases = []
+        self.request(lambda request: aliases.append(router.db_for_read(Cart)) or HttpResponse(),
+                     **{routers.PIN_COOKIE: str(int(time.time()) - 1)})
+        self.assertEqual(aliases, [routers.REPLICA])
+
+
+@skipUnless(routers.REPLICA in settings.DATABASES, 'Replica database is not configured (DATABASE_REPLICA_URL).')
+class TestReplicaDatabase(TransactionTestCase):
+    """ Tests requests against configured primary & replica databases. """
+    databases = {'default', routers.REPLICA}
+
+    def test_reads_of_client_use_replica(self):
+        """ Account page of client without recent writes is read from the replica. """
+        user = User.objects.create_user('test_user', password='12345')
+        client = Client()
+        client.force_login(user)
+        with CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+            self.assertEqual(client.get(reverse('logged')).status_code, 200)
+        self.assertTrue(replica.captured_queries)
+
+    def test_catalog_is_read_from_replica(self):
+        """ Cache misses of catalog pages are read from the replica when the catalog has not changed recently. """
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        product = Product.objects.create(category=category, product='Ryzen 5', price='799.00', stock=1)
+        cache.clear()
+        with CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+            self.assertContains(Client().get(reverse('product', kwargs={'pk': product.pk})), 'Ryzen 5')
+            self.assertContains(Client().get(reverse('category', kwargs={'slug': 'procesory'})), 'Ryzen 5')
+        self.assertTrue(replica.captured_queries)
+
+    def test_changed_catalog_is_read_from_primary(self):
+        """ Right after a change, cache misses are read from the primary, which the replica may lag behind. """
+        cache.clear()
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        product = Product.objects.create(category=category, product='Ryzen 5', price='799.00', stock=1)
+        with CaptureQueriesContext(connections[routers.REPLICA]) as replica:
+            self.assertContains(Client().get(reverse('product', kwargs={'pk': product.pk})), 'Ryzen 5')
+            Client().get(reverse('api-products'))
+        self.assertFalse(replica.captured_queries)
+
+
+class TestRecommendations(TestCase):
+    """ Tests "customers also bought" recommendations. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.user = User.objects.create_user('test_user', password='12345')
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(category=category, product=f'CPU {name}', price='100.00', stock=10)
+            for name in 'ABCD'
+        ]
+        for products in ((self.a, self.b), (self.a, self.b, self.c), (self.a, self.c)):
+            self.order(*products)
+        Cart.objects.create(user=self.user, product=self.a)
+        Cart.objects.create(user=self.user, product=self.d)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state = os.path.join(directory.name, 'recommendations.npz')
+
+    def order(self, *products):
+        """ Places order of `products`. """
+        order = Order.objects.create(user=self.user)
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=product, product_name=product.product, price=product.price, quantity=1)
+            for product in products
+        ])
+
+    def build(self):
+        """ Runs the command and returns its output. """
+        output = StringIO()
+        call_command('build_recommendations', state=self.state, stdout=output)
+        return output.getvalue()
+
+    def recommended(self, product):
+        """ Returns ids of products recommended for `product` by rank. """
+        return list(product.recommendations.order_by('rank').values_list('recommended_id', 'score'))
+
+    def test_build(self):
+        """ Products bought together with the product are recommended, the most frequent first. """
+        self.build()
+        self.assertEqual(self.recommended(self.a), [(self.b.id, 2), (self.c.id, 2), (self.d.id, 1)])
+        response = Client().get(reverse('product', kwargs={'pk': self.a.pk}))
+        self.assertContains(response, 'Klienci kupili również')
+        self.assertContains(response, 'CPU B')
+
+    def test_incremental_update(self):
+        """ Second run processes only new orders, missing state file triggers full rebuild. """
+        self.build()
+        self.order(self.c, self.d)
+        self.assertIn('Processed 2 order lines', self.build())
+        self.assertEqual(self.recommended(self.d), [(self.a.id, 1), (self.c.id, 1)])
+        os.remove(self.state)
+        self.assertIn('Processed 9 order lines', self.build())
+        self.assertEqual(self.recommended(self.c), [(self.a.id, 2), (self.b.id, 1), (self.d.id, 1)])
+
+    def test_late_commit_and_reserved_checkpoint(self):
+        """ Order committed after a newer one is added, export can not move the recommendations checkpoint. """
+        self.build()
+        last_id = Order.objects.order_by('-id').values_list('id', flat=True)[0]
+        order = Order.objects.create(id=last_id + 2, user=self.user)
+        OrderLine.objects.create(order=order, product=self.c, product_name='C', price=1, quantity=1)
+        OrderLine.objects.create(order=order, product=self.d, product_name='D', price=1, quantity=1)
+        self.build()
+        late = Order.objects.create(id=last_id + 1, user=self.user)
+        OrderLine.objects.create(order=late, product=self.b, product_name='B', price=1, quantity=1)
+        OrderLine.objects.create(order=late, product=self.d, product_name='D', price=1, quantity=1)
+        self.assertIn('Processed 2 order lines', self.build())
+        self.assertIn((self.b.id, 1), self.recommended(self.d))
+
+        staff = User.objects.create_user('staff_user', password='12345', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('export-orders'), {'checkpoint': recommendations.CHECKPOINT})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestRankings(TestCase):
+    """ Tests bestseller & trending rankings. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user('test_user', password='12345')
+        self.category = Category.objects.create(category='Procesory', slug='procesory')
+        other = Category.objects.create(category='Karty graficzne', slug='karty-graficzne')
+        self.old, self.new = [
+            Product.objects.create(category=self.category, product=name, price='100.00', stock=10)
+            for name in ('CPU stary', 'CPU nowy')
+        ]
+        self.gpu = Product.objects.create(category=other, product='GPU', price='100.00', stock=10)
+        self.today = timezone.localdate()
+
+    def test_checkout_updates_daily_sales(self):
+        """ Every order adds its quantities to today's row of the product. """
+        for quantity in (2, 3):
+            Cart.objects.create(user=self.user, product=self.new, quantity=quantity)
+            checkout.place_order(self.user)
+        jobs.run_pending()
+        self.assertEqual(
+            list(ProductSalesDaily.objects.values_list('product_id', 'day', 'quantity')),
+            [(self.new.id, self.today, 5)],
+        )
+
+    def test_recent_sales_weigh_more(self):
+        """ Trending ranks recent sales above bigger older ones, sales outside the window are ignored. """
+        rankings.record_sales({self.old.id: 10}, day=self.today - timedelta(days=5))
+        rankings.record_sales({self.new.id: 3, self.gpu.id: 1}, day=self.today)
+        rankings.record_sales({self.gpu.id: 100}, day=self.today - timedelta(days=40))
+        trending = [row['product_id'] for row in rankings.top('trending', today=self.today)]
+        self.assertEqual(trending, [self.new.id, self.old.id, self.gpu.id])
+        bestsellers = [row['product_id'] for row in rankings.top('bestsellers', self.category.id, today=self.today)]
+        self.assertEqual(bestsellers, [self.old.id, self.new.id])
+
+    def test_homepage_reads_cached_rankings(self):
+        """ Homepage lists popular products and reads rankings from the cache on the next request. """
+        rankings.record_sales({self.new.id: 1})
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Bestsellery')
+        self.assertContains(response, 'CPU nowy')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+        self.assertEqual(len(queries), 0)
+
+
+class TestJobs(TestCase):
+    """ Tests background jobs. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        self.user = User.objects.create_user('test_user', password='12345', email='test@example.com')
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        self.product = Product.objects.create(category=category, product='CPU', price='100.00', stock=10)
+        self.calls = []
+        jobs.HANDLERS['test_job'] = self.handler
+        self.addCleanup(jobs.HANDLERS.pop, 'test_job')
+
+    def handler(self, fail=False):
+        """ Records the call, raises error on request. """
+        self.calls.append(fail)
+        if fail:
+            raise ValueError('failed')
+
+    def test_checkout_leaves_email_to_worker(self):
+        """ Checkout only enqueues the confirmation e-mail, the worker sends it. """
+        Cart.objects.create(user=self.user, product=self.product)
+        order = checkout.place_order(self.user)
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(str(order.order_id), mail.outbox[0].subject)
+        self.assertFalse(Job.objects.exists())
+
+    def test_retry_with_backoff(self):
+        """ Failed job is retried later with growing delay and marked failed after the last attempt. """
+        job = jobs.enqueue('test_job', fail=True)
+        delays = []
+        for attempt in range(settings.JOB_MAX_ATTEMPTS):
+            self.assertEqual(jobs.run_pending(), (0, 1))
+            job.refresh_from_db()
+            delays.append(round((job.run_at - timezone.now()).total_seconds()))
+            Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        self.assertEqual(delays[:3], [settings.JOB_RETRY_DELAY * factor for factor in (1, 2, 4)])
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, settings.JOB_MAX_ATTEMPTS))
+        self.assertEqual(jobs.run_pending(), (0, 0))
+
+    def test_claimed_job_is_not_claimed_again(self):
+        """ Running job is claimed by another worker only after JOB_TIMEOUT. """
+        jobs.enqueue('test_job')
+        self.assertEqual(len(jobs.claim(10)), 1)
+        self.assertEqual(jobs.claim(10), [])
+        Job.objects.update(run_at=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1))
+        self.assertEqual(jobs.run_pending(), (1, 0))
+        self.assertEqual(self.calls, [False])
+
+
+class TestProductImages(TestCase):
+    """ Tests scaled down variants of product pictures. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = os.path.join(directory.name, 'variants')
+        settings_override = override_settings(MEDIA_ROOT=directory.name, PRODUCT_IMAGE_VARIANTS_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(category='Procesory', slug='procesory')
+
+    def picture(self, size, mode='RGB', extension='jpeg'):
+        """ Returns uploaded picture of given size. """
+        output = BytesIO()
+        Image.new(mode, size, 'red').save(output, format=extension)
+        return SimpleUploadedFile(f'photo.{extension}', output.getvalue())
+
+    def test_upload_generates_variants(self):
+        """ New picture is scaled down to every smaller width by a job & shown by the category page. """
+        product = Product.objects.create(category=self.category, product='CPU', price='100.00', stock=1,
+                                         picture=self.picture((1000, 500)))
+        jobs.run_pending()
+        product.refresh_from_db()
+        variants = product.picture_variants
+        self.assertEqual((variants['width'], variants['height']), (1000, 500))
+        self.assertEqual([width for width, url in variants['sources']['webp']], [200, 400, 800, 1000])
+        self.assertEqual(len(os.listdir(self.root)), 8)
+        with Image.open(os.path.join(self.root, os.path.basename(variants['sources']['jpeg'][0][1]))) as variant:
+            self.assertEqual(variant.size, (200, 100))
+        response = Client().get(reverse('category', kwargs={'slug': 'procesory'}))
+        self.assertContains(response, f'{variants["sources"]["webp"][0][1]} 200w')
+
+    def test_transparent_picture(self):
+        """ Small transparent picture gets one WebP and one PNG variant of its own size. """
+        product = Product.objects.create(category=self.category, product='CPU', price='100.00', stock=1,
+                                         picture=self.picture((120, 80), mode='RGBA', extension='png'))
+        images.generate(product.id)
+        product.refresh_from_db()
+        self.assertEqual(sorted(product.picture_variants['sources']), ['png', 'webp'])
+        variants = product.picture_variants
+        self.assertEqual(images.fallback(variants, 200), ('png', variants['sources']['png'][0][1]))
+
+    def test_regenerate_command(self):
+        """ Bulk regeneration fills missing variants, unchanged pictures keep their names. """
+        product = Product.objects.create(category=self.category, product='CPU', price='100.00', stock=1,
+                                         picture=self.picture((500, 500)))
+        Job.objects.all().delete()
+        output = StringIO()
+        call_command('regenerate_images', workers=1, stdout=output)
+        self.assertIn('Generated variants of 1 pictures, 0 failed.', output.getvalue())
+        product.refresh_from_db()
+        variants = product.picture_variants
+        call_command('regenerate_images', workers=1, stdout=output)
+        self.assertIn('Generated variants of 0 pictures', output.getvalue())
+        call_command('regenerate_images', all=True, workers=1, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.picture_variants, variants)
+
+
+class TestSharedPages(TestCase):
+    """ Tests pages cached by reverse proxies & the user fragment. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.user = User.objects.create_user('test_user', password='12345')
+        category = Category.objects.create(category='Procesory', slug='procesory')
+        self.product = Product.objects.create(category=category, product='CPU', price='100.00', stock=1)
+        self.comment = Comment.objects.create(user=self.user, product=self.product, text='Polecam')
+        self.url = reverse('product', kwargs={'pk': self.product.pk})
+        self.logged = Client()
+        self.logged.force_login(self.user)
+
+    def test_page_is_shared(self):
+        """ Logged in user gets the same cacheable page as anonymous visitor, without cookies. """
+        anonymous = Client().get(self.url)
+        logged = self.logged.get(self.url)
+        self.assertEqual(anonymous.content, logged.content)
+        self.assertEqual(logged['Cache-Control'], f'public, max-age=0, s-maxage={settings.EDGE_CACHE_SECONDS}')
+        self.assertNotIn('Cookie', logged['Vary'])
+        self.assertFalse(logged.cookies)
+        self.assertNotContains(logged, 'csrfmiddlewaretoken')
+        self.assertTrue(logged.has_header('Last-Modified'))
+
+    def test_conditional_get(self):
+        """ Unchanged page is revalidated without queries, new comment changes its ETag. """
+        etag = Client().get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(queries)), (304, 0))
+        self.assertIn('s-maxage', response['Cache-Control'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.logged.post(self.url, {'text': 'Nowy komentarz'})
+        self.assertIn('?v=', response.url)
+        response = Client().get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Nowy komentarz')
+
+    def test_user_fragment(self):
+        """ Fragment contains user's links, comment form & ids of own comments and is never cached. """
+        response = self.logged.get(reverse('user-fragment'), {'product': self.product.pk})
+        fragment = response.json()
+        self.assertIn('Wyloguj', fragment['nav'])
+        self.assertIn('csrfmiddlewaretoken', fragment['comment_form'])
+        self.assertEqual(fragment['own_comments'], [self.comment.id])
+        self.assertIn('private', response['Cache-Control'])
+        fragment = self.logged.get(reverse('user-fragment'), {'product': '²'}).json()
+        self.assertEqual((fragment['comment_form'], fragment['own_comments']), ('', []))
+        fragment = Client().get(reverse('user-fragment'), {'product': self.product.pk}).json()
+        self.assertEqual((fragment['comment_form'], fragment['own_comments']), ('', []))
+        self.assertIn('Rejestracja', fragment['nav'])
+
+    @override_settings(EDGE_CACHE_ENABLED=True)
+    def test_edge_cache_middleware(self):
+        """ Shared page is served from the cache by the middleware, the user fragment is not. """
+        client = Client()
+        self.assertEqual(client.get(self.url)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(self.url)
+        self.assertEqual((response['X-Cache'], len(queries)), ('HIT', 0))
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertFalse(client.get(reverse('user-fragment')).has_header('X-Cache'))
+
+
+@override_settings(API_PAGE_SIZE=2)
+class TestApi(TestCase):
+    """ Tests read-only JSON API. """
+
+    def setUp(self):
+        """ Data for further tests. """
+        cache.clear()
+        self.user = User.objects.create_user('test_user', password='12345')
+        self.category = Category.objects.create(category='Procesory', slug='procesory')
+        self.products = [
+            Product.objects.create(category=self.category, product=f'CPU {number}', description='Opis', price=price)
+            for number, price in enumerate(['300.00', '100.00', '200.00'])
+        ]
+
+    def test_products_pages(self):
+        """ Pages follow each other by cursors and contain selected fields only, read by a single query. """
+        url = reverse('api-products')
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get(url, {'sort': 'price', 'fields': 'id,product'}).json()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0]['sql'])
+        self.assertEqual(page['results'], [
+            {'id': self.products[1].id, 'product': 'CPU 1'},
+            {'id': self.products[2].id, 'product': 'CPU 2'},
+        ])
+        page = self.client.get(page['next']).json()
+        self.assertEqual((page['results'], page['next']), ([{'id': self.products[0].id, 'product': 'CPU 0'}], None))
+        product = self.client.get(url, {'category': self.category.id}).json()['results'][0]
+        self.assertEqual(product['price'], '300.00')
+        self.assertNotIn('description', product)
+
+    def test_invalid_parameters(self):
+        """ Unknown fields, sorts, malformed cursors & limits are rejected. """
+        url = reverse('api-products')
+        tampered = pagination.encode_cursor(['2024-01-01'])
+        for params in ({'fields': 'id,stock'}, {'sort': 'stock'}, {'cursor': 'x'}, {'cursor': tampered},
+                       {'limit': '0'}, {'limit': '²'}, {'category': 'a'}, {'category': '²'}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        self.assertEqual(self.client.get(reverse('api-product', kwargs={'pk': 0})).status_code, 404)
+        self.assertEqual(self.client.get(url, {'category': '9' * 20}).json()['results'], [])
+
+    def test_etag(self):
+        """ Unchanged product is revalidated without queries, its change makes a new ETag. """
+        url = reverse('api-product', kwargs={'pk': self.products[0].id})
+        response = self.client.get(url)
+        self.assertEqual(response.json()['description'], 'Opis')
+        self.assertIn('s-maxage', response['Cache-Control'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, len(queries)), (304, 0))
+        self.products[0].price = '250.00'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['price'], '250.00')
+
+    def test_comments(self):
+        """ Comments are listed the newest first, a new comment changes ETag of the list. """
+        product = self.products[0]
+        for days in range(3):
+            Comment.objects.create(user=self.user, product=product, text=f'Komentarz {days}',
+                                   text_date=timezone.now() - timedelta(days=days))
+        url = reverse('api-comments', kwargs={'pk': product.id})
+        response = self.client.get(url, {'fields': 'text,username'})
+        page = response.json()
+        self.assertEqual(page['results'][0], {'text': 'Komentarz 0', 'username': 'test_user'})
+        self.assertEqual(
+            self.client.get(page['next']).json()['results'], [{'text': 'Komentarz 2', 'username': 'test_user'}],
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(user=self.user, product=product, text='Nowy')
+        response = self.client.get(url, {'fields': 'text,username'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['results'][0]['text'], 'Nowy')
@@ -1,21 +1,45 @@
+import re
+import time
+import uuid
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 
+from . import cart, catalog, checkout, edge, exports, facets, inventory, jobs, rankings, search
 from .forms import AddAddressForm, AddCommentForm, ChangePasswordForm, LoginForm, ProfileForm, UpdateProfileForm, \
     UpdateUserForm, UserForm
-from .models import Address, Cart, Comment, Product, Profile, Order
+from .models import Address, Cart, Comment, Product, Profile, Order, OrderLine
+from .pagination import InvalidCursor, paginate
 
 
 class HomeView(View):
     """ Displays homepage. """
 
+    @method_decorator(edge.shared_page)
     def get(self, request):
-        """ Home view. """
-        return render(request=request, template_name="home.html")
+        """ Home view with bestsellers & products trending this week. """
+        context = {
+            'rankings': _rankings(catalog.popular_products()),
+        }
+        return render(request=request, template_name="home.html", context=context)
+
+
+def _rankings(popular):
+    """ Returns [(title, products)] of rankings for templates. """
+    return [(ranking.title, popular[kind]) for kind, ranking in rankings.RANKINGS.items()]
 
 
 class RegistrationView(View):
@@ -43,6 +67,7 @@ class RegistrationView(View):
             profile.save()
             user.set_password(user.password)
             user.save()
+            jobs.enqueue('send_welcome_email', user_id=user.id)
         else:
             messages.error(request, 'Nie udało się założyć konta!')
             context = {
@@ -140,7 +165,12 @@ class LoginView(View):
             user = authenticate(username=username, password=password)
             if user is not None:
                 login(request, user)
-                return redirect('home')
+                response = redirect('home')
+                anonymous_cart = cart.read_cookie(request)
+                if anonymous_cart:
+                    cart.merge(user.id, anonymous_cart)
+                    cart.write_cookie(response, {})
+                return response
             else:
                 form.add_error(None, 'Niepoprawny login lub hasło!')
 
@@ -165,16 +195,47 @@ class LoggedView(LoginRequiredMixin, View):
     login_url = '/login/'
 
     def get(self, request, *args, **kwargs):
-        """ Displays user's data such as username, first name, address, ect. """
-        address_form = Address.objects.filter(profile_id=request.user.id).order_by('name')
-        order_form = Order.objects.filter(user_id=request.user.id).order_by('-order_date')
+        """
+        Displays user's data such as username, first name, address, ect. with one page of orders,
+        the newest first. Addresses are loaded separately by the page (see AddressListView).
+        """
+        try:
+            order_form = paginate(
+                Order.objects.filter(user_id=request.user.id).only('id', 'order_id', 'order_date'),
+                ('-order_date', 'id'),
+                cursor=request.GET.get('after'),
+                page_size=settings.ACCOUNT_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return redirect('logged')
         context = {
-            'address_form': address_form,
             'order_form': order_form,
         }
         return render(request=request, template_name="logged.html", context=context)
 
 
+class AddressListView(LoginRequiredMixin, View):
+    """ Page of user's addresses, rendered as HTML fragment loaded lazily by the account page. """
+
+    login_url = '/login/'
+
+    def get(self, request, *args, **kwargs):
+        """ Displays one page of addresses sorted by name. """
+        try:
+            address_form = paginate(
+                Address.objects.filter(profile__user_id=request.user.id).only('id', 'name'),
+                ('name', 'id'),
+                cursor=request.GET.get('after'),
+                page_size=settings.ACCOUNT_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return HttpResponseBadRequest()
+        context = {
+            'address_form': address_form,
+        }
+        return render(request=request, template_name="addresses.html", context=context)
+
+
 class AddressView(LoginRequiredMixin, View):
     """ Allows user to check the address details and to remove it if necessary. """
 
@@ -268,38 +329,73 @@ class ChangeAddressView(LoginRequiredMixin, View):
         return render(request=request, template_name="change_address.html", context=context)
 
 
-class CartView(LoginRequiredMixin, View):
+class CartView(View):
     """ Allows user to check the cart, remove products and to place the order. """
 
     login_url = '/login/'
 
     def get(self, request):
-        """ Displays products in the cart. """
-        form = Cart.objects.filter(user_id=request.user)
+        """ Displays products in the cart. Cart of anonymous visitor is read from the cookie. """
+        if request.user.is_authenticated:
+            form = Cart.objects.filter(user_id=request.user).select_related('product').order_by('id')
+        else:
+            lines = cart.read_cookie(request)
+            form = [
+                Cart(product=product, quantity=lines[product.id])
+                for product in Product.objects.filter(id__in=lines).only('id', 'product', 'price').order_by('id')
+            ]
         context = {
             'form': form,
+            'idempotency_key': uuid.uuid4(),
         }
         return render(request=request, template_name="cart.html", context=context)
 
     def post(self, request):
-        """ Creates order. NOT FINISHED"""
-        user = request.user.id
-        order = Order.objects.create(
-            user_id=user,
-        )
-        order.save()
-        return render(request=request, template_name="order_placed.html")
+        """ Creates order from the products in the cart. """
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), self.login_url)
+        try:
+            idempotency_key = uuid.UUID(request.POST.get('idempotency_key', ''))
+        except ValueError:
+            idempotency_key = None
+        try:
+            order = checkout.place_order(request.user, idempotency_key=idempotency_key)
+        except checkout.EmptyCartError:
+            messages.error(request, 'Koszyk jest pusty!')
+            return redirect('cart')
+        except checkout.UnavailableProductsError as error:
+            messages.error(request, f'Produkty niedostępne: {", ".join(error.products)}!')
+            return redirect('cart')
+        context = {
+            'order': order,
+        }
+        return render(request=request, template_name="order_placed.html", context=context)
 
 
-@login_required
 def add_to_cart(request, pk):
-    """ Adds product to the cart. """
-    user = request.user.id
-    product = get_object_or_404(Product, pk=pk)
-    Cart.objects.create(
-        product=product,
-        user_id=user,
-    )
+    """
+    Adds product to the cart. Optional `quantity` parameter sets number of added items.
+    Anonymous visitors' cart is kept in the cookie, without reserving stock.
+    """
+    product = get_object_or_404(Product.objects.only('id', 'available'), pk=pk)
+    quantity = cart.parse_quantity(request.POST.get('quantity') or request.GET.get('quantity'))
+    if quantity is None:
+        messages.error(request, f'Ilość musi być liczbą od 1 do {cart.MAX_QUANTITY}!')
+        return redirect('product', pk=pk)
+    if not request.user.is_authenticated:
+        lines = cart.add_to_cookie(cart.read_cookie(request), product.id, quantity) if product.available else None
+        if lines is None:
+            messages.error(request, 'Nie można dodać produktu do koszyka!')
+            return redirect('product', pk=pk)
+        messages.success(request, 'Dodano produkt do koszyka!')
+        response = redirect('product', pk=pk)
+        cart.write_cookie(response, lines)
+        return response
+    try:
+        cart.add_product(user_id=request.user.id, product_id=product.id, quantity=quantity)
+    except inventory.InsufficientStock:
+        messages.error(request, 'Brak wystarczającej ilości produktu w magazynie!')
+        return redirect('product', pk=pk)
     messages.success(request, 'Dodano produkt do koszyka!')
     return redirect('product', pk=pk)
 
@@ -307,76 +403,172 @@ def add_to_cart(request, pk):
 @login_required
 def remove_from_cart(request, cart_id):
     """ Removes product from the cart. """
-    cart = Cart.objects.get(user=request.user.id, id=cart_id)
-    cart.delete()
+    cart.remove_line(user_id=request.user.id, cart_id=cart_id)
     messages.success(request, 'Produkt został usunięty z koszyka!')
     return redirect('cart')
 
 
+def remove_from_anonymous_cart(request, pk):
+    """ Removes product from anonymous visitor's cart. """
+    lines = cart.read_cookie(request)
+    lines.pop(pk, None)
+    messages.success(request, 'Produkt został usunięty z koszyka!')
+    response = redirect('cart')
+    cart.write_cookie(response, lines)
+    return response
+
+
 class OrderView(LoginRequiredMixin, View):
-    """ Order details view.. """
+    """ Order details view. """
 
     login_url = '/login/'
 
-    def get(self, request, *args, **kwargs):
+    def get(self, request, order_id, *args, **kwargs):
         """ Displays order details. """
-        order_form = Order.objects.filter(user_id=request.user.id)
-        cart_form = Cart.objects.filter(user=request.user.id)
+        order = get_object_or_404(
+            Order.objects.prefetch_related(Prefetch('lines', queryset=OrderLine.objects.order_by('id'))),
+            order_id=order_id,
+            user=request.user,
+        )
+        total = sum(line.price * line.quantity for line in order.lines.all())
         context = {
-            'order_form': order_form,
-            'cart_form': cart_form,
+            'order': order,
+            'total': total,
         }
         return render(request=request, template_name="order.html", context=context)
 
 
-class CpuView(View):
-    """ CPUs view. """
+class OrderExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """ Streams order lines as CSV or JSON lines. Available only for staff. """
+
+    login_url = '/login/'
+
+    def test_func(self):
+        return self.request.user.is_staff
 
     def get(self, request):
-        """ Displays only products in CPU category(id=1). """
-        form = Product.objects.filter(category_id='1')
+        """
+        Exports order lines. Optional parameters: format (csv/jsonl), since & until (ISO dates),
+        checkpoint (name of incremental export - only orders placed after its previous run are included).
+        """
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in exports.FORMATS:
+            return HttpResponseBadRequest('Unknown format.')
+        try:
+            export = exports.OrderExport(
+                since=exports.parse_moment(request.GET.get('since')),
+                until=exports.parse_moment(request.GET.get('until'), end_of_day=True),
+                checkpoint=request.GET.get('checkpoint') or None,
+            )
+        except exports.InvalidExportParameter:
+            return HttpResponseBadRequest('Invalid date or checkpoint.')
+        response = StreamingHttpResponse(export.lines(export_format), content_type=exports.FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+
+# Categories of the old hard-coded urls /category/<slug>/.
+LEGACY_CATEGORY_IDS = {
+    'cpu': 1,
+    'gpu': 2,
+    'motherboards': 3,
+}
+
+
+class CategoryView(View):
+    """ Products of a single category. """
+
+    @method_decorator(edge.shared_page)
+    def get(self, request, slug):
+        """
+        Displays one page of filtered products in the category, sorted by name or price, with facets
+        and the category's bestsellers.
+        """
+        category = catalog.category_by_slug(slug)
+        if category is None:
+            return _legacy_category_redirect(slug)
+        sort = request.GET.get('sort', 'name')
+        if sort not in catalog.CATEGORY_SORTS:
+            sort = 'name'
+        filters = facets.parse_filters(request.GET)
+        filter_query = facets.signature(filters)
+        try:
+            form = catalog.category_page(category['id'], sort, filters, cursor=request.GET.get('after'))
+        except InvalidCursor:
+            return redirect(f"{reverse('category', kwargs={'slug': slug})}?sort={sort}&{filter_query}")
+        counts = catalog.category_facets(category['id'], filters)
         context = {
+            'category': category,
             'form': form,
+            'sort': sort,
+            'filter_query': filter_query,
+            'total': counts['total'],
+            'facets': facets.build(category, catalog.categories(), filters, counts),
+            'rankings': _rankings(catalog.popular_products(category['id'])),
         }
         return render(request=request, template_name="category.html", context=context)
 
 
-class GpuView(View):
-    """ GPUs view. """
+def _legacy_category_redirect(slug):
+    """
+    Permanently redirects old hard-coded category urls (e.g. /category/cpu/) to the slug based ones.
+    Used only when no category has that slug, so such a category is never shadowed.
+    """
+    category = catalog.category_by_id(LEGACY_CATEGORY_IDS.get(slug))
+    if category is None:
+        raise Http404
+    return redirect('category', slug=category['slug'], permanent=True)
+
+
+class SearchView(View):
+    """ Product search. """
 
     def get(self, request):
-        """ Displays only products in GPU category(id=2). """
-        form = Product.objects.filter(category_id='2')
+        """ Displays products matching the `q` parameter. """
+        query = request.GET.get('q', '').strip()
+        form = search.search_products(query) if query else []
         context = {
+            'query': query,
             'form': form,
         }
-        return render(request=request, template_name="category.html", context=context)
+        return render(request=request, template_name="search.html", context=context)
 
 
-class MotherboardView(View):
-    """ Motherboards view. """
+def _product_etag(request, pk):
+    """ Returns ETag of the product page built from its cached data. """
+    detail = catalog.product_detail(pk)
+    if detail is None:
+        return None
+    return edge.etag([detail, catalog.navigation()])
 
-    def get(self, request):
-        """ Displays only products in Motherboards category(id=3). """
-        form = Product.objects.filter(category_id='3')
-        context = {
-            'form': form,
-        }
-        return render(request=request, template_name="category.html", context=context)
+
+def _product_last_modified(request, pk):
+    """ Returns time of the last change of the product or its comments. """
+    detail = catalog.product_detail(pk)
+    if detail is None:
+        return None
+    return max([detail['product']['updated_at']] + [comment['text_date'] for comment in detail['comments']])
+
+
+def _fresh_product_url(pk):
+    """ Returns url of the product page which is not cached by proxies yet, so the user sees own change at once. """
+    return f"{reverse('product', kwargs={'pk': pk})}?v={time.time_ns()}"
 
 
 class ProductView(View):
     """ Product's details view. """
 
+    @method_decorator(edge.shared_page)
+    @method_decorator(condition(etag_func=_product_etag, last_modified_func=_product_last_modified))
     def get(self, request, pk):
-        """ Displays product details and comments section. """
-        product_form = Product.objects.filter(id=pk)
-        comment_form = Comment.objects.filter(product_id=pk).order_by('-text_date')
-        add_comment_form = AddCommentForm
+        """ Displays product details and comments section. Comment form is loaded from the user fragment. """
+        detail = catalog.product_detail(pk)
+        if detail is None:
+            raise Http404
         context = {
-            'product_form': product_form,
-            'comment_form': comment_form,
-            'add_comment_form': add_comment_form,
+            'product': detail['product'],
+            'comment_form': detail['comments'],
+            'recommendations': detail['recommendations'],
         }
         return render(request=request, template_name="product.html", context=context)
 
@@ -391,7 +583,34 @@ class ProductView(View):
                 text=text,
             )
             comment.save()
-        return redirect('product', pk=pk)
+            jobs.enqueue('warm_product', product_id=pk)
+        return redirect(_fresh_product_url(pk))
+
+
+@method_decorator(never_cache, name='dispatch')
+class UserFragmentView(View):
+    """ User specific parts of shared pages (see the edge module): navigation links, messages & comment form. """
+
+    def get(self, request):
+        """ Returns the parts as JSON. Optional `product` parameter adds the comment form & own comments' ids. """
+        product_id = request.GET.get('product', '')
+        own_comments = []
+        comment_form = ''
+        if request.user.is_authenticated and re.fullmatch('[0-9]+', product_id):
+            own_comments = list(
+                Comment.objects.filter(product_id=product_id, user_id=request.user.id).values_list('id', flat=True)
+            )
+            comment_form = render_to_string(
+                'comment_form.html',
+                {'product_id': product_id, 'add_comment_form': AddCommentForm()},
+                request=request,
+            )
+        return JsonResponse({
+            'nav': render_to_string('user_nav.html', request=request),
+            'messages': render_to_string('messages.html', request=request),
+            'comment_form': comment_form,
+            'own_comments': own_comments,
+        })
 
 
 @login_required
@@ -400,4 +619,4 @@ def remove_comment(request, comment_id, pk):
     comment = Comment.objects.get(user=request.user.id, id=comment_id)
     comment.delete()
     messages.success(request, 'Komentarz został usunięty!')
-    return redirect('product', pk=pk)
+    return redirect(_fresh_product_url(pk))